@@ -0,0 +1,187 @@
+import math
+import os
+
+try:
+    import numpy as np
+except ImportError:  # only AGG needs NumPy; the rest of the program runs without it
+    np = None
+
+from btree import directory_size, record_size, rid_page
+
+# Vectorized aggregates over the data file.
+#
+# The data file is memory-mapped as an array of pages, each page a record
+# count, an array of record slots and the slot directory, so a column of a
+# whole chunk of pages is one NumPy array, masked by the directories. Cached
+# pages replace their disk version (the page cache is write-back) and pages
+# that only exist in the cache are included.
+# Each chunk is read under the data file latch, so no record is half written.
+#
+# Columns are the record fields p_a, p_b and p_aub, and p_aib, the
+# intersection P(A∩B) = P(A) + P(B) - P(A∪B) they imply.
+
+COLUMNS = ("p_a", "p_b", "p_aub", "p_aib")
+AGG_CHUNK_PAGES = 4096
+# Slack allowed by the consistency checks for rounding of the stored values
+TOLERANCE = 1e-9
+
+
+def page_dtype(page_size, max_records):
+    """
+    Layout of a data page: a 4-byte count, the record slots, packed with
+    record_format, and the slot directory at the end.
+    """
+    record = np.dtype({"names": ["key", "p_a", "p_b", "p_aub"],
+                       "formats": [np.int32, np.float64, np.float64, np.float64],
+                       "offsets": [0, 8, 16, 24], "itemsize": record_size})
+    size = directory_size(max_records)
+    return np.dtype({"names": ["count", "records", "directory"],
+                     "formats": [np.int32, (record, max_records), (np.uint8, size)],
+                     "offsets": [0, 4, page_size - size], "itemsize": page_size})
+
+
+def page_chunks(tree, page_nums=None):
+    """
+    Yield the pages of the data file as structured arrays of at most AGG_CHUNK_PAGES pages.
+
+    Parameters:
+    - tree (BTree): The open tree.
+    - page_nums (list): Page numbers to read, all pages by default.
+    """
+    dtype = page_dtype(tree.page_size, tree.max_records_per_page)
+    with tree.data_file_latch:
+        disk_pages = tree_file_pages(tree)
+        with tree.page_cache_latch:
+            cached_end = max(tree.page_cache, default=-1) + 1
+    if page_nums is None:
+        page_nums = range(max(disk_pages, cached_end))
+    page_nums = np.asarray(page_nums, dtype=np.int64)
+
+    for start in range(0, len(page_nums), AGG_CHUNK_PAGES):
+        nums = page_nums[start:start + AGG_CHUNK_PAGES]
+        with tree.data_file_latch:
+            # The file only grows while the tree is open; map what it holds now
+            disk_pages = tree_file_pages(tree)
+            chunk = np.zeros(len(nums), dtype=dtype)
+            on_disk = nums < disk_pages
+            if on_disk.any():
+                pages = np.memmap(tree.files["main_file"], dtype=dtype, mode="r", shape=(disk_pages,))
+                chunk[on_disk] = pages[nums[on_disk]]
+                del pages
+                loaded = int(on_disk.sum())
+                tree.add_counters(pages_loaded_from_disk=loaded, bytes_read=loaded * tree.page_size)
+            with tree.page_cache_latch:
+                for i, page_num in enumerate(nums.tolist()):
+                    data = tree.page_cache.get(page_num)  # get() leaves the LRU order alone
+                    if data is not None:
+                        chunk[i] = np.frombuffer(data, dtype=dtype, count=1)[0]
+        yield chunk
+
+
+def tree_file_pages(tree):
+    return os.path.getsize(tree.files["main_file"]) // tree.page_size
+
+
+def chunk_records(chunk, max_records, key_range=None):
+    """
+    The records held by a chunk of pages, as one flat structured array.
+    """
+    held = np.unpackbits(chunk["directory"], axis=1, count=max_records, bitorder="little").astype(bool)
+    # Pages from before the slot directory hold their records in the first slots
+    legacy = ~held.any(axis=1)
+    counts = np.clip(chunk["count"], 0, max_records)
+    held[legacy] = (np.arange(max_records) < counts[:, None])[legacy]
+    records = chunk["records"][held]
+    if key_range is not None:
+        lo, hi = key_range
+        records = records[(records["key"] >= lo) & (records["key"] <= hi)]
+    return records
+
+
+def column_values(records, column):
+    if column == "p_aib":
+        return records["p_a"] + records["p_b"] - records["p_aub"]
+    return records[column]
+
+
+def count_violations(records):
+    """
+    Records whose probabilities cannot all hold at once: a value outside [0, 1],
+    or P(A∪B) outside [max(P(A), P(B)), P(A) + P(B)], which puts the implied
+    P(A∩B) outside [0, min(P(A), P(B))].
+    """
+    p_a, p_b, p_aub = records["p_a"], records["p_b"], records["p_aub"]
+    out_of_range = ((p_a < -TOLERANCE) | (p_a > 1 + TOLERANCE) | (p_b < -TOLERANCE) | (p_b > 1 + TOLERANCE)
+                    | (p_aub < -TOLERANCE) | (p_aub > 1 + TOLERANCE))
+    inconsistent = (p_aub < np.maximum(p_a, p_b) - TOLERANCE) | (p_aub > p_a + p_b + TOLERANCE)
+    return int((out_of_range | inconsistent).sum())
+
+
+def aggregate(tree, column, key_range=None, bins=10, low=0.0, high=1.0):
+    """
+    Compute every aggregate of a column in one pass over the data file.
+
+    A key range is looked up in the tree first, so only the pages holding
+    its records are read.
+
+    Parameters:
+    - tree (BTree): The open tree.
+    - column (str): One of COLUMNS.
+    - key_range (tuple): (low_key, high_key) to restrict the records, inclusive.
+    - bins (int): Number of histogram bins between low and high.
+    - low, high (float): Range of the histogram.
+
+    Returns:
+    - dict: column, count, sum, avg, min, max, histogram (list of
+      (bin low, bin high, count)), below and above (values outside the
+      histogram range), violations (records failing count_violations) and
+      pages (pages read).
+    """
+    if np is None:
+        raise RuntimeError("AGG needs NumPy (pip install numpy).")
+    if column not in COLUMNS:
+        raise ValueError(f"Unknown column {column}; columns are {', '.join(COLUMNS)}.")
+    if bins < 1 or not low < high:
+        raise ValueError("A histogram needs at least one bin and low < high.")
+
+    page_nums = None
+    edges = np.linspace(low, high, bins + 1)
+    histogram = np.zeros(bins, dtype=np.int64)
+    count = below = above = violations = pages = 0
+    total = 0.0
+    minimum, maximum = math.inf, -math.inf
+    # VACUUM moves records between pages; it waits for the whole pass, writers do not
+    tree.write_gate.acquire_read()
+    try:
+        if key_range is not None:
+            page_nums = sorted({rid_page(rid) for _, rid in tree.range_search(*key_range)})
+        for chunk in page_chunks(tree, page_nums):
+            pages += len(chunk)
+            records = chunk_records(chunk, tree.max_records_per_page, key_range)
+            if not len(records):
+                continue
+            values = column_values(records, column)
+            count += len(values)
+            total += float(values.sum())
+            minimum = min(minimum, float(values.min()))
+            maximum = max(maximum, float(values.max()))
+            histogram += np.histogram(values, bins=edges)[0]
+            below += int((values < low).sum())
+            above += int((values > high).sum())
+            violations += count_violations(records)
+    finally:
+        tree.write_gate.release()
+
+    return {
+        "column": column,
+        "count": count,
+        "sum": total,
+        "avg": total / count if count else None,
+        "min": minimum if count else None,
+        "max": maximum if count else None,
+        "histogram": [(float(edges[i]), float(edges[i + 1]), int(histogram[i])) for i in range(bins)],
+        "below": below,
+        "above": above,
+        "violations": violations,
+        "pages": pages,
+    }
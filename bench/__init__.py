@@ -0,0 +1,2 @@
+from .runner import run_workload
+from .workloads import WORKLOADS
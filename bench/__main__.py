@@ -0,0 +1,45 @@
+import argparse
+import json
+import sys
+
+from btree import BTreeConfig
+
+from .runner import run_workload
+from .workloads import WORKLOADS
+
+# python -m bench [workload ...] --ops 2000 --seed 1 --output results.json
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run named B-tree workloads and report them as JSON")
+    parser.add_argument('workloads', nargs='*', metavar='workload',
+                        help=f'Workloads to run, from: {", ".join(WORKLOADS)} (default: all)')
+    parser.add_argument('--ops', type=int, default=1000, help='Measured operations per workload')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--d', type=int, default=2, help='Minimum degree of the tree')
+    parser.add_argument('--cache-size', type=int, default=0, help='Node cache size')
+    parser.add_argument('--page-cache-size', type=int, default=10, help='Page cache size')
+    parser.add_argument('--split-policy', choices=["classic", "bstar"], default="classic")
+    parser.add_argument('--placement', choices=BTreeConfig.PLACEMENTS, default="first_fit")
+    parser.add_argument('--page-fill', type=float, default=1.0, help='Data page fill of VACUUM and RESTORE')
+    parser.add_argument('--record-cache-size', type=int, default=0, help='Record cache size (0: no cache)')
+    parser.add_argument('--output', help='Write the results to this file instead of stdout')
+    args = parser.parse_args()
+    if args.ops < 1:
+        parser.error("--ops must be at least 1")
+    unknown = [name for name in args.workloads if name not in WORKLOADS]
+    if unknown:
+        parser.error(f"unknown workload(s): {', '.join(unknown)}")
+
+    results = []
+    for name in args.workloads or list(WORKLOADS):
+        result = run_workload(name, args.ops, args.seed, args.d, args.cache_size, args.page_cache_size,
+                              args.split_policy, args.placement, args.page_fill, args.record_cache_size)
+        results.append(result)
+        print(f"{name:>12}: {result['ops_per_s']:>10} ops/s, p99 {result['latency_us']['p99']} us", file=sys.stderr)
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
@@ -0,0 +1,132 @@
+import contextlib
+import io
+import os
+import random
+import subprocess
+import tempfile
+import time
+
+import btree
+from btree import BTree, BTreeConfig
+
+from .workloads import WORKLOADS
+
+BASE_NAME = "bench"
+
+
+class NullOutput(io.TextIOBase):
+    # main prints on every operation; writing it anywhere would be timed too
+    def write(self, text):
+        return len(text)
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(btree.__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_op(op, tree):
+    kind = op[0]
+    if kind == "insert":
+        tree.insert_key(op[1], (0.5, 0.25, 0.75))
+    elif kind == "search":
+        tree.search_key(op[1], None)
+    elif kind == "get":
+        tree.get_record(op[1])
+    elif kind == "update":
+        tree.update_record(op[1], 0.25, 0.5, 0.75)
+    elif kind == "delete":
+        tree.delete_key(op[1])
+    elif kind == "range":
+        for key, page_num in tree.range_search(op[1], op[2]):
+            tree.read_record(key, page_num)
+    elif kind == "load":
+        tree.load(BASE_NAME)
+    elif kind == "vacuum":
+        tree.vacuum()
+    else:
+        raise ValueError(f"Unknown operation {kind}")
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def run_workload(name, ops=1000, seed=1, d=2, cache_size=0, page_cache_size=10, split_policy="classic",
+                 placement="first_fit", page_fill=1.0, record_cache_size=0):
+    """
+    Run one named workload on a fresh tree in a temporary directory.
+
+    The setup operations (e.g. preloading keys) are not measured; the caches
+    are flushed and the counters reset before the measured part starts. The
+    measured time includes a final flush, so write-back caches are not
+    credited with writes they merely postponed.
+
+    Returns:
+    - dict: Configuration, wall time, ops/s, latency percentiles in
+      microseconds, the I/O counters of the measured part, the clustering
+      of the data file at the end (BTree.clustering) and the record cache
+      figures, None without a cache.
+    """
+    config = {"d": d, "cache_size": cache_size, "page_cache_size": page_cache_size, "split_policy": split_policy,
+              "placement": placement, "page_fill": page_fill, "record_cache_size": record_cache_size}
+    setup, measured = WORKLOADS[name](random.Random(seed), ops)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix=f"bench_{name}_") as workdir, \
+            contextlib.redirect_stdout(NullOutput()):
+        os.chdir(workdir)
+        try:
+            tree = BTree(BTreeConfig(**config))
+            tree.create(BASE_NAME)
+            for op in setup:
+                run_op(op, tree)
+            tree.flush_caches()
+            tree.reset_counters()
+
+            latencies = []
+            start = time.perf_counter()
+            for op in measured:
+                op_start = time.perf_counter_ns()
+                run_op(op, tree)
+                latencies.append(time.perf_counter_ns() - op_start)
+            tree.flush_caches()
+            wall_time = time.perf_counter() - start
+            counters = tree.counter_values()
+            clustering = tree.clustering()
+            record_cache = tree.record_cache.summary() if tree.record_cache is not None else None
+            tree.close()
+        finally:
+            os.chdir(cwd)
+
+    latencies.sort()
+    return {
+        "workload": name,
+        "seed": seed,
+        "ops": len(measured),
+        "config": config,
+        "revision": git_revision(),
+        "wall_time_s": round(wall_time, 6),
+        "ops_per_s": round(len(measured) / wall_time, 2) if wall_time > 0 else None,
+        "latency_us": {
+            "p50": round(percentile(latencies, 0.50) / 1000, 2),
+            "p99": round(percentile(latencies, 0.99) / 1000, 2),
+            "max": round(latencies[-1] / 1000, 2) if latencies else 0.0,
+        },
+        "io": {
+            "node_reads": counters["nodes_loaded_from_disk"],
+            "node_writes": counters["nodes_saved_to_disk"],
+            "node_cache_hits": counters["nodes_loaded_from_cache"],
+            "page_reads": counters["pages_loaded_from_disk"],
+            "page_writes": counters["pages_saved_to_disk"],
+            "page_cache_hits": counters["pages_loaded_from_cache"],
+            "metadata_reads": counters["metadata_loaded"],
+            "metadata_writes": counters["metadata_saved"],
+        },
+        "clustering": clustering,
+        "record_cache": record_cache,
+    }
@@ -0,0 +1,123 @@
+import bisect
+import itertools
+
+# Each workload turns (rng, ops) into two lists of operations: the setup run
+# before measuring, and the measured operations. An operation is a tuple:
+#   ("insert", key)  ("search", key)  ("get", key)  ("update", key)
+#   ("delete", key)  ("range", low, high)  ("load",)  ("vacuum",)
+# "search" descends to the key; "get" reads the record, through the record cache.
+# Keys are drawn from [1, KEY_SPACE * ops] so the tree size follows ops.
+
+KEY_SPACE = 10
+
+
+def sequential(rng, ops):
+    """Inserts in ascending key order, the append pattern of time-ordered keys."""
+    return [], [("insert", k) for k in range(1, ops + 1)]
+
+
+def uniform(rng, ops):
+    """Inserts of distinct keys in uniformly random order."""
+    return [], [("insert", k) for k in rng.sample(range(1, KEY_SPACE * ops + 1), ops)]
+
+
+def zipf(rng, ops, s=1.1):
+    """
+    Searches (80%) and updates (20%) on a preloaded tree, with the key
+    popularity following a Zipf distribution of exponent s.
+    """
+    keys = rng.sample(range(1, KEY_SPACE * ops + 1), ops)
+    # Popularity rank is independent of key order
+    cumulative = list(itertools.accumulate(1 / rank ** s for rank in range(1, ops + 1)))
+    measured = []
+    for _ in range(ops):
+        key = keys[bisect.bisect_left(cumulative, rng.random() * cumulative[-1])]
+        measured.append(("search", key) if rng.random() < 0.8 else ("update", key))
+    return [("insert", k) for k in keys], measured
+
+
+def hot_records(rng, ops, s=1.1):
+    """
+    Record reads on a preloaded tree: 70% of Zipf-popular keys, 20% of
+    uniformly random keys, read once and never again, and 10% updates of
+    Zipf-popular keys.
+    """
+    keys = rng.sample(range(1, KEY_SPACE * ops + 1), ops)
+    cumulative = list(itertools.accumulate(1 / rank ** s for rank in range(1, ops + 1)))
+    measured = []
+    for _ in range(ops):
+        key = keys[bisect.bisect_left(cumulative, rng.random() * cumulative[-1])]
+        roll = rng.random()
+        if roll < 0.7:
+            measured.append(("get", key))
+        elif roll < 0.9:
+            measured.append(("get", rng.choice(keys)))
+        else:
+            measured.append(("update", key))
+    return [("insert", k) for k in keys], measured
+
+
+def read_heavy(rng, ops):
+    """95% searches of existing keys, 5% inserts of new keys."""
+    space = rng.sample(range(1, KEY_SPACE * ops + 1), ops + ops // 10 + 1)
+    keys, fresh = space[:ops], iter(space[ops:])
+    measured = [("search", rng.choice(keys)) if rng.random() < 0.95 else ("insert", next(fresh))
+                for _ in range(ops)]
+    return [("insert", k) for k in keys], measured
+
+
+def delete_heavy(rng, ops):
+    """70% deletes of existing keys, 30% inserts of new keys."""
+    space = rng.sample(range(1, KEY_SPACE * ops + 1), 2 * ops)
+    keys, fresh = space[:ops], iter(space[ops:])
+    victims = iter(rng.sample(keys, ops))
+    measured = [("delete", next(victims)) if rng.random() < 0.7 else ("insert", next(fresh))
+                for _ in range(ops)]
+    return [("insert", k) for k in keys], measured
+
+
+def range_queries(rng, ops, width):
+    """
+    ops // 10 (at least one) range scans of the given key width at random
+    positions of the key space. The width is cut to fit a small key space.
+    """
+    width = min(width, KEY_SPACE * ops - 1)
+    measured = []
+    for _ in range(ops // 10 or 1):
+        low = rng.randint(1, KEY_SPACE * ops - width)
+        measured.append(("range", low, low + width))
+    return measured
+
+
+def range_scan(rng, ops, width=KEY_SPACE * 20):
+    """Range scans of a fixed key width (about 20 records each) on a preloaded tree."""
+    keys = rng.sample(range(1, KEY_SPACE * ops + 1), ops)
+    return [("insert", k) for k in keys], range_queries(rng, ops, width)
+
+
+def clustered_range(rng, ops, width=KEY_SPACE * 20):
+    """
+    Range scans on a tree that was vacuumed into key order and then got half
+    as many records again in random key order, as the placement left them.
+    """
+    space = rng.sample(range(1, KEY_SPACE * ops + 1), ops + ops // 2)
+    setup = [("insert", k) for k in space[:ops]] + [("vacuum",)] + [("insert", k) for k in space[ops:]]
+    return setup, range_queries(rng, ops, width)
+
+
+def bulk_load(rng, ops):
+    """Rebuild the tree from a data file of ops records (LOAD)."""
+    return [("insert", k) for k in rng.sample(range(1, KEY_SPACE * ops + 1), ops)], [("load",)]
+
+
+WORKLOADS = {
+    "sequential": sequential,
+    "uniform": uniform,
+    "zipf": zipf,
+    "hot_records": hot_records,
+    "read_heavy": read_heavy,
+    "delete_heavy": delete_heavy,
+    "range": range_scan,
+    "clustered_range": clustered_range,
+    "bulk_load": bulk_load,
+}
@@ -0,0 +1,80 @@
+import argparse
+import contextlib
+import io
+import os
+import random
+import tempfile
+import threading
+import time
+
+import btree
+from btree import BTree, BTreeConfig
+
+# Concurrent SEARCH benchmark: builds a tree, then runs random searches with an
+# increasing number of threads. --io-delay adds a fixed latency to every node
+# read from disk, standing in for a slow device.
+
+
+def build_tree(num_keys, key_max, seed, cache_size):
+    rng = random.Random(seed)
+    tree = BTree(BTreeConfig(cache_size=cache_size))
+    with contextlib.redirect_stdout(io.StringIO()):
+        tree.create("bench")
+        for key in rng.sample(range(1, key_max + 1), num_keys):
+            tree.insert_key(key, (0.5, 0.5, 0.75))
+        tree.flush_caches()
+    return tree
+
+
+def install_io_delay(tree, delay):
+    """
+    Make every read-only open() of the node file inside btree sleep for delay seconds.
+    """
+    real_open = open
+
+    def delayed_open(path, mode="r", *args, **kwargs):
+        if path == tree.files['node_file'] and mode == "rb":
+            time.sleep(delay)
+        return real_open(path, mode, *args, **kwargs)
+
+    btree.open = delayed_open
+
+
+def run_searches(tree, num_threads, searches_per_thread, key_max, seed):
+    def worker(worker_seed):
+        rng = random.Random(worker_seed)
+        for _ in range(searches_per_thread):
+            tree.search_key(rng.randint(1, key_max), None)
+
+    threads = [threading.Thread(target=worker, args=(seed + i,)) for i in range(num_threads)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return num_threads * searches_per_thread / elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent SEARCH throughput benchmark")
+    parser.add_argument('--keys', type=int, default=2000, help='Number of keys in the tree')
+    parser.add_argument('--searches', type=int, default=500, help='Searches per thread')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, 8], help='Thread counts to measure')
+    parser.add_argument('--io-delay', type=float, default=0.0, help='Simulated latency of a node read, in seconds')
+    parser.add_argument('--cache-size', type=int, default=0, help='Node cache size')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix="bench_threads_"))
+    key_max = args.keys * 4
+    tree = build_tree(args.keys, key_max, args.seed, args.cache_size)
+    if args.io_delay > 0:
+        install_io_delay(tree, args.io_delay)
+
+    print(f"{'threads':>8} {'searches/s':>12} {'speedup':>8}")
+    baseline = None
+    for n in args.threads:
+        throughput = run_searches(tree, n, args.searches, key_max, args.seed)
+        baseline = baseline or throughput
+        print(f"{n:>8} {throughput:>12.1f} {throughput / baseline:>8.2f}")
@@ -0,0 +1,108 @@
+import math
+import threading
+
+# Counting Bloom filter over the keys of a tree.
+#
+# A definite miss lets SEARCH, UPDATE and DELETE of an absent key return
+# without reading any node. Every counter is a byte, so deleting a key is
+# decrementing its counters; a counter that reached 255 stays there, which
+# can only cost false positives.
+
+MASK64 = (1 << 64) - 1
+
+
+def mix64(x):
+    """
+    splitmix64 finalizer: spreads consecutive keys over the whole 64-bit range.
+    """
+    x = (x + 0x9E3779B97F4A7C15) & MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK64
+    return x ^ (x >> 31)
+
+
+class CountingBloomFilter:
+    """
+    Parameters:
+    - capacity (int): Number of keys the filter is sized for; past it the
+      false-positive rate grows and the owner should rebuild a larger filter.
+    - bits_per_key (int): Counters per key of capacity.
+    """
+
+    def __init__(self, capacity, bits_per_key):
+        self.capacity = capacity
+        self.size = max(64, capacity * bits_per_key)
+        self.hashes = max(1, round(bits_per_key * math.log(2)))
+        self.counters = bytearray(self.size)
+        self.count = 0
+        self.lock = threading.Lock()
+        # Lookups answered "absent" without a descent, and lookups let through
+        # for keys that turned out to be absent
+        self.negatives = 0
+        self.false_positives = 0
+        self.saved_reads = 0
+
+    def positions(self, key):
+        # Double hashing: the two 32-bit halves of one 64-bit hash
+        h = mix64(key)
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        with self.lock:
+            for p in self.positions(key):
+                if self.counters[p] < 255:
+                    self.counters[p] += 1
+            self.count += 1
+
+    def add_all(self, keys):
+        with self.lock:
+            counters = self.counters
+            for key in keys:
+                for p in self.positions(key):
+                    if counters[p] < 255:
+                        counters[p] += 1
+                self.count += 1
+
+    def remove(self, key):
+        """
+        Remove a key that was added; removing any other key corrupts the filter.
+        """
+        with self.lock:
+            for p in self.positions(key):
+                if 0 < self.counters[p] < 255:
+                    self.counters[p] -= 1
+            self.count -= 1
+
+    def might_contain(self, key):
+        counters = self.counters
+        return all(counters[p] for p in self.positions(key))
+
+    def record_negative(self, saved_reads):
+        with self.lock:
+            self.negatives += 1
+            self.saved_reads += saved_reads
+
+    def record_false_positive(self):
+        with self.lock:
+            self.false_positives += 1
+
+    def expected_fp_rate(self):
+        """
+        False-positive rate expected for the current number of keys.
+        """
+        return (1 - math.exp(-self.hashes * self.count / self.size)) ** self.hashes
+
+    def summary(self):
+        absent = self.negatives + self.false_positives
+        return {
+            "keys": self.count,
+            "capacity": self.capacity,
+            "counters": self.size,
+            "hashes": self.hashes,
+            "expected_fp_rate": round(self.expected_fp_rate(), 6),
+            "observed_fp_rate": round(self.false_positives / absent, 6) if absent else None,
+            "negatives": self.negatives,
+            "false_positives": self.false_positives,
+            "saved_reads": self.saved_reads,
+        }
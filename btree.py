@@ -0,0 +1,3162 @@
+import struct
+import os
+import bisect
+import random
+import math
+import json
+import functools
+from collections import OrderedDict, defaultdict
+import threading
+
+from bloom import CountingBloomFilter
+from metrics import Metrics, Tracer, timed_phase
+from record_cache import RecordCache
+from sketch import QuantileSketch, save_sketches
+
+# -----------------------------------------------------------
+# Record layout
+# -----------------------------------------------------------
+record_format = 'i d d d'  # key, P(A), P(B), P(AuB)
+record_size = struct.calcsize(record_format)
+# Probability fields of a record, in record order
+PROBABILITY_COLUMNS = ("p_a", "p_b", "p_aub")
+
+# Data pages are slotted: a count of the records held, max_records_per_page
+# record slots, and at the end of the page the slot directory, a bitmap of
+# the slots in use. A record keeps its slot until it is deleted, so the tree
+# points to records by record ID: the page number shifted left by SLOT_BITS,
+# plus the slot. Pages written before slots existed hold their count of
+# sorted records in the first slots and an empty directory, and read as such.
+SLOT_BITS = 8
+MAX_SLOTS = 1 << SLOT_BITS
+# A record ID is a non-negative int32 in the node file, so the data file can
+# have at most 2^23 pages: 2 GB at the default page size of 256 bytes.
+MAX_DATA_PAGES = 1 << (31 - SLOT_BITS)
+
+# Sequential-insert fast path: keys above max_key_hint always belong to the
+# rightmost leaf, so appends skip the root-to-leaf descent.
+# APPEND_SPLIT_FILL is the share of keys the left node keeps when the rightmost
+# node splits during an append run of at least APPEND_RUN_THRESHOLD inserts.
+APPEND_SPLIT_FILL = 0.9
+APPEND_RUN_THRESHOLD = 4
+
+# Whole-file scans read this many node slots or data pages at a time into a
+# buffer of their own, leaving the caches alone.
+SCAN_BLOCK_NODES = 256
+SCAN_BLOCK_PAGES = 256
+
+# Smallest number of keys the Bloom filter is sized for; a full filter is
+# rebuilt with twice the capacity.
+BLOOM_MIN_CAPACITY = 1024
+
+# EXPORT and RESTORE stream whole files through write buffers of this size, and
+# EXPORT keeps at most EXPORT_PAGE_BUFFER data pages in memory.
+BULK_BUFFER_BYTES = 1 << 20
+EXPORT_PAGE_BUFFER = 64
+
+# VACUUM moves at most this many records per step; writers wait only for a step.
+VACUUM_STEP_RECORDS = 1024
+
+
+# -----------------------------------------------------------
+# Configuration
+# -----------------------------------------------------------
+class BTreeConfig:
+    """
+    Tuning of one tree.
+
+    d and page_size fix the layout of the files, so they are stored with the
+    tree (<base_name>_config.json) and a loaded tree keeps the values it was
+    created with. The other fields only affect the running process.
+
+    Parameters:
+    - d (int): Minimum degree; nodes hold d to 2d keys.
+    - page_size (int): Size of a data page in bytes.
+    - cache_size (int): Number of cached nodes.
+    - page_cache_size (int): Number of cached data pages.
+    - split_policy (str): "classic" splits the overflown node into two half-full
+      nodes, "bstar" splits it and a full sibling into three nodes.
+    - fill_factor (float): Target occupancy of the nodes produced by a "bstar" split
+      and by RESTORE.
+    - bloom_bits_per_key (int): Counters per key of the Bloom filter that answers
+      lookups of absent keys without a descent; 0 disables the filter.
+    - hash_index (bool): Keep a key -> record ID hash index in memory, so point
+      reads and updates go to their page without descending the tree.
+    - placement (str): Data page of a new record: "first_fit" takes the lowest
+      numbered page with a free slot, "neighbour" the page of a neighbouring
+      key in the leaf if it has room, else the free page nearest to it.
+    - page_fill (float): Share of the record slots of each data page that
+      VACUUM and RESTORE fill; the rest is left to new records placed next
+      to their key neighbours.
+    - record_cache_size (int): Number of records kept in memory for point reads
+      of hot keys, admitted by how often their key is read; 0 disables the cache.
+    """
+    STORED_FIELDS = ("d", "page_size")
+    PLACEMENTS = ("first_fit", "neighbour")
+
+    def __init__(self, d=2, page_size=256, cache_size=0, page_cache_size=10, split_policy="classic",
+                 fill_factor=2 / 3, bloom_bits_per_key=10, hash_index=False, placement="first_fit",
+                 page_fill=1.0, record_cache_size=0):
+        self.d = d
+        self.page_size = page_size
+        self.cache_size = cache_size
+        self.page_cache_size = page_cache_size
+        self.split_policy = split_policy
+        self.fill_factor = fill_factor
+        self.bloom_bits_per_key = bloom_bits_per_key
+        self.hash_index = hash_index
+        self.placement = placement
+        self.page_fill = page_fill
+        self.record_cache_size = record_cache_size
+
+    def to_dict(self):
+        return {
+            "d": self.d,
+            "page_size": self.page_size,
+            "cache_size": self.cache_size,
+            "page_cache_size": self.page_cache_size,
+            "split_policy": self.split_policy,
+            "fill_factor": self.fill_factor,
+            "bloom_bits_per_key": self.bloom_bits_per_key,
+            "hash_index": self.hash_index,
+            "placement": self.placement,
+            "page_fill": self.page_fill,
+            "record_cache_size": self.record_cache_size,
+        }
+
+    def copy(self):
+        return BTreeConfig(**self.to_dict())
+
+    def update(self, values):
+        """
+        Set the fields present in values, e.g. a dict read from a config file.
+        """
+        unknown = set(values) - set(self.to_dict())
+        if unknown:
+            raise ValueError(f"Unknown configuration fields: {', '.join(sorted(unknown))}")
+        for name, value in values.items():
+            setattr(self, name, value)
+
+    @staticmethod
+    def from_file(path):
+        """
+        Read a configuration from a JSON object; missing fields keep their defaults.
+        """
+        with open(path) as f:
+            config = BTreeConfig()
+            config.update(json.load(f))
+        return config
+
+    def validate(self):
+        if self.d < 1:
+            raise ValueError("The degree d must be at least 1.")
+        if page_slots(self.page_size) < 1:
+            raise ValueError(f"A page must hold at least one record ({4 + record_size + 1} bytes).")
+        if page_slots(self.page_size) > MAX_SLOTS:
+            raise ValueError(f"A page can hold at most {MAX_SLOTS} records "
+                             f"({4 + MAX_SLOTS * record_size + directory_size(MAX_SLOTS)} bytes).")
+        if self.cache_size < 0 or self.page_cache_size < 0 or self.record_cache_size < 0:
+            raise ValueError("Cache sizes must not be negative.")
+        if self.split_policy not in ("classic", "bstar"):
+            raise ValueError("Split policy must be 'classic' or 'bstar'.")
+        if not 0.5 <= self.fill_factor <= 1.0:
+            raise ValueError("Fill factor must be between 0.5 and 1.0.")
+        if self.bloom_bits_per_key < 0:
+            raise ValueError("Bloom filter bits per key must not be negative.")
+        if self.placement not in self.PLACEMENTS:
+            raise ValueError(f"Placement must be one of {', '.join(self.PLACEMENTS)}.")
+        if not 0.0 < self.page_fill <= 1.0:
+            raise ValueError("Page fill must be above 0 and at most 1.0.")
+
+
+def tree_files(base_name):
+    """
+    Names of the files of the tree with the given base name.
+    """
+    return {
+        'main_file': f"{base_name}_data.dat",
+        'node_file': f"{base_name}_nodes.dat",
+        'metadata_file': f"{base_name}_metadata.dat",
+        'node_metadata_file': f"{base_name}_nodes_metadata.dat",
+        'config_file': f"{base_name}_config.json",
+        'sketch_file': f"{base_name}_sketch.json",
+    }
+
+
+def tree_exists(base_name):
+    # Trees created before the config and sketch files were introduced have neither
+    files = tree_files(base_name)
+    return all(os.path.exists(path) for name, path in files.items()
+               if name not in ('config_file', 'sketch_file'))
+
+
+# -----------------------------------------------------------
+# Latches
+# -----------------------------------------------------------
+class RWLatch:
+    """
+    Reader-writer latch with writer preference.
+
+    The thread holding the latch exclusively may acquire it again in either
+    mode, so split/merge helpers can latch nodes their caller already holds.
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = None
+        self._writer_depth = 0
+        self._writers_waiting = 0
+
+    def acquire_read(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._writer_depth += 1
+                return
+            while self._writer is not None or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+
+    def acquire_write(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._writer_depth += 1
+                return
+            self._writers_waiting += 1
+            while self._writer is not None or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = me
+            self._writer_depth = 1
+
+    def release(self):
+        with self._cond:
+            if self._writer == threading.get_ident():
+                self._writer_depth -= 1
+                if self._writer_depth == 0:
+                    self._writer = None
+                    self._cond.notify_all()
+            else:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._cond.notify_all()
+
+
+# Latches held by the current thread, in acquisition order, over all trees
+latch_stack = threading.local()
+
+
+def held_latches():
+    if not hasattr(latch_stack, "held"):
+        latch_stack.held = []
+    return latch_stack.held
+
+
+def acquire_latch(latch, exclusive=False):
+    if exclusive:
+        latch.acquire_write()
+    else:
+        latch.acquire_read()
+    held_latches().append(latch)
+
+
+def release_ancestors(start=0):
+    """
+    Crabbing step: release the latches taken since position start, except the newest one.
+    """
+    held = held_latches()
+    while len(held) - start > 1:
+        held.pop(start).release()
+
+
+def release_latches(start=0):
+    """
+    Release the latches taken since position start.
+    """
+    held = held_latches()
+    while len(held) > start:
+        held.pop().release()
+
+
+# -----------------------------------------------------------
+# Record and Page Classes
+# -----------------------------------------------------------
+class Record:
+    def __init__(self, key, p_a, p_b, p_aub):
+        self.key = key
+        self.p_a = p_a
+        self.p_b = p_b
+        self.p_aub = p_aub
+
+
+@functools.lru_cache(maxsize=None)
+def page_slots(page_size):
+    """
+    Number of record slots of a data page: as many records as fit next to the
+    count and a directory bit for each.
+    """
+    slots = (page_size - 4) // record_size
+    while slots > 0 and 4 + slots * record_size + directory_size(slots) > page_size:
+        slots -= 1
+    return slots
+
+
+def directory_size(slots):
+    return (slots + 7) // 8
+
+
+def slot_offset(slot):
+    return 4 + slot * record_size
+
+
+def make_rid(page_num, slot):
+    return page_num << SLOT_BITS | slot
+
+
+def check_data_pages(pages, page_size):
+    """
+    Raise a ValueError if a data file of this many pages has pages that no record ID can address.
+    """
+    if pages > MAX_DATA_PAGES:
+        raise ValueError(f"The data file is full: record IDs address at most {MAX_DATA_PAGES} pages "
+                         f"({MAX_DATA_PAGES * page_size} bytes at a page size of {page_size}). "
+                         f"Use a larger --page-size.")
+
+
+def rid_page(rid):
+    return rid >> SLOT_BITS
+
+
+def rid_slot(rid):
+    return rid & (MAX_SLOTS - 1)
+
+
+def slot_used(directory, count, slot):
+    """
+    Whether a slot holds a record, given the directory and count of its page.
+    """
+    if any(directory):
+        return directory[slot >> 3] >> (slot & 7) & 1 == 1
+    # A page from before the slot directory keeps its records in the first slots
+    return slot < count
+
+
+def slots_in_use(data, slots):
+    """
+    The slots of a packed page that hold a record, in slot order.
+    """
+    directory = bytes(data[len(data) - directory_size(slots):])
+    count = struct.unpack_from('i', data, 0)[0]
+    return [slot for slot in range(slots) if slot_used(directory, count, slot)]
+
+
+class Page:
+    """
+    A data page as a list of slots, each a Record or None; free slots past the
+    last record may be left out.
+    """
+
+    def __init__(self, slots=None):
+        self.slots = slots if slots else []
+
+    @property
+    def records(self):
+        """
+        The records of the page, in slot order.
+        """
+        return [r for r in self.slots if r is not None]
+
+    def free_slot(self):
+        for slot, r in enumerate(self.slots):
+            if r is None:
+                return slot
+        return len(self.slots)
+
+    def pack(self, page_size):
+        slots = page_slots(page_size)
+        data = bytearray(page_size)
+        directory = page_size - directory_size(slots)
+        count = 0
+        for slot, r in enumerate(self.slots):
+            if r is not None:
+                struct.pack_into(record_format, data, slot_offset(slot), r.key, r.p_a, r.p_b, r.p_aub)
+                data[directory + (slot >> 3)] |= 1 << (slot & 7)
+                count += 1
+        struct.pack_into('i', data, 0, count)
+        return bytes(data)
+
+    @staticmethod
+    def unpack(data):
+        slots = page_slots(len(data))
+        used = slots_in_use(data, slots)
+        page = Page([None] * (used[-1] + 1 if used else 0))
+        for slot in used:
+            page.slots[slot] = Record(*struct.unpack_from(record_format, data, slot_offset(slot)))
+        return page
+
+
+# -----------------------------------------------------------
+# BTreeNode Class
+# -----------------------------------------------------------
+class BTreeNode:
+    def __init__(self, node_id, keys=None, children=None, leaf=True, parent_id=-1):
+        self.node_id = node_id
+        self.keys = keys if keys else []  # keys will be a list of tuples (key, record ID)
+        self.children = children if children else []
+        self.leaf = leaf
+        self.parent_id = parent_id
+
+    def to_bytes(self, max_keys, node_page_size, key_format='ii'):
+        n = len(self.keys)
+        leaf_byte = 1 if self.leaf else 0
+        data = struct.pack('i', self.node_id)
+        data += struct.pack('B', leaf_byte)
+        data += struct.pack('i', n)
+        data += struct.pack('i', self.parent_id)
+
+        # Each key is now (k, p)
+        # max_keys keys, each 8 bytes total (2 ints) in the default key_format
+        for i in range(max_keys):
+            if i < n:
+                k, p = self.keys[i]
+            else:
+                k, p = 0, 0
+            data += struct.pack(key_format, k, p)
+
+        # max_children = max_keys + 1 children, each 4 bytes
+        max_children = max_keys + 1
+        for i in range(max_children):
+            if i < len(self.children):
+                c = self.children[i]
+            else:
+                c = -1
+            data += struct.pack('i', c)
+
+        if len(data) < node_page_size:
+            data += b'\x00' * (node_page_size - len(data))
+
+        return data
+
+    @staticmethod
+    def from_bytes(data, max_keys, key_format='ii'):
+        node_id = struct.unpack('i', data[0:4])[0]
+        leaf_byte = data[4]
+        leaf = (leaf_byte == 1)
+        n = struct.unpack('i', data[5:9])[0]
+        parent_id = struct.unpack('i', data[9:13])[0]
+
+        keys = []
+        offset = 13
+        # Each key: (k, p) = 8 bytes in the default key_format
+        pair_size = struct.calcsize(key_format)
+        for i in range(max_keys):
+            k, p = struct.unpack(key_format, data[offset:offset + pair_size])
+            offset += pair_size
+            if i < n:
+                keys.append((k, p))
+
+        children = []
+        for i in range(max_keys + 1):
+            c = struct.unpack('i', data[offset:offset + 4])[0]
+            offset += 4
+            if c != -1:
+                children.append(c)
+
+        return BTreeNode(node_id, keys, children, leaf, parent_id)
+
+
+# -----------------------------------------------------------
+# Metadata files
+# -----------------------------------------------------------
+def print_page(page_num, page):
+    print(f"Page {page_num}: {len(page.records)} records")
+    for slot, r in enumerate(page.slots):
+        if r is not None:
+            print(f"  Slot {slot}: Key={r.key}, P(A)={r.p_a}, P(B)={r.p_b}, P(A∪B)={r.p_aub}")
+
+
+def load_int_list_from_file(filename):
+    if not os.path.exists(filename):
+        return []
+    with open(filename, "rb") as f:
+        data = f.read()
+    if len(data) < 4:
+        return []
+    count = struct.unpack('i', data[0:4])[0]
+    int_list = []
+    offset = 4
+    for _ in range(count):
+        val = struct.unpack('i', data[offset:offset + 4])[0]
+        offset += 4
+        int_list.append(val)
+    return int_list
+
+
+def save_int_list_to_file(filename, int_list):
+    with open(filename, "wb") as f:
+        f.write(struct.pack('i', len(int_list)))
+        for val in int_list:
+            f.write(struct.pack('i', val))
+
+
+def delete_metadata_files(*filenames):
+    for filename in filenames:
+        if os.path.exists(filename):
+            try:
+                os.remove(filename)
+                print(f"Deleted existing file: {filename}")
+            except OSError as e:
+                print(f"Error deleting file {filename}: {e}")
+
+
+def children_owners(*nodes):
+    """
+    Map every child ID of the given nodes to the node that currently holds it.
+    """
+    owners = {}
+    for node in nodes:
+        for child_id in node.children:
+            owners[child_id] = node.node_id
+    return owners
+
+
+# -----------------------------------------------------------
+# Snapshots
+# -----------------------------------------------------------
+# A snapshot pins the tree as it was when it was taken. Nodes keep their IDs
+# when they change, so instead of writing new versions elsewhere the old
+# version is moved out of the way: the first time a node slot is overwritten
+# on disk after the snapshot, its previous contents are copied to a fresh
+# node ID and the snapshot reads the copy from then on. Nodes that were
+# dirty in the cache when the snapshot was taken are kept as images, since
+# the disk does not hold their current version yet. Data pages are small and
+# few, so their old versions are simply kept in memory.
+class Snapshot:
+    def __init__(self, snapshot_id, root_id, node_end, page_end, free_nodes):
+        self.snapshot_id = snapshot_id
+        self.root = root_id
+        # Slots at or past node_end, and free slots, are not part of the snapshot
+        self.node_end = node_end
+        self.page_end = page_end
+        self.free_nodes = free_nodes
+        self.node_copies = {}   # node ID -> ID of the copy of its old version
+        self.node_images = {}   # node ID -> bytes, for nodes dirty at creation
+        self.pages = {}         # page number -> bytes of its old version
+
+
+class Vacuum:
+    """
+    Progress of a VACUUM. The records with keys up to cursor have been given
+    the first placed record positions, in key order; a position is a slot
+    counted over the whole file, page * max_records_per_page + slot.
+    """
+    def __init__(self, pages):
+        self.pages = pages  # data pages when the VACUUM started
+        self.cursor = None  # largest key placed so far
+        self.placed = 0
+        self.moved = 0
+        self.steps = 0
+        # Keys inserted at or below the cursor, wherever a free slot was
+        self.late_keys = set()
+        # Pages changed by the current step -> whether they have a free slot
+        self.touched = {}
+
+
+# -----------------------------------------------------------
+# Statistics
+# -----------------------------------------------------------
+class TreeStats:
+    """
+    Tree-wide figures kept up to date by inserts, deletes, splits and merges,
+    so reading them costs no node reads.
+
+    Levels are numbered from the leaves: level_nodes[0] is the number of
+    leaves and the last entry is the root level, so the height of the tree is
+    len(level_nodes). They live in memory only: LOAD recomputes them while
+    rebuilding the tree.
+    """
+
+    def __init__(self, keys=0, free_nodes=0, level_nodes=None):
+        self.keys = keys
+        self.free_nodes = free_nodes
+        self.level_nodes = list(level_nodes) if level_nodes else [1]  # an empty tree is a root leaf
+        # Writers on disjoint subtrees update the figures concurrently
+        self.lock = threading.Lock()
+
+    def add_keys(self, delta):
+        with self.lock:
+            self.keys += delta
+
+    def add_node(self, level):
+        with self.lock:
+            if level == len(self.level_nodes):
+                self.level_nodes.append(1)  # a new root
+            else:
+                self.level_nodes[level] += 1
+
+    def remove_node(self, level):
+        with self.lock:
+            self.level_nodes[level] -= 1
+            while len(self.level_nodes) > 1 and self.level_nodes[-1] == 0:
+                self.level_nodes.pop()  # the root was collapsed
+
+
+# -----------------------------------------------------------
+# BTree
+# -----------------------------------------------------------
+class BTree:
+    """
+    A B-tree over a data file of record pages, with its own files, caches,
+    counters and latches, so several trees can be open in one process.
+
+    The tree has no files until create() or load() is called; both can be
+    called again to switch the object to another tree.
+
+    Parameters:
+    - config (BTreeConfig): Tuning of the tree; copied, so later changes to
+      the caller's object have no effect.
+    """
+    # Struct format of a (key, page) pair in the node file
+    key_format = 'ii'
+
+    def __init__(self, config=None):
+        self.config = config.copy() if config is not None else BTreeConfig()
+        self.config.validate()
+        self.base_name = None
+        self.files = {
+            'main_file': None,
+            'node_file': None,
+            'metadata_file': None,
+            'node_metadata_file': None,
+            'config_file': None,
+            'sketch_file': None,
+        }
+        self.node_cache = OrderedDict()
+        self.page_cache = OrderedDict()
+        self.counters = {
+            "nodes_saved_to_disk": 0,
+            "nodes_loaded_from_disk": 0,
+            "nodes_loaded_from_cache": 0,
+            "pages_saved_to_disk": 0,
+            "pages_loaded_from_disk": 0,
+            "pages_loaded_from_cache": 0,
+            "metadata_loaded": 0,
+            "metadata_saved": 0,
+            "bytes_read": 0,
+            "bytes_written": 0
+        }
+        # Concurrent clients count their I/O into the same counters
+        self.counters_lock = threading.Lock()
+        self.metrics = Metrics()
+        self.stats = TreeStats()
+        self.bloom = None
+        # key -> record ID of every record, None unless config.hash_index
+        self.page_index = None
+        # key -> Record of hot keys, None unless config.record_cache_size
+        self.record_cache = None
+        # column -> SecondaryIndex over that field of the records
+        self.secondary_indexes = {}
+        # column -> QuantileSketch of that field of the records
+        self.sketches = self.new_sketches()
+        # Records the accesses of a single operation for EXPLAIN
+        self.tracer = Tracer()
+
+        # One latch per node, created on first use
+        self.node_latches = {}
+        self.node_latches_guard = threading.Lock()
+        # Protects the root pointer; held until the root node is known to be safe
+        self.root_latch = RWLatch()
+        # Cache hits reorder the LRU lists, so the caches are guarded by plain mutexes
+        self.node_cache_latch = threading.RLock()
+        self.page_cache_latch = threading.RLock()
+        # Underutilized pages, last_page and read-modify-write of data pages
+        self.data_file_latch = threading.RLock()
+        # Free-node list and allocation of new node IDs
+        self.node_alloc_latch = threading.RLock()
+        # max_key_hint, append_run and rightmost_leaf_hint, which inserts anywhere in the tree update
+        self.append_hint_latch = threading.Lock()
+        # Held shared by every insert, delete and update for its whole duration, and
+        # exclusively while a snapshot is taken, so a snapshot never sees half a split
+        self.write_gate = RWLatch()
+
+        self.snapshots = {}
+        self.next_snapshot_id = 1
+        # Number of snapshots referencing each node copy
+        self.copy_refs = {}
+        # Orders snapshot reads against the preserve-then-overwrite of a slot
+        self.snapshot_latch = threading.RLock()
+
+        self.root = 0
+        self.last_page = 1
+        self.reserved_node_end = 0  # first node ID past the IDs handed out by allocate_node_id
+        self.rightmost_leaf_hint = None  # node ID of the rightmost leaf, None if unknown
+        self.max_key_hint = None  # upper bound of the largest key, None if the tree is empty or unknown
+        self.append_run = 0  # number of consecutive inserts above max_key_hint
+        self.vacuum_state = None  # Vacuum of the VACUUM in progress
+        self.apply_geometry()
+
+    def apply_geometry(self):
+        """
+        Derive the node and page layout from config.d and config.page_size.
+        The layout of open files cannot change, so this runs at create and load.
+        """
+        self.config.validate()
+        self.d = self.config.d
+        self.max_keys = 2 * self.d
+        self.min_keys = self.d
+        # id, leaf flag, key count, parent, max_keys (key, page) pairs, max_keys + 1 children
+        self.node_page_size = max(555, 17 + (struct.calcsize(self.key_format) + 4) * self.max_keys)
+        self.page_size = self.config.page_size
+        self.max_records_per_page = page_slots(self.page_size)
+        # Records per page written by VACUUM and RESTORE
+        self.fill_records = max(1, int(self.max_records_per_page * self.config.page_fill))
+
+    # -------------------------------------------------------
+    # Opening and closing
+    # -------------------------------------------------------
+    def create(self, base_name):
+        """
+        Create an empty tree named base_name, overwriting any files of that name.
+        """
+        files = tree_files(base_name)
+        self.close()
+        self.secondary_indexes = {}
+        for column in PROBABILITY_COLUMNS:
+            delete_metadata_files(*tree_files(index_base_name(base_name, column)).values())
+        # Delete existing metadata and node files if they exist
+        self.drop_snapshots()
+        delete_metadata_files(files['metadata_file'], files['node_metadata_file'], files['node_file'],
+                              files['main_file'], files['config_file'], files['sketch_file'])
+        self.files = files
+        self.base_name = base_name
+        self.apply_geometry()
+        self.save_config()
+        self.stats = TreeStats()
+        self.bloom = self.new_bloom(BLOOM_MIN_CAPACITY)
+        self.page_index = {} if self.config.hash_index else None
+        self.record_cache = self.new_record_cache()
+        self.sketches = self.new_sketches()
+
+        # Initialize necessary files
+        self.generate_main_file()
+        self.add_underutilized_page(0)
+        self.init_btree_nodes_file()
+        self.init_node_metadata()
+        self.init_metadata()
+
+        # Reset the counters
+        self.reset_counters()
+        self.metrics.reset()
+
+    def load(self, base_name):
+        """
+        Open the tree named base_name and rebuild its B-tree from the data file.
+
+        The stored d and page_size replace the configured ones; a tree without a
+        config file keeps the configured values and gets them stored.
+        """
+        self.close()
+        self.files = tree_files(base_name)
+        self.base_name = base_name
+        if os.path.exists(self.files['config_file']):
+            with open(self.files['config_file']) as f:
+                stored = json.load(f)
+            self.config.update({name: stored[name] for name in BTreeConfig.STORED_FIELDS if name in stored})
+        self.apply_geometry()
+        self.save_config()
+        # The rebuild below inserts every key again, which recomputes the figures and
+        # refills the filter; both live in memory only. The filter is sized for a
+        # full data file, so the rebuild never has to grow it.
+        self.stats = TreeStats()
+        pages = os.path.getsize(self.files['main_file']) // self.page_size \
+            if os.path.exists(self.files['main_file']) else 0
+        self.bloom = self.new_bloom(max(BLOOM_MIN_CAPACITY, pages * self.max_records_per_page))
+        # Filled from the data file by the rebuild, like the filter
+        self.page_index = {} if self.config.hash_index else None
+        self.record_cache = self.new_record_cache()
+        # So are the quantile sketches and the secondary indexes the tree had
+        self.sketches = self.new_sketches()
+        self.secondary_indexes = {}
+        for column in PROBABILITY_COLUMNS:
+            name = index_base_name(base_name, column)
+            if os.path.exists(tree_files(name)['node_file']):
+                self.secondary_indexes[column] = SecondaryIndex(column, self.config, name)
+        self.load_main_file()
+        self.save_quantile_sketches()
+
+    def save_config(self):
+        with open(self.files['config_file'], "w") as f:
+            json.dump({name: getattr(self.config, name) for name in BTreeConfig.STORED_FIELDS}, f, indent=2)
+
+    def new_bloom(self, capacity):
+        if self.config.bloom_bits_per_key == 0:
+            return None
+        return CountingBloomFilter(capacity, self.config.bloom_bits_per_key)
+
+    def new_record_cache(self):
+        return RecordCache(self.config.record_cache_size) if self.config.record_cache_size > 0 else None
+
+    def new_sketches(self):
+        return {column: QuantileSketch() for column in PROBABILITY_COLUMNS}
+
+    def save_quantile_sketches(self):
+        if self.files['sketch_file'] is not None and self.sketches:
+            save_sketches(self.files['sketch_file'], self.sketches)
+
+    def grow_bloom(self):
+        """
+        Rebuild a full Bloom filter with twice the capacity from the keys of the tree.
+
+        Writers are held off while the keys are collected, so none is missed.
+        """
+        self.write_gate.acquire_write()
+        try:
+            old = self.bloom
+            if old is None or old.count < old.capacity:
+                return  # another thread grew it first
+            bloom = self.new_bloom(old.capacity * 2)
+            for node in self.collect_nodes():
+                for key, _ in node["keys"]:
+                    bloom.add(key)
+            bloom.negatives = old.negatives
+            bloom.false_positives = old.false_positives
+            bloom.saved_reads = old.saved_reads
+            self.bloom = bloom
+        finally:
+            self.write_gate.release()
+
+    def close(self):
+        """
+        Write back the caches of the open tree and forget its cached state,
+        before create or load switch to other files.
+        """
+        for index in self.secondary_indexes.values():
+            index.close()
+        if any(dirty for _, dirty in self.node_cache.values()) or self.page_cache:
+            self.flush_caches()
+        else:
+            self.save_quantile_sketches()
+        with self.node_cache_latch:
+            self.node_cache.clear()
+        self.last_page = 1
+
+    def flush_caches(self):
+        """
+        Write all cached nodes and pages to disk and clear caches.
+        """
+        print("\nFlushing all caches to disk...")
+
+        # Save dirty nodes from node cache
+        with self.node_cache_latch:
+            for node_id, (node, is_dirty) in list(self.node_cache.items()):
+                if is_dirty:
+                    print(f"Flushing dirty node {node_id} to disk...")
+                    self.write_node_to_disk(node)
+                    self.node_cache[node_id] = (node, False)
+
+        # Save pages from page cache
+        with self.page_cache_latch:
+            for page_num, page_data in list(self.page_cache.items()):
+                print(f"Flushing page {page_num} to disk...")
+                self.write_page_to_disk(page_num, page_data)
+
+                self.page_cache.pop(page_num)
+
+        self.save_quantile_sketches()
+        for index in self.secondary_indexes.values():
+            index.flush_caches()
+        print("All caches flushed successfully.\n")
+
+    def generate_main_file(self):
+        filename = self.files['main_file']
+        if os.path.exists(filename):
+            os.remove(filename)
+
+        with open(filename, "wb") as f:
+            f.write(Page().pack(self.page_size))
+
+    def init_btree_nodes_file(self):
+        node_filename = self.files['node_file']
+        if os.path.exists(node_filename):
+            print("Node file exists. Loading existing root node...")
+            self.reset_append_hint()
+            return  # Avoid overwriting existing data
+        root_node = BTreeNode(0, keys=[], leaf=True, parent_id=-1)
+        self.save_node(root_node, "wb")
+        self.root = root_node.node_id
+        self.reset_append_hint(self.root)
+        self.reserved_node_end = 0
+
+    def reset_append_hint(self, leaf_id=None):
+        """
+        Reset the sequential-insert state. Pass the root ID for a new, empty tree.
+        """
+        with self.append_hint_latch:
+            self.rightmost_leaf_hint = leaf_id
+            self.max_key_hint = None
+            self.append_run = 0
+
+    def load_main_file(self):
+        """
+        Rebuild the B-tree from the contents of the main file.
+        Identify underutilized pages and mark them.
+        """
+        main_file = self.files['main_file']
+        if not os.path.exists(main_file):
+            print(f"Main file '{main_file}' does not exist. Creating a new file.")
+            self.generate_main_file()
+            self.add_underutilized_page(0)
+            self.init_btree_nodes_file()
+            self.init_node_metadata()
+            self.init_metadata()
+            self.last_page = 1  # Start with the first page
+            return
+
+        print(f"Loading main file '{main_file}' and rebuilding the B-tree...")
+
+        # Clear existing metadata and B-tree files
+        self.drop_snapshots()
+        delete_metadata_files(self.files['metadata_file'], self.files['node_metadata_file'], self.files['node_file'])
+        self.init_metadata()
+        self.init_node_metadata()
+        self.init_btree_nodes_file()
+
+        # Read and parse the data from the main file
+        file_size = os.path.getsize(main_file)
+        num_pages = file_size // self.page_size
+
+        # Set last_page to the next available page
+        self.last_page = num_pages + 1
+        print(f"File '{main_file}' has {num_pages} pages. Setting last_page to {self.last_page}.")
+
+        keys_inserted = 0
+        underutilized_pages = []
+
+        with open(main_file, "rb") as f:
+            for page_num in range(num_pages):
+                f.seek(page_num * self.page_size)
+                data = f.read(self.page_size)
+                self.add_counters(bytes_read=len(data))
+                page = Page.unpack(data)
+
+                # Check for underutilized pages
+                if len(page.records) < self.max_records_per_page:
+                    underutilized_pages.append(page_num)
+
+                for slot, record in enumerate(page.slots):
+                    if record is None:
+                        continue
+                    # Insert each record into the B-tree
+                    rid = make_rid(page_num, slot)
+                    result = self.insert_key(record.key, (record.p_a, record.p_b, record.p_aub),
+                                             loading=True, rid=rid)
+                    if result == 'OK':
+                        keys_inserted += 1
+                        if self.page_index is not None:
+                            self.page_index[record.key] = rid
+
+        # Save underutilized pages to metadata
+        self.save_underutilized_pages(underutilized_pages)
+        print(f"Identified {len(underutilized_pages)} underutilized pages.")
+        print(f"Rebuilt B-tree with {keys_inserted} keys from the main file '{main_file}'.")
+        print(f"Last page set to {self.last_page}.")
+
+    # -------------------------------------------------------
+    # Latches
+    # -------------------------------------------------------
+    def add_counters(self, **amounts):
+        with self.counters_lock:
+            for name, amount in amounts.items():
+                self.counters[name] += amount
+
+    def reset_counters(self):
+        with self.counters_lock:
+            for name in self.counters:
+                self.counters[name] = 0
+
+    def counter_values(self):
+        """
+        Returns:
+        - dict: A consistent copy of the counters.
+        """
+        with self.counters_lock:
+            return dict(self.counters)
+
+    def get_node_latch(self, node_id):
+        with self.node_latches_guard:
+            latch = self.node_latches.get(node_id)
+            if latch is None:
+                latch = self.node_latches[node_id] = RWLatch()
+            return latch
+
+    def latch_node(self, node_id, exclusive=False):
+        acquire_latch(self.get_node_latch(node_id), exclusive)
+
+    # -------------------------------------------------------
+    # Data pages
+    # -------------------------------------------------------
+    @timed_phase("page_io")
+    def read_page(self, page_num):
+        with self.page_cache_latch:
+            if (self.config.page_cache_size != 0) and (page_num in self.page_cache):
+                # Move to end to mark as recently used
+                page_data = self.page_cache.pop(page_num)
+                self.page_cache[page_num] = page_data
+                self.add_counters(pages_loaded_from_cache=1)
+                self.tracer.emit("read_page", page=page_num, hit=True)
+                return Page.unpack(page_data)
+
+            # Read from disk
+            with open(self.files['main_file'], "rb") as f:
+                f.seek(page_num * self.page_size)
+                page_bytes = f.read(self.page_size)
+                if not page_bytes:
+                    # If page does not exist, return empty page
+                    page = Page()
+                else:
+                    page = Page.unpack(page_bytes)
+                self.add_counters(pages_loaded_from_disk=1, bytes_read=len(page_bytes))
+                self.tracer.emit("read_page", page=page_num, hit=False)
+
+            # Add to cache
+            page_data = page.pack(self.page_size)
+            self.page_cache[page_num] = page_data
+
+            if self.config.page_cache_size != 0 and len(self.page_cache) > self.config.page_cache_size:
+                evicted_page_num, evicted_data = self.page_cache.popitem(last=False)
+                self.tracer.emit("evict_page", page=evicted_page_num)
+                self.write_page_to_disk(evicted_page_num, evicted_data)
+
+            return page
+
+    @timed_phase("page_io")
+    def write_page(self, page_num, page):
+        with self.page_cache_latch:
+            cached = page_num in self.page_cache
+            if cached:
+                self.page_cache.pop(page_num)
+                self.page_cache[page_num] = page.pack(self.page_size)
+            else:
+                self.write_page_to_disk(page_num, page.pack(self.page_size))
+            self.tracer.emit("write_page", page=page_num, cached=cached)
+
+            # Evict if cache size exceeded
+            if len(self.page_cache) > self.config.page_cache_size:
+                evicted_page_num, evicted_data = self.page_cache.popitem(last=False)
+                self.tracer.emit("evict_page", page=evicted_page_num)
+                self.write_page_to_disk(evicted_page_num, evicted_data)
+
+    def write_page_to_disk(self, page_num, page_data):
+        """
+        Write packed page data to the data file, bypassing the cache.
+        """
+        self.preserve_page(page_num)
+        with open(self.files['main_file'], "r+b") as f:
+            f.seek(page_num * self.page_size)
+            f.write(page_data)
+            f.flush()
+        self.add_counters(pages_saved_to_disk=1, bytes_written=len(page_data))
+
+    def insert_record_in_main_file(self, record, near=()):
+        """
+        Put a record in the first free slot of an underutilized page, or of a new page.
+
+        Parameters:
+        - record (Record): The record.
+        - near (list): Pages of the records with neighbouring keys, for the
+          "neighbour" placement.
+
+        Returns:
+        - int: The record ID.
+
+        Raises:
+        - ValueError: If every page is full and a new page could not be
+          addressed by a record ID; nothing has been written then.
+        """
+        with self.data_file_latch:
+            underutilized_pages = self.load_underutilized_pages()
+
+            if underutilized_pages:
+                page_num = self.choose_page(underutilized_pages, near)
+                print('from list')
+            else:
+                check_data_pages(self.last_page + 1, self.page_size)
+                self.add_underutilized_page(self.last_page)
+                page_num = self.last_page
+                self.last_page += 1
+                print('from filesize')
+
+            page = self.read_page(page_num)
+
+            # The other records stay where they are
+            slot = page.free_slot()
+            if slot == len(page.slots):
+                page.slots.append(record)
+            else:
+                page.slots[slot] = record
+
+            if len(page.records) == self.max_records_per_page:
+                print('should remove')
+                self.remove_underutilized_page(page_num)
+
+            self.write_page(page_num, page)
+            self.metrics.record_write()
+            rid = make_rid(page_num, slot)
+            if self.page_index is not None:
+                self.page_index[record.key] = rid
+            vacuum = self.vacuum_state
+            if vacuum is not None and vacuum.cursor is not None and record.key <= vacuum.cursor:
+                vacuum.late_keys.add(record.key)
+
+            return rid
+
+    def choose_page(self, underutilized_pages, near):
+        """
+        Pick the page for a new record among the underutilized pages, a sorted list.
+        """
+        if self.config.placement == "first_fit" or not near:
+            return underutilized_pages[0]
+        for page_num in near:
+            i = bisect.bisect_left(underutilized_pages, page_num)
+            if i < len(underutilized_pages) and underutilized_pages[i] == page_num:
+                return page_num
+        # The pages of the neighbours are full; take the free page closest to the first one
+        i = bisect.bisect_left(underutilized_pages, near[0])
+        candidates = underutilized_pages[max(0, i - 1):i + 1]
+        return min(candidates, key=lambda p: abs(p - near[0]))
+
+    def remove_record_from_main_file(self, rid, key):
+        """
+        Returns:
+        - Record: The removed record, or None if the slot does not hold the key.
+        """
+        page_num, slot = rid_page(rid), rid_slot(rid)
+        with self.data_file_latch:
+            page = self.read_page(page_num)
+
+            if slot < len(page.slots) and page.slots[slot] is not None and page.slots[slot].key == key:
+                removed = page.slots[slot]
+                page.slots[slot] = None
+
+                self.write_page(page_num, page)
+                self.metrics.record_write()
+                if self.page_index is not None:
+                    self.page_index.pop(key, None)
+
+                if len(page.records) < self.max_records_per_page:
+                    self.add_underutilized_page(page_num)
+                return removed
+            return None
+
+    @timed_phase("page_io")
+    def update_record_in_main_file(self, rid, record):
+        """
+        Overwrite a record in its slot, writing only the record.
+
+        A cached page is patched in the cache; otherwise the record is read and
+        written at its offset in the data file, and the rest of the page is
+        not touched.
+
+        Returns:
+        - Record: The previous version, or None if the slot does not hold record.key.
+        """
+        page_num, slot = rid_page(rid), rid_slot(rid)
+        if slot >= self.max_records_per_page:
+            return None
+        offset = slot_offset(slot)
+        data = struct.pack(record_format, record.key, record.p_a, record.p_b, record.p_aub)
+        # The page cache latch is held throughout, so no reader caches the old page meanwhile
+        with self.data_file_latch, self.page_cache_latch:
+            page_data = self.page_cache.get(page_num)
+            if page_data is not None:
+                if slot not in slots_in_use(page_data, self.max_records_per_page):
+                    return None
+                old = Record(*struct.unpack_from(record_format, page_data, offset))
+                if old.key != record.key:
+                    return None
+                self.page_cache.pop(page_num)
+                self.page_cache[page_num] = page_data[:offset] + data + page_data[offset + record_size:]
+                self.add_counters(pages_loaded_from_cache=1)
+                self.tracer.emit("write_record", page=page_num, slot=slot, cached=True)
+                return old
+
+            position = page_num * self.page_size
+            size = directory_size(self.max_records_per_page)
+            fd = os.open(self.files['main_file'], os.O_RDWR)
+            try:
+                count_data = os.pread(fd, 4, position)
+                old_data = os.pread(fd, record_size, position + offset)
+                directory = os.pread(fd, size, position + self.page_size - size)
+                self.add_counters(bytes_read=4 + record_size + size)
+                if len(directory) < size or not slot_used(directory, struct.unpack('i', count_data)[0], slot):
+                    return None
+                old = Record(*struct.unpack(record_format, old_data))
+                if old.key != record.key:
+                    return None
+                self.preserve_page(page_num)
+                os.pwrite(fd, data, position + offset)
+            finally:
+                os.close(fd)
+            self.add_counters(bytes_written=record_size)
+            self.tracer.emit("write_record", page=page_num, slot=slot, cached=False)
+            return old
+
+    def read_record(self, key, rid):
+        """
+        Return the record with the given key from its slot, or None.
+
+        VACUUM may have moved the record since rid was looked up; the key is
+        then looked up again.
+        """
+        while True:
+            page = self.read_page(rid_page(rid))
+            slot = rid_slot(rid)
+            if slot < len(page.slots) and page.slots[slot] is not None and page.slots[slot].key == key:
+                return page.slots[slot]
+            moved = self.find_rid(key)
+            if moved is None or moved == rid:
+                return None
+            rid = moved
+
+    def find_rid(self, key):
+        """
+        Return the record ID of a key, from the hash index if there is one, or None.
+        """
+        if self.page_index is not None:
+            return self.page_index.get(key)
+        node, found = self.search_key(key)
+        if found == 'not found':
+            return None
+        return next((rid for k, rid in node.keys if k == key), None)
+
+    def get_record(self, key):
+        """
+        Point read of the record with the given key: from the record cache if
+        it holds the key, else through find_rid and read_record, offering the
+        record to the cache.
+
+        Returns:
+        - Record: The record, or None if the key is absent.
+        """
+        cache = self.record_cache
+        if cache is None:
+            rid = self.find_rid(key)
+            return self.read_record(key, rid) if rid is not None else None
+        record = cache.get(key)
+        self.tracer.emit("record_cache", key=key, hit=record is not None)
+        if record is not None:
+            return record
+        epoch = cache.epoch
+        rid = self.find_rid(key)
+        record = self.read_record(key, rid) if rid is not None else None
+        if record is not None:
+            cache.admit(key, record, epoch)
+        return record
+
+    def print_main_file(self):
+        filename = self.files['main_file']
+        if not os.path.exists(filename):
+            print("Main file does not exist.")
+            return
+        for p, page in enumerate(self.scan_pages()):
+            print_page(p, page)
+
+    def scan_pages(self):
+        """
+        Yield every data page in page order, as scan_nodes does for nodes.
+
+        Cached pages replace their disk version, including pages that were
+        never written to disk, and the page cache is left as it is.
+        """
+        with self.page_cache_latch:
+            cached_end = max(self.page_cache, default=-1) + 1
+        buffer = bytearray(SCAN_BLOCK_PAGES * self.page_size)
+        view = memoryview(buffer)
+        page_num = 0
+        with open(self.files['main_file'], "rb") as f:
+            while True:
+                length = f.readinto(buffer)
+                count = length // self.page_size
+                if count == 0:
+                    break
+                self.add_counters(bytes_read=length)
+                with self.page_cache_latch:
+                    cached = {p: self.page_cache[p] for p in range(page_num, page_num + count)
+                              if p in self.page_cache}
+                for i in range(count):
+                    data = cached.get(page_num)
+                    if data is None:
+                        data = view[i * self.page_size:(i + 1) * self.page_size]
+                        self.add_counters(pages_loaded_from_disk=1)
+                    yield Page.unpack(data)
+                    page_num += 1
+        while page_num < cached_end:
+            with self.page_cache_latch:
+                data = self.page_cache.get(page_num)
+            yield Page.unpack(data) if data is not None else Page()
+            page_num += 1
+
+    # -------------------------------------------------------
+    # Metadata
+    # -------------------------------------------------------
+    def init_metadata(self):
+        if not os.path.exists(self.files['metadata_file']):
+            with open(self.files['metadata_file'], "wb") as f:
+                # Start with zero free pages
+                f.write(struct.pack('i', 0))
+
+    @timed_phase("metadata")
+    def load_underutilized_pages(self):
+        self.add_counters(metadata_loaded=1)
+        pages = load_int_list_from_file(self.files['metadata_file'])
+        self.add_counters(bytes_read=4 + 4 * len(pages))
+        self.tracer.emit("metadata_load", file="underutilized_pages", entries=len(pages))
+        return pages
+
+    @timed_phase("metadata")
+    def save_underutilized_pages(self, pages):
+        save_int_list_to_file(self.files['metadata_file'], pages)
+        self.add_counters(metadata_saved=1, bytes_written=4 + 4 * len(pages))
+        self.tracer.emit("metadata_save", file="underutilized_pages", entries=len(pages))
+
+    def add_underutilized_page(self, page_num):
+        """
+        Add a page to the list of underutilized pages.
+        """
+        pages = self.load_underutilized_pages()
+        if page_num not in pages:  # Avoid duplicates
+            bisect.insort(pages, page_num)
+            self.save_underutilized_pages(pages)
+
+    def remove_underutilized_page(self, page_num):
+        """
+        Remove a page from the list of underutilized pages.
+        """
+        pages = self.load_underutilized_pages()
+        if page_num in pages:
+            pages.remove(page_num)
+            self.save_underutilized_pages(pages)
+
+    def init_node_metadata(self):
+        """
+        Initialize the metadata file for free B-tree nodes if it does not exist.
+        """
+        if not os.path.exists(self.files['node_metadata_file']):
+            with open(self.files['node_metadata_file'], "wb") as f:
+                f.write(struct.pack('i', 0))  # Start with zero free nodes.
+
+    @timed_phase("metadata")
+    def load_free_nodes(self):
+        free_nodes = load_int_list_from_file(self.files['node_metadata_file'])
+        self.add_counters(bytes_read=4 + 4 * len(free_nodes))
+        self.tracer.emit("metadata_load", file="free_nodes", entries=len(free_nodes))
+        return free_nodes
+
+    @timed_phase("metadata")
+    def save_free_nodes(self, free_nodes):
+        save_int_list_to_file(self.files['node_metadata_file'], free_nodes)
+        self.stats.free_nodes = len(free_nodes)
+        self.add_counters(bytes_written=4 + 4 * len(free_nodes))
+        self.tracer.emit("metadata_save", file="free_nodes", entries=len(free_nodes))
+
+    def add_free_node(self, node_id):
+        """
+        Add a node ID to the list of free nodes in the metadata file.
+        """
+        with self.node_alloc_latch:
+            free_nodes = self.load_free_nodes()
+            bisect.insort(free_nodes, node_id)  # Maintain sorted order.
+            self.save_free_nodes(free_nodes)
+
+    def get_free_node(self):
+        """
+        Retrieve and remove a free node ID from the metadata file, if available.
+        """
+        with self.node_alloc_latch:
+            free_nodes = self.load_free_nodes()
+            if not free_nodes:
+                return None
+            free_node_id = free_nodes.pop(0)  # Get the first free node ID.
+            self.save_free_nodes(free_nodes)
+            return free_node_id
+
+    def allocate_node_id(self):
+        """
+        Take a free node ID, or the next ID past the end of the node file.
+
+        IDs past the end are reserved until written, so two writers splitting at
+        the same time never get the same one.
+        """
+        with self.node_alloc_latch:
+            node_id = self.get_free_node()
+            if node_id is None:
+                node_id = max(os.path.getsize(self.files['node_file']) // self.node_page_size,
+                              self.reserved_node_end)
+                self.reserved_node_end = node_id + 1
+            return node_id
+
+    # -------------------------------------------------------
+    # Nodes
+    # -------------------------------------------------------
+    def mark_node_dirty(self, node_id):
+        if node_id in self.node_cache:
+            node, _ = self.node_cache.pop(node_id)
+            self.node_cache[node_id] = (node, True)
+
+    def read_node(self, node_to_read_id):
+        with self.node_cache_latch:
+            if node_to_read_id in self.node_cache:
+                self.add_counters(nodes_loaded_from_cache=1)
+                node, t = self.node_cache.pop(node_to_read_id)
+                self.node_cache[node_to_read_id] = (node, t)
+                self.tracer.emit("read_node", node=node_to_read_id, hit=True)
+                return node
+
+        node_filename = self.files['node_file']
+        if not os.path.exists(node_filename):
+            return None
+
+        # The disk read happens outside the cache latch so concurrent readers overlap their I/O
+        with open(node_filename, "rb") as f:
+            f.seek(node_to_read_id * self.node_page_size)
+            data = f.read(self.node_page_size)
+            if len(data) < self.node_page_size:
+                return None
+
+        node = BTreeNode.from_bytes(data, self.max_keys, self.key_format)
+        with self.node_cache_latch:
+            self.add_counters(nodes_loaded_from_disk=1, bytes_read=self.node_page_size)
+            self.tracer.emit("read_node", node=node_to_read_id, hit=False)
+            if node_to_read_id in self.node_cache:
+                # Another reader cached it meanwhile; keep a single shared copy
+                node, t = self.node_cache.pop(node_to_read_id)
+                self.node_cache[node_to_read_id] = (node, t)
+                return node
+
+            self.node_cache[node_to_read_id] = (node, False)
+            if len(self.node_cache) > self.config.cache_size:
+                evicted_node_id, (evicted_node, dirty) = self.node_cache.popitem(last=False)
+                if self.config.cache_size > 0:
+                    self.tracer.emit("evict_node", node=evicted_node_id, dirty=dirty)
+                if self.config.cache_size > 0 and dirty:
+                    self.write_node_to_disk(evicted_node)
+
+        return node
+
+    def write_node_to_disk(self, node):
+        """
+        Write a node to its slot in the node file, bypassing the cache.
+        """
+        self.preserve_node(node.node_id)
+        with open(self.files['node_file'], "r+b") as f:
+            f.seek(node.node_id * self.node_page_size)
+            f.write(node.to_bytes(self.max_keys, self.node_page_size, self.key_format))
+            f.flush()
+        self.add_counters(nodes_saved_to_disk=1, bytes_written=self.node_page_size)
+
+    def save_node(self, node_to_save, mode="r+b"):
+        with self.node_cache_latch:
+            if node_to_save.node_id in self.node_cache:
+                self.node_cache.move_to_end(node_to_save.node_id)
+                self.node_cache[node_to_save.node_id] = (node_to_save, True)
+                self.tracer.emit("save_node", node=node_to_save.node_id, cached=True)
+            else:
+                if mode != "wb":
+                    self.preserve_node(node_to_save.node_id)
+                with open(self.files['node_file'], mode) as f:
+                    f.seek(node_to_save.node_id * self.node_page_size)
+                    f.write(node_to_save.to_bytes(self.max_keys, self.node_page_size, self.key_format))
+                    f.flush()
+                self.add_counters(nodes_saved_to_disk=1, bytes_written=self.node_page_size)
+                self.tracer.emit("save_node", node=node_to_save.node_id, cached=False)
+
+    def set_root(self, new_root_id):
+        self.root = new_root_id
+
+    def peek_node(self, node_id):
+        """
+        Read a node without changing the node cache: the cached version if there
+        is one, else the disk version, which is not cached.
+        """
+        with self.node_cache_latch:
+            cached = self.node_cache.get(node_id)  # get() leaves the LRU order alone
+        if cached is not None:
+            return cached[0]
+        with open(self.files['node_file'], "rb") as f:
+            f.seek(node_id * self.node_page_size)
+            data = f.read(self.node_page_size)
+        if len(data) < self.node_page_size:
+            return None
+        self.add_counters(nodes_loaded_from_disk=1, bytes_read=self.node_page_size)
+        return BTreeNode.from_bytes(data, self.max_keys, self.key_format)
+
+    def scan_nodes(self):
+        """
+        Yield every node slot of the node file in ID order.
+
+        The file is read SCAN_BLOCK_NODES slots at a time into one reused
+        buffer. Cached nodes, dirty or not, replace their disk version; the
+        cache itself is neither filled nor reordered.
+        """
+        node_filename = self.files['node_file']
+        if not os.path.exists(node_filename):
+            return
+        buffer = bytearray(SCAN_BLOCK_NODES * self.node_page_size)
+        view = memoryview(buffer)
+        node_id = 0
+        with open(node_filename, "rb") as f:
+            while True:
+                length = f.readinto(buffer)
+                count = length // self.node_page_size
+                if count == 0:
+                    break
+                self.add_counters(bytes_read=length)
+                with self.node_cache_latch:
+                    cached = {i: self.node_cache[i][0] for i in range(node_id, node_id + count)
+                              if i in self.node_cache}
+                for i in range(count):
+                    node = cached.get(node_id)
+                    if node is None:
+                        node = BTreeNode.from_bytes(view[i * self.node_page_size:(i + 1) * self.node_page_size],
+                                                    self.max_keys, self.key_format)
+                        self.add_counters(nodes_loaded_from_disk=1)
+                    yield node
+                    node_id += 1
+
+    def load_all_nodes(self):
+        """
+        Every node slot of the node file, free ones included, read by scan_nodes.
+        """
+        return [{"id": node.node_id, "leaf": node.leaf, "keys": node.keys, "children": node.children}
+                for node in self.scan_nodes()]
+
+    def collect_nodes(self, root_id=None, max_depth=None, snap=None):
+        """
+        Collect the nodes of a subtree, level by level, for display.
+
+        The whole tree is read with one sequential scan_nodes pass; a subtree or
+        a depth-limited view only reads the nodes it shows, through peek_node.
+        Neither disturbs the node cache.
+
+        Parameters:
+        - root_id (int): Root of the subtree, the tree root by default.
+        - max_depth (int): Number of levels to collect, all by default.
+        - snap (Snapshot): Read the nodes as they were in this snapshot.
+
+        Returns:
+        - list: Nodes in the format of load_all_nodes, plus "truncated", true for
+          nodes whose children were cut off by max_depth. Empty if root_id is
+          not a node.
+        """
+        if snap is not None:
+            root_id = snap.root if root_id is None else root_id
+            read = functools.partial(self.read_snapshot_node, snap)
+        elif (root_id is None or root_id == self.root) and max_depth is None:
+            root_id = self.root
+            # Keyed by slot: a snapshot copy stores the ID of the node it was copied from
+            read = dict(enumerate(self.scan_nodes())).get
+        else:
+            root_id = self.root if root_id is None else root_id
+            read = self.peek_node
+
+        nodes = []
+        level = [root_id]
+        depth = 0
+        while level:
+            depth += 1
+            next_level = []
+            for node_id in level:
+                node = read(node_id)
+                if node is None:
+                    continue
+                truncated = max_depth is not None and depth >= max_depth and not node.leaf
+                nodes.append({"id": node.node_id, "leaf": node.leaf, "keys": node.keys,
+                              "children": [] if truncated else node.children, "truncated": truncated})
+                if not node.leaf and not truncated:
+                    next_level.extend(node.children)
+            level = next_level
+        return nodes
+
+    def tree_stats(self):
+        """
+        Summary of the incrementally maintained statistics; reads no nodes.
+
+        Returns:
+        - dict: keys, height, level_nodes (leaves first), nodes, free_nodes,
+          fill_factor (keys per node slot) and page_utilization (records per
+          record slot of the data pages).
+        """
+        with self.stats.lock:
+            keys = self.stats.keys
+            level_nodes = list(self.stats.level_nodes)
+            free_nodes = self.stats.free_nodes
+        nodes = sum(level_nodes)
+        return {
+            "keys": keys,
+            "height": len(level_nodes),
+            "level_nodes": level_nodes,
+            "nodes": nodes,
+            "free_nodes": free_nodes,
+            "fill_factor": round(keys / (nodes * self.max_keys), 4) if nodes else 0.0,
+            "page_utilization": round(keys / (self.last_page * self.max_records_per_page), 4),
+        }
+
+    def scan_stats(self):
+        """
+        Recompute the statistics by walking the whole tree from the root, to
+        check the incremental ones.
+
+        Returns:
+        - TreeStats: The figures found by the scan.
+        """
+        keys = 0
+        depth_nodes = []
+        level = [self.root]
+        while level:
+            depth_nodes.append(len(level))
+            next_level = []
+            for node_id in level:
+                node = self.read_node(node_id)
+                keys += len(node.keys)
+                if not node.leaf:
+                    next_level.extend(node.children)
+            level = next_level
+        return TreeStats(keys, len(self.load_free_nodes()), depth_nodes[::-1])
+
+    def clustering(self):
+        """
+        Measure how closely the data file follows key order, by walking the keys in order.
+
+        Returns:
+        - dict: records, pages (data pages holding records), page_changes (the
+          clustering factor: pages entered by the walk, from pages when the
+          records of every page have consecutive keys to records when no two
+          consecutive keys share a page) and score, 1.0 for the former and
+          0.0 for the latter.
+        """
+        pages = [rid_page(rid) for _, rid in self.range_search(-2 ** 31, 2 ** 31 - 1)]
+        records, distinct = len(pages), len(set(pages))
+        changes = sum(1 for i, page_num in enumerate(pages) if i == 0 or page_num != pages[i - 1])
+        span = records - distinct
+        return {
+            "records": records,
+            "pages": distinct,
+            "page_changes": changes,
+            "score": round((records - changes) / span, 4) if span else 1.0,
+        }
+
+    def get_largest_key(self, node):
+        while not node.leaf:
+            node = self.read_node(node.children[-1])
+        return node.keys[-1]
+
+    def get_smallest_key(self, node):
+        while not node.leaf:
+            node = self.read_node(node.children[0])
+        return node.keys[0]
+
+    # -------------------------------------------------------
+    # Search
+    # -------------------------------------------------------
+    @timed_phase("descent")
+    def search_key(self, x, current_node_id=None):
+        """
+        Find the node holding key x, or the leaf where it would be inserted.
+
+        The descent is latch-coupled: the shared latch of a child is taken before
+        the one of its parent is released, so concurrent searches never see a
+        node in the middle of a split or merge.
+
+        A search from the root first asks the Bloom filter, which rules out most
+        absent keys without reading a node; those return no node.
+
+        Returns:
+        - (node, 'found' | 'not found')
+        """
+        bloom = None
+        if current_node_id is None and self.bloom is not None:
+            bloom = self.bloom
+            if not self.key_may_exist(bloom, x):
+                return None, 'not found'
+        start = len(held_latches())
+        try:
+            if current_node_id is None:
+                acquire_latch(self.root_latch)
+                current_node_id = self.root
+            while True:
+                self.latch_node(current_node_id)
+                release_ancestors(start)
+                current_node = self.read_node(current_node_id)
+                if current_node is None:
+                    return current_node, 'not found'
+
+                keys_only = [k for k, _ in current_node.keys]
+                pos = bisect.bisect_left(keys_only, x)
+                if pos < len(keys_only) and keys_only[pos] == x:
+                    return current_node, 'found'
+                if current_node.leaf:
+                    if bloom is not None:
+                        bloom.record_false_positive()
+                    return current_node, 'not found'
+                current_node_id = current_node.children[pos]
+        finally:
+            release_latches(start)
+
+    def key_may_exist(self, bloom, x):
+        """
+        Ask the Bloom filter about key x, counting the node reads a definite miss saves.
+        """
+        if bloom.might_contain(x):
+            return True
+        bloom.record_negative(len(self.stats.level_nodes))
+        self.tracer.emit("bloom_negative", key=x)
+        return False
+
+    @timed_phase("descent")
+    def descend_for_update(self, x, is_safe):
+        """
+        Latch-coupled descent for writers.
+
+        Every node on the path is latched exclusively. As soon as a node is safe,
+        i.e. the pending change cannot propagate to its parent, the latches above
+        it are released. The remaining latches are left to the caller.
+
+        Parameters:
+        - x (int): Key to look for.
+        - is_safe (callable): Predicate telling whether a node is safe for the operation.
+
+        Returns:
+        - (node, 'found' | 'not found') as search_key.
+        """
+        start = len(held_latches())
+        acquire_latch(self.root_latch, exclusive=True)
+        node_id = self.root
+        while True:
+            self.latch_node(node_id, exclusive=True)
+            node = self.read_node(node_id)
+            if is_safe(node):
+                release_ancestors(start)
+
+            keys_only = [k for k, _ in node.keys]
+            pos = bisect.bisect_left(keys_only, x)
+            if pos < len(keys_only) and keys_only[pos] == x:
+                return node, 'found'
+            if node.leaf:
+                return node, 'not found'
+            node_id = node.children[pos]
+
+    def is_safe_for_insert(self, node):
+        # One more key neither splits the node nor moves keys through its parent
+        return len(node.keys) < self.max_keys
+
+    def is_safe_for_delete(self, node):
+        # One key less neither underflows the node nor collapses the root
+        if node.parent_id == -1:
+            return node.leaf or len(node.keys) > 1
+        return len(node.keys) > self.min_keys
+
+    def range_search(self, lo, hi, limit=None):
+        """
+        Collect the (key, page) pairs with lo <= key <= hi in key order.
+
+        The nodes from the root down to the one being visited stay latched in
+        shared mode, so no split or merge can move keys under the scan.
+
+        Parameters:
+        - limit (int): Stop after this many pairs, the first ones; all by default.
+        """
+        start = len(held_latches())
+        results = []
+        try:
+            acquire_latch(self.root_latch)
+            self.collect_range(self.root, lo, hi, results, limit)
+        finally:
+            release_latches(start)
+        return results
+
+    def collect_range(self, node_id, lo, hi, results, limit=None):
+        start = len(held_latches())
+        self.latch_node(node_id)
+        node = self.read_node(node_id)
+        # Child i holds the keys between keys[i - 1] and keys[i]
+        i = bisect.bisect_left([k for k, _ in node.keys], lo)
+        while True:
+            if not node.leaf:
+                self.collect_range(node.children[i], lo, hi, results, limit)
+            if i >= len(node.keys) or node.keys[i][0] > hi or (limit is not None and len(results) >= limit):
+                break
+            results.append(node.keys[i])
+            i += 1
+        release_latches(start)
+
+    # -------------------------------------------------------
+    # Insert
+    # -------------------------------------------------------
+    def add_key_to_node(self, node, key, page):
+        if node is None:
+            return
+
+        keys_only = [k[0] for k in node.keys]
+        insert_pos = bisect.bisect_left(keys_only, key)
+        node.keys.insert(insert_pos, (key, page))
+        self.save_node(node)
+
+        if len(node.keys) > self.max_keys:
+            appending = self.is_sequential_append(node, key)
+            if node.parent_id == -1:
+                self.split_node(node, append=appending)
+            elif appending:
+                # Left siblings of an append run are full, compensation would only cost reads
+                self.split_node(node, append=True)
+            else:
+                self.try_compensation(node, key, page)
+
+    def is_sequential_append(self, node, key):
+        """
+        Check whether key was appended to the rightmost leaf during an append run.
+        """
+        return (node.node_id == self.rightmost_leaf_hint and self.append_run >= APPEND_RUN_THRESHOLD
+                and node.keys[-1][0] == key)
+
+    def insert_key(self, x, a, loading=False, rid=None):
+        # The filter is checked before the write gate is taken, since growing it takes the gate
+        if self.bloom is not None and self.bloom.count >= self.bloom.capacity:
+            self.grow_bloom()
+        start = len(held_latches())
+        self.write_gate.acquire_read()
+        try:
+            node = None
+            is_append = self.max_key_hint is None or x > self.max_key_hint
+            hinted_leaf = self.rightmost_leaf_hint
+            if hinted_leaf is not None and is_append:
+                # Every separator is below x, so the descent would end in the rightmost leaf.
+                # Only a safe leaf can be used: its parent is not latched.
+                self.latch_node(hinted_leaf, exclusive=True)
+                node = self.read_node(hinted_leaf)
+                # Checked again under the hint latch: an insert elsewhere may have raised the hint
+                with self.append_hint_latch:
+                    usable = (self.rightmost_leaf_hint == hinted_leaf
+                              and (self.max_key_hint is None or x > self.max_key_hint)
+                              and self.is_safe_for_insert(node))
+                if usable:
+                    is_found = 'not found'
+                else:
+                    release_latches(start)
+                    node = None
+            if node is None:
+                node, is_found = self.descend_for_update(x, self.is_safe_for_insert)
+                if is_append:
+                    with self.append_hint_latch:
+                        if self.max_key_hint is not None and x > self.max_key_hint:
+                            self.rightmost_leaf_hint = node.node_id
+            print(f'POSITION {node.node_id}')
+            if is_found == 'found':
+                return 'ALREADY EXISTS!'
+
+            if not os.path.exists(self.files['main_file']):
+                return 'ERROR: Main file not found!'
+
+            # Raised before x becomes visible, so the hint never falls below a key of the tree
+            with self.append_hint_latch:
+                if self.max_key_hint is not None or self.rightmost_leaf_hint is not None:
+                    self.append_run = self.append_run + 1 if is_append else 0
+                    self.max_key_hint = x if self.max_key_hint is None else max(self.max_key_hint, x)
+
+            if not loading:
+                new_record = Record(x, a[0], a[1], a[2])
+                # The leaf holds the keys next to x, predecessor first
+                pos = bisect.bisect_left([k for k, _ in node.keys], x)
+                near = [rid_page(rid) for _, rid in node.keys[max(0, pos - 1):pos + 1]]
+                rid = self.insert_record_in_main_file(new_record, near)
+
+            # Added before the key becomes visible, so the filter never denies a key of the tree
+            if self.bloom is not None:
+                self.bloom.add(x)
+            self.add_key_to_node(node, x, rid)
+            if self.record_cache is not None:
+                self.record_cache.invalidate(x)
+            for index in self.secondary_indexes.values():
+                index.add(x, a, rid)
+            if self.sketches:
+                for column, value in zip(PROBABILITY_COLUMNS, a):
+                    self.sketches[column].add(value)
+            self.stats.add_keys(1)
+            return 'OK'
+        finally:
+            release_latches(start)
+            self.write_gate.release()
+
+    @timed_phase("split")
+    def try_compensation(self, overflown_node, key, page, level=0):
+        parent = self.read_node(overflown_node.parent_id)
+        if parent is None:
+            return False
+
+        try:
+            idx = parent.children.index(overflown_node.node_id)
+        except ValueError:
+            print(f"Node {overflown_node.node_id} is not a child of its parent {overflown_node.parent_id}.")
+            return False
+
+        left_sibling_id = parent.children[idx - 1] if idx > 0 else None
+        right_sibling_id = parent.children[idx + 1] if idx < len(parent.children) - 1 else None
+
+        combined_keys = []
+        combined_children = []
+        left_sibling = None
+        right_sibling = None
+
+        if left_sibling_id is not None:
+            self.latch_node(left_sibling_id, exclusive=True)
+            left_sibling = self.read_node(left_sibling_id)
+            if len(left_sibling.keys) < self.max_keys:
+                combined_keys.extend(left_sibling.keys)
+                combined_keys.append(parent.keys[idx - 1])
+                combined_keys.extend(overflown_node.keys)
+
+                if not overflown_node.leaf:
+                    combined_children.extend(left_sibling.children)
+                    combined_children.extend(overflown_node.children)
+                    previous_parent = children_owners(left_sibling, overflown_node)
+
+                mid_index = len(combined_keys) // 2
+                parent.keys[idx - 1] = combined_keys[mid_index]
+
+                left_sibling.keys = combined_keys[:mid_index]
+                overflown_node.keys = combined_keys[mid_index + 1:]
+
+                if not overflown_node.leaf:
+                    left_sibling.children = combined_children[:mid_index + 1]
+                    overflown_node.children = combined_children[mid_index + 1:]
+                    self.reparent_children((left_sibling, overflown_node), previous_parent)
+
+                self.save_node(left_sibling)
+                self.save_node(overflown_node)
+                self.save_node(parent)
+                self.tracer.emit("compensation", node=overflown_node.node_id, sibling=left_sibling.node_id)
+                return True
+
+        if right_sibling_id is not None:
+            self.latch_node(right_sibling_id, exclusive=True)
+            right_sibling = self.read_node(right_sibling_id)
+            if len(right_sibling.keys) < self.max_keys:
+                combined_keys.extend(overflown_node.keys)
+                combined_keys.append(parent.keys[idx])
+                combined_keys.extend(right_sibling.keys)
+
+                if not overflown_node.leaf:
+                    combined_children.extend(overflown_node.children)
+                    combined_children.extend(right_sibling.children)
+                    previous_parent = children_owners(overflown_node, right_sibling)
+
+                mid_index = len(combined_keys) // 2
+                parent.keys[idx] = combined_keys[mid_index]
+
+                overflown_node.keys = combined_keys[:mid_index]
+                right_sibling.keys = combined_keys[mid_index + 1:]
+
+                if not overflown_node.leaf:
+                    overflown_node.children = combined_children[:mid_index + 1]
+                    right_sibling.children = combined_children[mid_index + 1:]
+                    self.reparent_children((overflown_node, right_sibling), previous_parent)
+
+                self.save_node(overflown_node)
+                self.save_node(right_sibling)
+                self.save_node(parent)
+                self.tracer.emit("compensation", node=overflown_node.node_id, sibling=right_sibling.node_id)
+                return True
+
+        # Both neighbours are full
+        if self.config.split_policy == "bstar":
+            if right_sibling is not None:
+                self.split_two_to_three(overflown_node, right_sibling, parent, idx, level)
+                return False
+            if left_sibling is not None:
+                self.split_two_to_three(left_sibling, overflown_node, parent, idx - 1, level)
+                return False
+
+        self.split_node(overflown_node, level=level)
+        return False
+
+    def reparent_children(self, nodes, previous_parent):
+        """
+        Update parent_id of the children that moved between nodes during a redistribution.
+        """
+        for owner in nodes:
+            for child_id in owner.children:
+                if previous_parent.get(child_id) != owner.node_id:
+                    self.latch_node(child_id, exclusive=True)
+                    child_node = self.read_node(child_id)
+                    child_node.parent_id = owner.node_id
+                    self.save_node(child_node)
+
+    @timed_phase("split")
+    def split_two_to_three(self, left_node, right_node, parent, parent_key_idx, level=0):
+        """
+        B*-tree split: redistribute two full siblings and their separator into three nodes.
+
+        The left and middle nodes are filled up to config.fill_factor, the right node
+        takes the rest. Two separators go to the parent instead of one.
+
+        Parameters:
+        - left_node (BTreeNode): Left sibling, parent.children[parent_key_idx].
+        - right_node (BTreeNode): Right sibling, parent.children[parent_key_idx + 1].
+        - parent (BTreeNode): Common parent of both siblings.
+        - parent_key_idx (int): Index of the separator between the siblings in parent.keys.
+        - level (int): Level of the siblings, counted from the leaves.
+        """
+        self.tracer.emit("split_two_to_three", node=left_node.node_id, sibling=right_node.node_id)
+        combined_keys = left_node.keys + [parent.keys[parent_key_idx]] + right_node.keys
+        combined_children = left_node.children + right_node.children
+        previous_parent = children_owners(left_node, right_node)
+
+        # Two keys move up to the parent, the rest is shared by the three nodes
+        total = len(combined_keys) - 2
+        target = max(self.min_keys, min(self.max_keys, round(self.config.fill_factor * self.max_keys)))
+        while target > self.min_keys and total - 2 * target < self.min_keys:
+            target -= 1
+        left_count = target
+        middle_count = min(target, total - left_count - self.min_keys)
+
+        new_node_id = self.allocate_node_id()
+        middle_node = BTreeNode(new_node_id, leaf=left_node.leaf, parent_id=parent.node_id)
+        self.stats.add_node(level)
+
+        first_separator = combined_keys[left_count]
+        second_separator = combined_keys[left_count + 1 + middle_count]
+        left_node.keys = combined_keys[:left_count]
+        middle_node.keys = combined_keys[left_count + 1:left_count + 1 + middle_count]
+        right_node.keys = combined_keys[left_count + 2 + middle_count:]
+
+        if not left_node.leaf:
+            left_node.children = combined_children[:left_count + 1]
+            middle_node.children = combined_children[left_count + 1:left_count + middle_count + 2]
+            right_node.children = combined_children[left_count + middle_count + 2:]
+            self.reparent_children((left_node, middle_node, right_node), previous_parent)
+
+        self.save_node(left_node)
+        self.save_node(middle_node)
+        self.save_node(right_node)
+
+        parent.keys[parent_key_idx] = first_separator
+        parent.keys.insert(parent_key_idx + 1, second_separator)
+        parent.children.insert(parent_key_idx + 1, middle_node.node_id)
+        self.save_node(parent)
+
+        # The parent gained a key and may overflow in turn
+        if len(parent.keys) > self.max_keys:
+            if parent.parent_id == -1:
+                self.split_node(parent, level=level + 1)
+            else:
+                self.try_compensation(parent, second_separator[0], second_separator[1], level + 1)
+
+    @timed_phase("split")
+    def split_node(self, overflown_node, append=False, level=0):
+        # Step 1: Allocate a new node
+        new_node_id = self.allocate_node_id()
+        self.stats.add_node(level)
+
+        new_node = BTreeNode(new_node_id, leaf=overflown_node.leaf, parent_id=overflown_node.parent_id)
+        self.tracer.emit("split", node=overflown_node.node_id, new_node=new_node_id, append=append)
+
+        # Step 2: Redistribute keys and children
+        if append:
+            # Asymmetric split of the rightmost node: the left node stays (nearly) full
+            # and the new right node receives the following appends
+            mid_index = max(self.min_keys, math.ceil(APPEND_SPLIT_FILL * self.max_keys))
+            mid_index = min(mid_index, len(overflown_node.keys) - (1 if overflown_node.leaf else 2))
+        else:
+            mid_index = len(overflown_node.keys) // 2
+        middle_key = overflown_node.keys[mid_index]
+
+        # Assign keys to the new node
+        new_node.keys = overflown_node.keys[mid_index + 1:]
+        overflown_node.keys = overflown_node.keys[:mid_index]
+
+        # Assign children to the new node if not a leaf
+        if not overflown_node.leaf:
+            new_node.children = overflown_node.children[mid_index + 1:]
+            overflown_node.children = overflown_node.children[:mid_index + 1]
+
+            # Update parent_id for the children of the new node
+            for child_id in new_node.children:
+                self.latch_node(child_id, exclusive=True)
+                child_node = self.read_node(child_id)
+                child_node.parent_id = new_node.node_id
+                self.save_node(child_node)
+
+        with self.append_hint_latch:
+            if overflown_node.node_id == self.rightmost_leaf_hint:
+                self.rightmost_leaf_hint = new_node.node_id
+
+        # Save the updated nodes
+        self.save_node(overflown_node)
+        self.save_node(new_node)
+
+        # Step 3: Insert the middle key into the parent node
+        if overflown_node.parent_id == -1:
+            # Create a new root if the overflown node is the root
+            new_root_id = self.allocate_node_id()
+            self.stats.add_node(level + 1)
+
+            new_root = BTreeNode(new_root_id, leaf=False, parent_id=-1,
+                                 children=[overflown_node.node_id, new_node.node_id])
+            new_root.keys = [middle_key]
+
+            # Update parent_id of the split nodes
+            overflown_node.parent_id = new_root_id
+            new_node.parent_id = new_root_id
+
+            self.save_node(overflown_node)
+            self.save_node(new_node)
+            self.save_node(new_root)
+
+            self.root = new_root_id
+        else:
+            # Insert the middle key into the parent node
+            parent_node = self.read_node(overflown_node.parent_id)
+            insert_pos = bisect.bisect_left([k[0] for k in parent_node.keys], middle_key[0])
+
+            parent_node.keys.insert(insert_pos, middle_key)
+            print(f'INSERTT POSSS {insert_pos}')
+            print(f'{new_node.keys}')
+            parent_node.children.remove(overflown_node.node_id)
+            parent_node.children.insert(insert_pos, new_node.node_id)
+            parent_node.children.insert(insert_pos, overflown_node.node_id)
+
+            self.save_node(parent_node)
+
+            # Handle parent overflow if it occurs
+            if len(parent_node.keys) > self.max_keys:
+                self.split_node(parent_node, append=append and insert_pos == len(parent_node.keys) - 1,
+                                level=level + 1)
+
+    # -------------------------------------------------------
+    # Update and delete
+    # -------------------------------------------------------
+    def update_record(self, key, new_pA, new_pB, new_pAuB):
+        # The record ID is looked up under the write gate, so VACUUM cannot move the record meanwhile
+        self.write_gate.acquire_read()
+        try:
+            if self.page_index is not None:
+                # The index holds every key, so a miss needs no descent either
+                rid = self.page_index.get(key)
+                if rid is None:
+                    return 'Not_Found'
+            else:
+                node, found = self.search_key(key, None)
+                if found == 'not found':
+                    return 'Not_Found'
+
+                if node is None:
+                    return 'Error_Node_Read'
+
+                # Find which key matches
+                rid = None
+                for (k, p) in node.keys:
+                    if k == key:
+                        rid = p
+                        break
+
+                if rid is None:
+                    return 'Error_Data_Inconsistent'
+
+            page_num = rid_page(rid)
+            with self.page_cache_latch:
+                num_pages = max(os.path.getsize(self.files['main_file']) // self.page_size,
+                                max(self.page_cache, default=-1) + 1)
+            if page_num < 0 or page_num >= num_pages:
+                return 'Error_Invalid_Page'
+
+            with self.data_file_latch:
+                # Only the record is written; the key, and so the slot, do not change
+                updated_record = Record(key, new_pA, new_pB, new_pAuB)
+                old = self.update_record_in_main_file(rid, updated_record)
+                if old is None:
+                    return 'Error_Invalid_Slot'
+
+                self.metrics.record_write()
+                # After the write, so a reader that read the old record cannot cache it
+                if self.record_cache is not None:
+                    self.record_cache.update(key, updated_record)
+                for index in self.secondary_indexes.values():
+                    index.replace(key, (old.p_a, old.p_b, old.p_aub), (new_pA, new_pB, new_pAuB), rid)
+                for column, sketch in self.sketches.items():
+                    sketch.remove(getattr(old, column))
+                    sketch.add(getattr(updated_record, column))
+        finally:
+            self.write_gate.release()
+
+        return 'OK'
+
+    def delete_key(self, x):
+        bloom = self.bloom
+        if bloom is not None and not self.key_may_exist(bloom, x):
+            return 'Not_Found'
+
+        # Merges may free the rightmost leaf; it is looked up again on the next append
+        with self.append_hint_latch:
+            self.rightmost_leaf_hint = None
+
+        start = len(held_latches())
+        self.write_gate.acquire_read()
+        try:
+            node, found = self.descend_for_update(x, self.is_safe_for_delete)
+            if found == 'not found':
+                if bloom is not None:
+                    bloom.record_false_positive()
+                return 'Not_Found'
+
+            if node is None:
+                raise ValueError(f"Node {node.node_id} could not be read.")
+
+            # Find key in node
+            record_index = None
+            rid = None
+            for i, (k, p) in enumerate(node.keys):
+                if k == x:
+                    record_index = i
+                    rid = p
+                    break
+
+            if record_index is None:
+                raise ValueError("Key not found in node after searching. Data inconsistency!")
+
+            if node.leaf:
+                leaf = node
+                del leaf.keys[record_index]
+            else:
+                # Replace the key with its in-order predecessor, which always sits in a leaf.
+                # The path below stays latched: the leaf underflow may propagate up to here.
+                leaf_id = node.children[record_index]
+                while True:
+                    self.latch_node(leaf_id, exclusive=True)
+                    leaf = self.read_node(leaf_id)
+                    if leaf.leaf:
+                        break
+                    leaf_id = leaf.children[-1]
+                node.keys[record_index] = leaf.keys.pop()
+                self.save_node(node)
+
+            removed = self.remove_record_from_main_file(rid, x)
+            if self.record_cache is not None:
+                self.record_cache.invalidate(x)
+            if removed is not None:
+                for index in self.secondary_indexes.values():
+                    index.discard(x, (removed.p_a, removed.p_b, removed.p_aub))
+                for column, sketch in self.sketches.items():
+                    sketch.remove(getattr(removed, column))
+            # Saved before the underflow handling, which re-reads the nodes it changes
+            self.save_node(leaf)
+            # An emptied leaf is an underflow like any other; the root leaf may stay empty
+            if leaf.parent_id != -1 and len(leaf.keys) < self.min_keys:
+                self.handle_underflow(leaf)
+            self.stats.add_keys(-1)
+            if self.bloom is not None:
+                self.bloom.remove(x)
+            return 'OK'
+        finally:
+            release_latches(start)
+            self.write_gate.release()
+
+    @timed_phase("underflow")
+    def handle_underflow(self, node, level=0):
+        """
+        Handles underflow in a B-tree node through compensation or merging.
+
+        Parameters:
+        - node (BTreeNode): The node experiencing underflow.
+        - level (int): Level of the node, counted from the leaves.
+
+        Returns:
+        - None
+        """
+        if node.parent_id != -1:
+            parent = self.read_node(node.parent_id)
+        else:
+            return
+        self.tracer.emit("underflow", node=node.node_id)
+
+        idx = parent.children.index(node.node_id)
+
+        # Check left and right siblings
+        left_sibling_id = parent.children[idx - 1] if idx > 0 else None
+        right_sibling_id = parent.children[idx + 1] if idx < len(parent.children) - 1 else None
+        for sibling_id in (left_sibling_id, right_sibling_id):
+            if sibling_id is not None:
+                self.latch_node(sibling_id, exclusive=True)
+        left_sibling = self.read_node(left_sibling_id) if left_sibling_id is not None else None
+        right_sibling = self.read_node(right_sibling_id) if right_sibling_id is not None else None
+
+        # Try compensation with left sibling
+        if left_sibling and len(left_sibling.keys) > self.min_keys:
+            self.tracer.emit("compensation", node=node.node_id, sibling=left_sibling_id)
+            self.transfer_key_from_left(node, left_sibling, parent, idx - 1)
+            return
+
+        # Try compensation with right sibling
+        if right_sibling and len(right_sibling.keys) > self.min_keys:
+            self.tracer.emit("compensation", node=node.node_id, sibling=right_sibling_id)
+            self.transfer_key_from_right(node, right_sibling, parent, idx)
+            return
+
+        # If compensation is not possible, merge with a sibling
+        if left_sibling:
+            self.merge_nodes(left_sibling, node, parent, idx - 1, level)
+        elif right_sibling:
+            self.merge_nodes(node, right_sibling, parent, idx, level)
+
+    def transfer_key_from_left(self, node, left_sibling, parent, parent_key_idx):
+        # Transfer key from parent to node
+        node.keys.insert(0, parent.keys[parent_key_idx])
+        parent.keys[parent_key_idx] = left_sibling.keys.pop()
+
+        # Transfer child from left sibling to node (if not a leaf)
+        if not node.leaf:
+            self.latch_node(left_sibling.children[-1], exclusive=True)
+            child = self.read_node(left_sibling.children[-1])
+            child.parent_id = node.node_id
+            self.save_node(child)
+            node.children.insert(0, left_sibling.children.pop())
+
+        self.save_node(node)
+        self.save_node(left_sibling)
+        self.save_node(parent)
+
+    def transfer_key_from_right(self, node, right_sibling, parent, parent_key_idx):
+        # Transfer key from parent to node
+        node.keys.append(parent.keys[parent_key_idx])
+        parent.keys[parent_key_idx] = right_sibling.keys.pop(0)
+
+        # Transfer child from right sibling to node (if not a leaf)
+        if not node.leaf:
+            self.latch_node(right_sibling.children[0], exclusive=True)
+            child = self.read_node(right_sibling.children[0])
+            child.parent_id = node.node_id
+            self.save_node(child)
+            print(node.node_id)
+            print(child.node_id)
+            print(child.parent_id)
+
+            print(f'{right_sibling.children}')
+
+            node.children.append(right_sibling.children.pop(0))
+            print(f'{right_sibling.node_id}')
+
+            print(f'{right_sibling.children}')
+
+        self.save_node(node)
+        self.save_node(right_sibling)
+        self.save_node(parent)
+
+    def merge_nodes(self, left_node, right_node, parent, parent_key_idx, level=0):
+        """
+        Merges two sibling nodes into one and adjusts the parent.
+        """
+        self.tracer.emit("merge", node=left_node.node_id, freed=right_node.node_id)
+        merging_key = parent.keys.pop(parent_key_idx)
+        left_node.keys.append(merging_key)
+        left_node.keys.extend(right_node.keys)
+        left_node.children.extend(right_node.children)
+
+        if not right_node.leaf:
+            for child_id in right_node.children:
+                self.latch_node(child_id, exclusive=True)
+                child_node = self.read_node(child_id)
+                child_node.parent_id = left_node.node_id
+                self.save_node(child_node)
+
+        print(f'{left_node.keys}')
+        print(f'{parent.keys}')
+
+        parent.children.remove(right_node.node_id)
+        right_node.keys.clear()
+        right_node.children.clear()
+        self.save_node(left_node)
+        self.save_node(right_node)
+
+        self.save_node(parent)
+
+        self.stats.remove_node(level)
+        if len(parent.keys) < self.min_keys:
+            self.handle_underflow(parent, level + 1)
+        if len(parent.keys) == 0 and parent.parent_id == -1:
+            self.stats.remove_node(level + 1)
+            left_node.parent_id = parent.parent_id
+            self.save_node(left_node)
+            parent.children.clear()
+            self.save_node(parent)
+            self.save_node(left_node)
+            self.root = left_node.node_id
+        # Mark the right node as free. Its cached version would otherwise be
+        # written back over whatever reuses the slot.
+        with self.node_cache_latch:
+            self.node_cache.pop(right_node.node_id, None)
+        with self.append_hint_latch:
+            if self.rightmost_leaf_hint == right_node.node_id:
+                self.rightmost_leaf_hint = left_node.node_id
+        self.add_free_node(right_node.node_id)
+
+    # -------------------------------------------------------
+    # Snapshots
+    # -------------------------------------------------------
+    def create_snapshot(self):
+        """
+        Pin the current state of the tree and the data file.
+
+        Writers are held back only while the dirty cached nodes and the cached
+        pages are copied, which is bounded by the cache sizes.
+
+        Returns:
+        - Snapshot: The new snapshot.
+        """
+        self.write_gate.acquire_write()
+        try:
+            # Same order as evictions, which preserve under the cache latches
+            with self.node_cache_latch, self.page_cache_latch, self.snapshot_latch:
+                node_end = os.path.getsize(self.files['node_file']) // self.node_page_size
+                page_end = os.path.getsize(self.files['main_file']) // self.page_size
+                if self.page_cache:
+                    page_end = max(page_end, max(self.page_cache) + 1)
+                snap = Snapshot(self.next_snapshot_id, self.root, node_end, page_end, set(self.load_free_nodes()))
+                self.next_snapshot_id += 1
+                for node_id, (node, dirty) in self.node_cache.items():
+                    if dirty:
+                        snap.node_images[node_id] = node.to_bytes(self.max_keys, self.node_page_size,
+                                                                  self.key_format)
+                # The page cache is write-back, cached pages are newer than the disk
+                for page_num, page_data in self.page_cache.items():
+                    snap.pages[page_num] = page_data
+                self.snapshots[snap.snapshot_id] = snap
+                return snap
+        finally:
+            self.write_gate.release()
+
+    def release_snapshot(self, snapshot_id):
+        """
+        Drop a snapshot and free the node copies no other snapshot uses.
+
+        Returns:
+        - int: Number of node slots returned to the free list.
+        """
+        with self.snapshot_latch:
+            snap = self.snapshots.pop(snapshot_id)
+            freed = 0
+            for copy_id in set(snap.node_copies.values()):
+                self.copy_refs[copy_id] -= 1
+                if self.copy_refs[copy_id] == 0:
+                    del self.copy_refs[copy_id]
+                    self.add_free_node(copy_id)
+                    freed += 1
+            return freed
+
+    def drop_snapshots(self):
+        # The files are recreated; their copies and images mean nothing any more
+        with self.snapshot_latch:
+            self.snapshots.clear()
+            self.copy_refs.clear()
+
+    def preserve_node(self, node_id):
+        """
+        Copy the on-disk version of a node slot aside for the snapshots that still need it.
+
+        Called before every overwrite of a node slot.
+        """
+        if not self.snapshots:
+            return
+        with self.snapshot_latch:
+            needing = [s for s in self.snapshots.values()
+                       if node_id < s.node_end and node_id not in s.free_nodes
+                       and node_id not in s.node_copies and node_id not in s.node_images]
+            if not needing:
+                return
+            node_filename = self.files['node_file']
+            with open(node_filename, "rb") as f:
+                f.seek(node_id * self.node_page_size)
+                data = f.read(self.node_page_size)
+            self.add_counters(nodes_loaded_from_disk=1, bytes_read=len(data))
+            copy_id = self.allocate_node_id()
+            # The copy slot may itself be an old free slot some snapshot still reads
+            self.preserve_node(copy_id)
+            with open(node_filename, "r+b") as f:
+                f.seek(copy_id * self.node_page_size)
+                f.write(data)
+                f.flush()
+            self.add_counters(nodes_saved_to_disk=1, bytes_written=len(data))
+            for snap in needing:
+                snap.node_copies[node_id] = copy_id
+            self.copy_refs[copy_id] = len(needing)
+
+    def preserve_page(self, page_num):
+        """
+        Keep the on-disk version of a data page for the snapshots that still need it.
+
+        Called before every overwrite of a data page.
+        """
+        if not self.snapshots:
+            return
+        with self.snapshot_latch:
+            needing = [s for s in self.snapshots.values() if page_num < s.page_end and page_num not in s.pages]
+            if not needing:
+                return
+            with open(self.files['main_file'], "rb") as f:
+                f.seek(page_num * self.page_size)
+                data = f.read(self.page_size)
+            self.add_counters(pages_loaded_from_disk=1, bytes_read=len(data))
+            for snap in needing:
+                snap.pages[page_num] = data
+
+    def read_snapshot_node(self, snap, node_id):
+        """
+        Read a node as it was when the snapshot was taken. The node cache is not used.
+        """
+        with self.snapshot_latch:
+            if node_id in snap.node_images:
+                return BTreeNode.from_bytes(snap.node_images[node_id], self.max_keys, self.key_format)
+            slot = snap.node_copies.get(node_id, node_id)
+            with open(self.files['node_file'], "rb") as f:
+                f.seek(slot * self.node_page_size)
+                data = f.read(self.node_page_size)
+        self.add_counters(nodes_loaded_from_disk=1, bytes_read=self.node_page_size)
+        return BTreeNode.from_bytes(data, self.max_keys, self.key_format)
+
+    def read_snapshot_page(self, snap, page_num):
+        with self.snapshot_latch:
+            data = snap.pages.get(page_num)
+            if data is None:
+                with open(self.files['main_file'], "rb") as f:
+                    f.seek(page_num * self.page_size)
+                    data = f.read(self.page_size)
+        self.add_counters(pages_loaded_from_disk=1, bytes_read=len(data))
+        return Page.unpack(data)
+
+    def load_snapshot_nodes(self, snap):
+        """
+        Collect the nodes reachable from the snapshot root, in the format of load_all_nodes.
+        """
+        nodes = []
+        pending = [snap.root]
+        while pending:
+            node = self.read_snapshot_node(snap, pending.pop())
+            nodes.append({
+                "id": node.node_id,
+                "leaf": node.leaf,
+                "keys": node.keys,
+                "children": node.children
+            })
+            if not node.leaf:
+                pending.extend(reversed(node.children))
+        return nodes
+
+    def find_snapshot(self, token):
+        try:
+            snap = self.snapshots.get(int(token))
+        except ValueError:
+            snap = None
+        if snap is None:
+            print(f"No snapshot {token}. Use SNAPSHOT LIST to see the snapshots.")
+        return snap
+
+    def print_snapshot(self, snap):
+        for p in range(snap.page_end):
+            print_page(p, self.read_snapshot_page(snap, p))
+
+    def iter_records(self, lo=None, hi=None):
+        """
+        Yield the records of the tree in key order, as they were when iteration began.
+
+        The records are read through a snapshot, so writers carry on meanwhile,
+        by an in-order walk that holds one node per level. Data pages go through
+        an LRU of EXPORT_PAGE_BUFFER pages of its own, so memory does not grow
+        with the tree and the caches are left alone. The snapshot is released
+        when the generator is exhausted or closed.
+
+        Parameters:
+        - lo, hi (int): Key bounds, inclusive; None for no bound.
+        """
+        snap = self.create_snapshot()
+        try:
+            pages = OrderedDict()  # page number -> slots
+
+            def first_index(node):
+                return 0 if lo is None else bisect.bisect_left([k for k, _ in node.keys], lo)
+
+            root = self.read_snapshot_node(snap, snap.root)
+            # [node, index of the next key, whether the child left of that key was visited]
+            stack = [[root, first_index(root), False]]
+            while stack:
+                frame = stack[-1]
+                node, i, visited = frame
+                if not node.leaf and not visited:
+                    frame[2] = True
+                    child = self.read_snapshot_node(snap, node.children[i])
+                    stack.append([child, first_index(child), False])
+                    continue
+                if i == len(node.keys):
+                    stack.pop()
+                    continue
+                key, rid = node.keys[i]
+                if hi is not None and key > hi:
+                    return
+                frame[1], frame[2] = i + 1, False
+                page_num, slot = rid_page(rid), rid_slot(rid)
+                if page_num in pages:
+                    pages.move_to_end(page_num)
+                else:
+                    pages[page_num] = self.read_snapshot_page(snap, page_num).slots
+                    if len(pages) > EXPORT_PAGE_BUFFER:
+                        pages.popitem(last=False)
+                slots = pages[page_num]
+                if slot >= len(slots) or slots[slot] is None or slots[slot].key != key:
+                    raise ValueError(f"Key {key} is missing from slot {slot} of data page {page_num}.")
+                yield slots[slot]
+        finally:
+            self.release_snapshot(snap.snapshot_id)
+
+    # -------------------------------------------------------
+    # Bulk loading
+    # -------------------------------------------------------
+    def bulk_load(self, records, count):
+        """
+        Fill an empty tree, bottom-up, from records sorted by key.
+
+        The shape of the tree is worked out from count before anything is
+        written: every node gets between min_keys and max_keys keys, as close
+        to config.fill_factor as the count allows. Nodes are numbered and
+        written in post-order, so the node file is written front to back, like
+        the data file, whose pages get fill_records records each in key order. Nothing
+        is read back and memory holds one node per level. The Bloom filter,
+        hash index and sketches are filled on the way.
+
+        Parameters:
+        - records (iterable): (key, p_a, p_b, p_aub) tuples in increasing key order.
+        - count (int): Number of records.
+
+        Returns:
+        - int: Number of records loaded.
+        """
+        if self.stats.keys:
+            raise ValueError("Only an empty tree can be bulk loaded.")
+        check_data_pages(-(-count // self.fill_records), self.page_size)
+        target = max(self.min_keys, min(self.max_keys, round(self.config.fill_factor * self.max_keys)))
+        # Fewest, most and targeted keys of a non-root subtree rooted at each level
+        least, most, aim = [self.min_keys], [self.max_keys], [target]
+        while most[-1] < count:
+            least.append(self.min_keys + (self.min_keys + 1) * least[-1])
+            most.append(self.max_keys + (self.max_keys + 1) * most[-1])
+            aim.append(target + (target + 1) * aim[-1])
+        height = len(most)
+
+        @functools.lru_cache(maxsize=None)
+        def child_sizes(n, level):
+            # Any number of children between these bounds can share the n keys
+            # less their separators evenly within the child bounds
+            fewest = -(-(n + 1) // (most[level - 1] + 1))
+            widest = (n + 1) // (least[level - 1] + 1)
+            c = max(2, fewest, min(widest, self.max_keys + 1, round((n + 1) / (aim[level - 1] + 1))))
+            size, extra = divmod(n - (c - 1), c)
+            return tuple(size + 1 if i < extra else size for i in range(c))
+
+        @functools.lru_cache(maxsize=None)
+        def subtree_nodes(n, level):
+            if level == 0:
+                return 1
+            return 1 + sum(subtree_nodes(size, level - 1) for size in child_sizes(n, level))
+
+        record_struct = struct.Struct(record_format)
+        directory = self.page_size - directory_size(self.max_records_per_page)
+        self.bloom = self.new_bloom(max(BLOOM_MIN_CAPACITY, 2 * count))  # room to grow before a rebuild
+        records = iter(records)
+        page = []  # packed records of the page being filled
+        page_keys = []
+        page_values = tuple([] for _ in PROBABILITY_COLUMNS)
+        loaded = 0
+        last_key = None
+        level_nodes = [0] * height
+        next_id = 0
+
+        with open(self.files['main_file'], "wb", buffering=BULK_BUFFER_BYTES) as data_file, \
+                open(self.files['node_file'], "wb", buffering=BULK_BUFFER_BYTES) as node_file:
+
+            def write_page():
+                # The records fill the first slots
+                data = bytearray(struct.pack('i', len(page)) + b''.join(page))
+                data.extend(bytes(self.page_size - len(data)))
+                for slot in range(len(page)):
+                    data[directory + (slot >> 3)] |= 1 << (slot & 7)
+                data_file.write(data)
+                self.add_counters(pages_saved_to_disk=1, bytes_written=self.page_size)
+                page.clear()
+                # The filter and the sketches take a page of records at a time
+                if self.bloom is not None:
+                    self.bloom.add_all(page_keys)
+                for column, values in zip(PROBABILITY_COLUMNS, page_values):
+                    self.sketches[column].add_all(values)
+                    values.clear()
+                page_keys.clear()
+
+            def next_entry():
+                nonlocal loaded, last_key
+                try:
+                    key, p_a, p_b, p_aub = next(records)
+                except StopIteration:
+                    raise ValueError(f"Expected {count} records, got {loaded}.") from None
+                if last_key is not None and key <= last_key:
+                    raise ValueError(f"Records are not in increasing key order at key {key}.")
+                rid = make_rid(loaded // self.fill_records, len(page))
+                page.append(record_struct.pack(key, p_a, p_b, p_aub))
+                page_keys.append(key)
+                for values, value in zip(page_values, (p_a, p_b, p_aub)):
+                    values.append(value)
+                if len(page) == self.fill_records:
+                    write_page()
+                if self.page_index is not None:
+                    self.page_index[key] = rid
+                loaded += 1
+                last_key = key
+                return key, rid
+
+            def build(n, level, parent_id):
+                nonlocal next_id
+                # The children come first in post-order, so the ID is known before them
+                node_id = next_id + subtree_nodes(n, level) - 1
+                node = BTreeNode(node_id, leaf=level == 0, parent_id=parent_id)
+                if level == 0:
+                    node.keys = [next_entry() for _ in range(n)]
+                else:
+                    sizes = child_sizes(n, level)
+                    for i, size in enumerate(sizes):
+                        node.children.append(build(size, level - 1, node_id))
+                        if i < len(sizes) - 1:
+                            node.keys.append(next_entry())
+                node_file.write(node.to_bytes(self.max_keys, self.node_page_size, self.key_format))
+                self.add_counters(nodes_saved_to_disk=1, bytes_written=self.node_page_size)
+                level_nodes[level] += 1
+                next_id = node_id + 1
+                if level == 0:
+                    self.rightmost_leaf_hint = node_id
+                return node_id
+
+            self.root = build(count, height - 1, -1)
+            if next(records, None) is not None:
+                raise ValueError(f"Expected {count} records, got more.")
+            if page or loaded == 0:
+                write_page()
+
+        num_pages = max(1, -(-count // self.fill_records))
+        self.last_page = num_pages
+        self.reserved_node_end = next_id
+        self.max_key_hint = last_key
+        self.append_run = 0
+        if self.fill_records < self.max_records_per_page:
+            self.save_underutilized_pages(list(range(num_pages)))
+        else:
+            self.save_underutilized_pages([num_pages - 1] if count % self.fill_records or count == 0 else [])
+        self.stats = TreeStats(count, 0, level_nodes)
+        self.save_quantile_sketches()
+        return loaded
+
+    # -------------------------------------------------------
+    # Vacuum
+    # -------------------------------------------------------
+    def vacuum(self, step_records=VACUUM_STEP_RECORDS):
+        """
+        Rewrite the records in key order, then truncate the data file.
+
+        The records are placed in steps of at most step_records, each under the
+        write gate: the i-th key in key order is swapped into slot position i,
+        counting fill_records slots per page (all of them unless
+        config.page_fill is below 1), and the entries pointing to the two
+        records are updated. Between steps
+        writers carry on. Records inserted behind the placed keys meanwhile are
+        placed after the others by the last step, which also drops the emptied
+        pages at the end of the file.
+
+        Returns:
+        - Vacuum: The finished VACUUM, with its counts.
+        """
+        with self.data_file_latch:
+            if self.vacuum_state is not None:
+                raise ValueError("A VACUUM is already running.")
+            self.vacuum_state = vacuum = Vacuum(self.data_page_count())
+        try:
+            while not self.vacuum_step(vacuum, step_records):
+                pass
+        finally:
+            self.vacuum_state = None
+        return vacuum
+
+    def vacuum_step(self, vacuum, limit):
+        """
+        Place the next limit keys after the cursor.
+
+        Returns:
+        - bool: True if the VACUUM is finished.
+        """
+        self.write_gate.acquire_write()
+        try:
+            with self.data_file_latch:
+                lo = -2 ** 31 if vacuum.cursor is None else vacuum.cursor + 1
+                entries = self.range_search(lo, 2 ** 31 - 1, limit)
+                # Record IDs of entries that were swapped out of the way earlier in this step
+                relocated = {}
+                for key, rid in entries:
+                    rid = relocated.pop(key, rid)
+                    occupant = self.place_record(vacuum, key, rid)
+                    if occupant is not None:
+                        relocated[occupant.key] = rid
+                    vacuum.cursor = key
+                done = len(entries) < limit
+                if done:
+                    for key in sorted(vacuum.late_keys):
+                        rid = self.find_rid(key)
+                        if rid is not None and self.fill_position(rid) >= vacuum.placed:
+                            self.place_record(vacuum, key, rid)
+                self.update_free_slots(vacuum.touched)
+                vacuum.touched.clear()
+                if done:
+                    self.truncate_data_file(vacuum)
+                vacuum.steps += 1
+                return done
+        finally:
+            self.write_gate.release()
+
+    def place_record(self, vacuum, key, rid):
+        """
+        Move a record to the next slot position; the record there, if any,
+        takes its old slot.
+
+        Returns:
+        - Record: The record that was moved out of the way, or None.
+        """
+        position = vacuum.placed
+        vacuum.placed += 1
+        target = make_rid(position // self.fill_records, position % self.fill_records)
+        if rid == target:
+            return None
+        source_num, target_num = rid_page(rid), rid_page(target)
+        source = self.read_page(source_num)
+        page = source if target_num == source_num else self.read_page(target_num)
+        slot = rid_slot(rid)
+        if slot >= len(source.slots) or source.slots[slot] is None or source.slots[slot].key != key:
+            raise ValueError(f"Key {key} is missing from slot {slot} of data page {source_num}.")
+        record = source.slots[slot]
+        page.slots.extend([None] * (rid_slot(target) + 1 - len(page.slots)))
+        occupant = page.slots[rid_slot(target)]
+        page.slots[rid_slot(target)] = record
+        source.slots[slot] = occupant
+        self.write_page(target_num, page)
+        if source is not page:
+            self.write_page(source_num, source)
+        for page_num, p in ((source_num, source), (target_num, page)):
+            vacuum.touched[page_num] = len(p.records) < self.max_records_per_page
+        vacuum.moved += 1
+
+        self.repoint_record(record, target)
+        if occupant is not None:
+            self.repoint_record(occupant, rid)
+        return occupant
+
+    def repoint_record(self, record, rid):
+        """
+        Point the tree, the hash index and the secondary indexes at the new slot of a record.
+        """
+        self.set_rid(record.key, rid)
+        if self.page_index is not None:
+            self.page_index[record.key] = rid
+        for index in self.secondary_indexes.values():
+            index.move(record.key, (record.p_a, record.p_b, record.p_aub), rid)
+
+    def set_rid(self, x, rid):
+        """
+        Point the entry of key x at another record ID; the nodes keep their keys.
+        """
+        start = len(held_latches())
+        try:
+            # Nothing propagates upwards, so every node is safe
+            node, found = self.descend_for_update(x, lambda node: True)
+            if found == 'not found':
+                raise ValueError(f"Key {x} is not in the tree.")
+            i = bisect.bisect_left([k for k, _ in node.keys], x)
+            node.keys[i] = (x, rid)
+            self.save_node(node)
+        finally:
+            release_latches(start)
+
+    def update_free_slots(self, pages):
+        """
+        Bring the underutilized page list up to date with one load and save.
+
+        Parameters:
+        - pages (dict): page number -> whether the page has a free slot.
+        """
+        if not pages:
+            return
+        underutilized = set(self.load_underutilized_pages())
+        underutilized.update(p for p, free in pages.items() if free)
+        underutilized.difference_update(p for p, free in pages.items() if not free)
+        self.save_underutilized_pages(sorted(underutilized))
+
+    def truncate_data_file(self, vacuum):
+        """
+        Cut the data file after the last page holding placed records.
+
+        The cut pages are kept for the snapshots that still read them, like any
+        overwritten page, and dropped from the page cache without being written.
+        """
+        end = max(1, -(-vacuum.placed // self.fill_records))
+        with self.page_cache_latch:
+            for page_num in range(end, self.data_page_count()):
+                self.preserve_page(page_num)
+                self.page_cache.pop(page_num, None)
+            os.truncate(self.files['main_file'], end * self.page_size)
+        self.last_page = end
+        # The steps kept the list up to date for the pages that remain
+        self.save_underutilized_pages([p for p in self.load_underutilized_pages() if p < end])
+
+    def fill_position(self, rid):
+        """
+        Slot position of a record ID as counted by VACUUM. The slots past
+        fill_records of a page are never placed into and count as its first.
+        """
+        slot = rid_slot(rid)
+        return rid_page(rid) * self.fill_records + (slot if slot < self.fill_records else 0)
+
+    def data_page_count(self):
+        """
+        Number of data pages, counting the cached pages not yet written to disk.
+        """
+        with self.page_cache_latch:
+            return max(os.path.getsize(self.files['main_file']) // self.page_size,
+                       max(self.page_cache, default=-1) + 1)
+
+    # -------------------------------------------------------
+    # Secondary indexes
+    # -------------------------------------------------------
+    def create_index(self, column):
+        """
+        Build a secondary index over one probability field of the records.
+
+        Writers are held off while the data file is scanned, so no record is
+        missed; from then on inserts, updates and deletes maintain the index.
+
+        Parameters:
+        - column (str): One of PROBABILITY_COLUMNS.
+
+        Returns:
+        - SecondaryIndex: The new index.
+        """
+        if column not in PROBABILITY_COLUMNS:
+            raise ValueError(f"Unknown column {column}; indexable columns are {', '.join(PROBABILITY_COLUMNS)}.")
+        if column in self.secondary_indexes:
+            raise ValueError(f"There is already an index on {column}.")
+        self.write_gate.acquire_write()
+        try:
+            index = SecondaryIndex(column, self.config, index_base_name(self.base_name, column))
+            for page_num, page in enumerate(self.scan_pages()):
+                for slot, r in enumerate(page.slots):
+                    if r is not None:
+                        index.add(r.key, (r.p_a, r.p_b, r.p_aub), make_rid(page_num, slot))
+            self.secondary_indexes[column] = index
+        finally:
+            self.write_gate.release()
+        return index
+
+    def select_between(self, column, lo, hi):
+        """
+        Find the records with lo <= column <= hi.
+
+        With an index on the column only the data pages holding matches are
+        read, each once; without one, every page is scanned. The write gate is
+        held shared, so VACUUM moves no record meanwhile.
+
+        Returns:
+        - (records, pages_read): The matching records in column order, and the
+          number of data pages read.
+        """
+        if column not in PROBABILITY_COLUMNS:
+            raise ValueError(f"Unknown column {column}; indexable columns are {', '.join(PROBABILITY_COLUMNS)}.")
+        self.write_gate.acquire_read()
+        try:
+            return self.select_records_between(column, lo, hi)
+        finally:
+            self.write_gate.release()
+
+    def select_records_between(self, column, lo, hi):
+        index = self.secondary_indexes.get(column)
+        if index is None:
+            records = []
+            pages_read = 0
+            for page in self.scan_pages():
+                pages_read += 1
+                records.extend(r for r in page.records if lo <= getattr(r, column) <= hi)
+            records.sort(key=lambda r: (getattr(r, column), r.key))
+            return records, pages_read
+
+        entries = index.lookup(lo, hi)
+        slots_by_page = defaultdict(list)
+        for key, rid in entries:
+            slots_by_page[rid_page(rid)].append((rid_slot(rid), key))
+        found = {}
+        for page_num in sorted(slots_by_page):
+            slots = self.read_page(page_num).slots
+            for slot, key in slots_by_page[page_num]:
+                r = slots[slot] if slot < len(slots) else None
+                # The index compares float32 values, so the bounds are checked again exactly
+                if r is not None and r.key == key and lo <= getattr(r, column) <= hi:
+                    found[key] = r
+        return [found[key] for key, _ in entries if key in found], len(slots_by_page)
+
+    def load_all_keys(self):
+        """
+        Traverse the B-tree and collect all existing keys.
+
+        The traversal reads a snapshot, so dirty cached nodes need not be
+        flushed first and writers keep going while it runs.
+
+        Returns:
+        - keys (set): A set containing all existing keys in the B-tree.
+        """
+        snap = self.create_snapshot()
+        try:
+            nodes = self.load_snapshot_nodes(snap)
+        finally:
+            self.release_snapshot(snap.snapshot_id)
+        keys = set()
+        for node in nodes:
+            for key_tuple in node["keys"]:
+                keys.add(key_tuple[0])
+        return keys
+
+    def addrandom(self, num_keys, key_min=1, key_max=10000):
+        """
+        Generates and inserts a specified number of random records into the B-tree,
+        ensuring that no duplicate keys are inserted.
+
+        Parameters:
+        - num_keys (int): Number of random keys to generate and insert.
+        - key_min (int): Minimum possible key value (inclusive).
+        - key_max (int): Maximum possible key value (inclusive).
+
+        Returns:
+        - inserted (int): Number of successfully inserted keys.
+        - skipped (int): Number of keys skipped due to duplication.
+        """
+        inserted = 0
+        skipped = 0
+        attempts = 0
+        max_attempts = num_keys * 10  # Prevent infinite loops
+
+        while inserted < num_keys and attempts < max_attempts:
+
+            key = random.randint(key_min, key_max)
+            pA = round(random.uniform(0.0, 1.0), 4)
+            pB = round(random.uniform(0.0, 1.0), 4)
+            pAuB = round(random.uniform(0.0, 1.0), 4)
+
+            print(f'Inserting key {key}...')
+            result = self.insert_key(key, (pA, pB, pAuB))
+
+            if result == 'ALREADY EXISTS!':
+                skipped += 1
+                print(f"Key {key} insertion skipped: already exists.")
+            elif result == 'OK':
+                inserted += 1
+                print(f"Key {key} inserted successfully.")
+            else:
+                print(f"Error inserting key {key}: {result}")
+
+            attempts += 1
+
+        print(f"ADDRANDOM completed: Inserted {inserted} keys, Skipped {skipped} duplicates.")
+        return inserted, skipped
+
+
+def index_base_name(base_name, column):
+    return f"{base_name}_idx_{column}"
+
+
+def sortable_float_bits(value):
+    """
+    Bits of value as a float32, mapped so that unsigned integer order is float order.
+    """
+    value = min(max(value, -3.4028234663852886e38), 3.4028234663852886e38)
+    bits = struct.unpack('<I', struct.pack('<f', value))[0]
+    return bits ^ 0xFFFFFFFF if bits & 0x80000000 else bits | 0x80000000
+
+
+def index_key(value, key):
+    """
+    Key of a secondary index entry: the value, then the record key to tell equal
+    values apart, as one signed 64-bit integer.
+    """
+    return ((sortable_float_bits(value) << 32) | (key + 2 ** 31)) - 2 ** 63
+
+
+def record_key(entry_key):
+    """
+    Record key of a secondary index entry, the inverse of the low half of index_key.
+    """
+    return ((entry_key + 2 ** 63) & 0xFFFFFFFF) - 2 ** 31
+
+
+class SecondaryIndex(BTree):
+    """
+    B-tree over one probability field of the records of another tree.
+
+    Entries are (index_key(value, key), rid): the record ID of the record in
+    the indexed tree, so a match costs one page read there. The
+    index keeps no records of its own; its files are named after the indexed
+    tree, <base_name>_idx_<column>, and are rebuilt with it on load.
+
+    Parameters:
+    - column (str): The indexed field, one of PROBABILITY_COLUMNS.
+    - config (BTreeConfig): Configuration of the indexed tree; its degree and
+      node and page cache sizes are reused, the Bloom filter, hash index and
+      record cache are not.
+    - base_name (str): Base name of the index files, created empty.
+    """
+    key_format = 'qi'
+
+    def __init__(self, column, config, base_name):
+        config = config.copy()
+        config.update({"bloom_bits_per_key": 0, "hash_index": False, "record_cache_size": 0})
+        super().__init__(config)
+        self.column = column
+        self.position = PROBABILITY_COLUMNS.index(column)
+        self.create(base_name)
+
+    def add(self, key, values, rid):
+        """
+        Index a record given its key, its (p_a, p_b, p_aub) values and its record ID.
+        """
+        self.insert_key(index_key(values[self.position], key), None, loading=True, rid=rid)
+
+    def discard(self, key, values):
+        self.delete_key(index_key(values[self.position], key))
+
+    def replace(self, key, old_values, new_values, rid):
+        if old_values[self.position] != new_values[self.position]:
+            self.discard(key, old_values)
+            self.add(key, new_values, rid)
+
+    def move(self, key, values, rid):
+        self.set_rid(index_key(values[self.position], key), rid)
+
+    def lookup(self, lo, hi):
+        """
+        Returns:
+        - list: (key, rid) of the records whose value lies in [lo, hi] at
+          float32 precision, in value order.
+        """
+        entries = self.range_search(index_key(lo, -2 ** 31), index_key(hi, 2 ** 31 - 1))
+        return [(record_key(entry_key), rid) for entry_key, rid in entries]
+
+    def new_sketches(self):
+        # Entry values are already sketched by the indexed tree
+        return {}
+
+    def remove_record_from_main_file(self, rid, key):
+        # The record belongs to the data file of the indexed tree, which changes it itself
+        return None
@@ -0,0 +1,237 @@
+import argparse
+import csv
+import struct
+import sys
+import threading
+import time
+from collections import defaultdict
+
+# Access traces and offline cache sizing.
+#
+# An AccessRecorder attached to a tree (main.py --trace-file) logs every node
+# and page access to a binary file. Replaying the trace with stack-distance
+# analysis gives the hit ratio of every cache size in a single pass:
+#
+#   python cachesim.py trace.bin --max-size 64 --csv curve.csv
+#
+# The trace file starts with TRACE_MAGIC, followed by one access_format
+# record per access: flags (bit 0: page rather than node, bit 1: write),
+# node or page ID, and nanoseconds since the recording started.
+
+TRACE_MAGIC = b"BTTRACE1"
+access_format = "<BIQ"
+access_size = struct.calcsize(access_format)
+
+PAGE_FLAG = 1
+WRITE_FLAG = 2
+
+# Trace events of btree.BTree that are accesses, and their flags
+ACCESS_EVENTS = {
+    "read_node": 0,
+    "save_node": WRITE_FLAG,
+    "read_page": PAGE_FLAG,
+    "write_page": PAGE_FLAG | WRITE_FLAG,
+    "write_record": PAGE_FLAG | WRITE_FLAG,
+}
+
+POLICIES = ("lru", "lfu")
+
+
+class AccessRecorder:
+    """
+    Append the node and page accesses of a tree, from all threads, to a trace file.
+
+    Attach it with tree.tracer.recorder = AccessRecorder(path) and close it when done.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, "wb")
+        self.file.write(TRACE_MAGIC)
+        self.lock = threading.Lock()
+        self.start = time.perf_counter_ns()
+        self.accesses = 0
+
+    def record_event(self, event, fields):
+        flags = ACCESS_EVENTS.get(event)
+        if flags is None:
+            return
+        item = fields["page"] if flags & PAGE_FLAG else fields["node"]
+        data = struct.pack(access_format, flags, item, time.perf_counter_ns() - self.start)
+        with self.lock:
+            self.file.write(data)
+            self.accesses += 1
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+def read_trace(path):
+    """
+    Read a trace file.
+
+    Returns:
+    - list: (flags, item, timestamp_ns) tuples in recording order.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(TRACE_MAGIC)) != TRACE_MAGIC:
+            raise ValueError(f"{path} is not an access trace")
+        data = f.read()
+    usable = len(data) - len(data) % access_size
+    return list(struct.iter_unpack(access_format, data[:usable]))
+
+
+def lru_stack_distances(items):
+    """
+    LRU stack distance of every reference: the number of distinct items
+    referenced since the previous reference to the same item, plus one.
+    A first reference has distance None.
+
+    A Fenwick tree over reference times marks the latest reference of every
+    item, so each distance costs O(log n).
+    """
+    n = len(items)
+    marks = [0] * (n + 1)
+
+    def add(i, delta):
+        i += 1
+        while i <= n:
+            marks[i] += delta
+            i += i & -i
+
+    def prefix(i):
+        # Number of marks at times < i
+        total = 0
+        while i > 0:
+            total += marks[i]
+            i -= i & -i
+        return total
+
+    last = {}
+    distances = []
+    for t, item in enumerate(items):
+        previous = last.get(item)
+        if previous is None:
+            distances.append(None)
+        else:
+            distances.append(prefix(t) - prefix(previous + 1) + 1)
+            add(previous, -1)
+        add(t, 1)
+        last[item] = t
+    return distances
+
+
+def lfu_stack_distances(items, max_size):
+    """
+    Stack distances under LFU, computed with Mattson's priority-stack update.
+
+    Priority is the number of references so far, ties going to the most
+    recent reference. Counts are kept for items outside the cache as well, so
+    this is perfect LFU. Only the top max_size stack positions are kept: deeper
+    references are misses for every cache size of interest (distance None).
+    """
+    counts = defaultdict(int)
+    last = {}
+    stack = []
+    distances = []
+    for t, item in enumerate(items):
+        try:
+            depth = stack.index(item)
+            distances.append(depth + 1)
+        except ValueError:
+            depth = len(stack)
+            distances.append(None)
+
+        if depth > 0:
+            # A cache holding the top i + 1 items misses and evicts the lowest
+            # priority one of them; the others keep their positions
+            carry = stack[0]
+            for i in range(1, depth):
+                other = stack[i]
+                if (counts[other], last[other]) < (counts[carry], last[carry]):
+                    stack[i] = carry
+                    carry = other
+            if depth < len(stack):
+                stack[depth] = carry
+            else:
+                stack.append(carry)
+            stack[0] = item
+        elif not stack:
+            stack.append(item)
+        del stack[max_size:]
+        counts[item] += 1
+        last[item] = t
+    return distances
+
+
+def hit_ratio_curve(distances, sizes):
+    """
+    Fraction of references that hit in a cache of each size.
+
+    A reference with stack distance d hits in every cache of size >= d.
+    """
+    histogram = defaultdict(int)
+    for d in distances:
+        if d is not None:
+            histogram[d] += 1
+    curve = {}
+    for size in sizes:
+        hits = sum(n for d, n in histogram.items() if d <= size)
+        curve[size] = hits / len(distances) if distances else 0.0
+    return curve
+
+
+def simulate(trace, sizes, include_writes=False):
+    """
+    Hit ratio curves of the node and page caches under every policy.
+
+    By default only reads are references, which matches the caches of the
+    tree: a save or write of an item that is not cached goes straight to disk,
+    and the counters only count reads as hits or misses. With include_writes
+    every access is a reference, as for a write-allocate cache.
+
+    Returns:
+    - dict: {(stream, policy): {size: hit ratio}}, stream being "node" or "page".
+    """
+    curves = {}
+    for stream in ("node", "page"):
+        page = stream == "page"
+        items = [item for flags, item, _ in trace
+                 if bool(flags & PAGE_FLAG) == page and (include_writes or not flags & WRITE_FLAG)]
+        curves[(stream, "lru")] = hit_ratio_curve(lru_stack_distances(items), sizes)
+        curves[(stream, "lfu")] = hit_ratio_curve(lfu_stack_distances(items, max(sizes)), sizes)
+    return curves
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hit ratio of every cache size from an access trace")
+    parser.add_argument('trace', help='Trace file written by main.py --trace-file')
+    parser.add_argument('--max-size', type=int, default=32, help='Largest cache size to report')
+    parser.add_argument('--step', type=int, default=1, help='Report every step-th cache size')
+    parser.add_argument('--include-writes', action='store_true',
+                        help='Count node saves and page writes as references too (write-allocate caches)')
+    parser.add_argument('--csv', help='Also write the curves to this CSV file')
+    args = parser.parse_args()
+
+    try:
+        trace = read_trace(args.trace)
+    except (OSError, ValueError) as e:
+        print(e)
+        sys.exit(1)
+    sizes = list(range(0, args.max_size + 1, args.step))
+    curves = simulate(trace, sizes, args.include_writes)
+    nodes = sum(1 for flags, _, _ in trace if not flags & PAGE_FLAG)
+    print(f"{len(trace)} accesses: {nodes} to nodes, {len(trace) - nodes} to pages")
+
+    columns = [f"{stream}_{policy}" for stream in ("node", "page") for policy in POLICIES]
+    print(f"{'size':>6} " + " ".join(f"{c:>9}" for c in columns))
+    rows = []
+    for size in sizes:
+        row = [curves[(stream, policy)][size] for stream in ("node", "page") for policy in POLICIES]
+        rows.append([size] + [round(r, 6) for r in row])
+        print(f"{size:>6} " + " ".join(f"{r:>9.3f}" for r in row))
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["size"] + columns)
+            writer.writerows(rows)
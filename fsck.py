@@ -0,0 +1,398 @@
+import argparse
+import os
+import struct
+import sys
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+from btree import (BTree, BTreeConfig, directory_size, load_int_list_from_file, rid_page, rid_slot, slot_offset,
+                   slot_used, tree_files)
+
+# Structural verifier for the node and data files of a tree.
+#
+# Workers of a process pool read ranges of the node file in large sequential
+# chunks and check every node on its own: sorted keys, key count, children
+# matching the leaf flag. They send back compact arrays of what the global
+# checks need: parent, first and last key of every node, every parent-child
+# edge with the separators bounding the child, and every (key, record ID) pointer.
+# The main process walks the tree from the root over those arrays and checks
+# parent/child consistency, key ranges, leaf depth, key counts against
+# min_keys/max_keys and reachability against the free-node list. The pointers
+# of the reachable nodes are then split by page range, and a second round of
+# workers reads the data file sequentially to check that every pointer hits a
+# record with its key in its slot and that every record is pointed to.
+#
+#   python fsck.py <base_name> [--jobs 8]
+#
+# The files must be flushed: the verifier reads them directly, not through the
+# caches of an open tree.
+
+CHUNK_BYTES = 8 * 1024 * 1024
+MAX_MESSAGES = 100
+
+# Bounds of a child with no separator on that side; keys are 32-bit ints
+NO_LOW = -2 ** 31 - 1
+NO_HIGH = 2 ** 31
+
+
+class Report:
+    """
+    Errors and warnings found by a verification, with the first MAX_MESSAGES of each kept.
+    """
+
+    def __init__(self):
+        self.errors = []
+        self.warnings = []
+        self.error_count = 0
+        self.warning_count = 0
+        self.summary = {}
+
+    def error(self, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_MESSAGES:
+            self.errors.append(message)
+
+    def warning(self, message):
+        self.warning_count += 1
+        if len(self.warnings) < MAX_MESSAGES:
+            self.warnings.append(message)
+
+    def print(self):
+        for name, value in self.summary.items():
+            print(f"{name.replace('_', ' ').capitalize()}: {value}")
+        for message in self.warnings:
+            print(f"WARNING: {message}")
+        if self.warning_count > len(self.warnings):
+            print(f"... {self.warning_count - len(self.warnings)} more warnings")
+        for message in self.errors:
+            print(f"ERROR: {message}")
+        if self.error_count > len(self.errors):
+            print(f"... {self.error_count - len(self.errors)} more errors")
+        print(f"{self.error_count} errors, {self.warning_count} warnings.")
+
+
+def check_node_range(node_file, start, end, max_keys, node_page_size):
+    """
+    Read nodes start..end-1 and check each of them on its own.
+
+    Returns:
+    - dict: Per-node arrays (ids, parents, leaf flags, key counts, first and
+      last keys), the child edges (owner, child, low and high separator), the
+      pointers (owner, key, record ID) and the local problems as (node_id, message).
+    """
+    node_struct = struct.Struct(f"=iBii{2 * max_keys}i{max_keys + 1}i")
+    count = end - start
+    result = {
+        "ids": array('i', [0]) * count, "parents": array('i', [0]) * count, "leaf": bytearray(count),
+        "nkeys": array('i', [0]) * count, "first": array('i', [0]) * count, "last": array('i', [0]) * count,
+        "child_owner": array('i'), "child_id": array('i'), "child_low": array('q'), "child_high": array('q'),
+        "ptr_owner": array('i'), "ptr_key": array('i'), "ptr_rid": array('i'),
+        "problems": [],
+    }
+    nodes_per_chunk = max(1, CHUNK_BYTES // node_page_size)
+    with open(node_file, "rb") as f:
+        f.seek(start * node_page_size)
+        node_id = start
+        while node_id < end:
+            data = f.read(min(nodes_per_chunk, end - node_id) * node_page_size)
+            if not data:
+                break
+            for offset in range(0, len(data) - node_page_size + 1, node_page_size):
+                i = node_id - start
+                fields = node_struct.unpack_from(data, offset)
+                stored_id, leaf_byte, n, parent = fields[0], fields[1], fields[2], fields[3]
+                pairs = fields[4:4 + 2 * max_keys]
+                children = [c for c in fields[4 + 2 * max_keys:] if c != -1]
+                result["ids"][i] = stored_id
+                result["parents"][i] = parent
+                result["leaf"][i] = leaf_byte == 1
+
+                if stored_id != node_id:
+                    result["problems"].append((node_id, f"node {node_id} stores the ID {stored_id}"))
+                if not 0 <= n <= max_keys:
+                    result["problems"].append((node_id, f"node {node_id} has {n} keys, more than max_keys {max_keys}"))
+                    n = max(0, min(n, max_keys))
+                result["nkeys"][i] = n
+                keys = pairs[0:2 * n:2]
+                if n:
+                    result["first"][i] = keys[0]
+                    result["last"][i] = keys[-1]
+                if any(a >= b for a, b in zip(keys, keys[1:])):
+                    result["problems"].append((node_id, f"keys of node {node_id} are not strictly increasing"))
+                if leaf_byte == 1 and children:
+                    result["problems"].append((node_id, f"leaf {node_id} has {len(children)} children"))
+                if leaf_byte != 1 and len(children) != n + 1:
+                    result["problems"].append(
+                        (node_id, f"internal node {node_id} has {n} keys but {len(children)} children"))
+
+                result["ptr_owner"].extend([node_id] * n)
+                result["ptr_key"].extend(keys)
+                result["ptr_rid"].extend(pairs[1:2 * n:2])
+                if leaf_byte != 1:
+                    for c, child in enumerate(children):
+                        result["child_owner"].append(node_id)
+                        result["child_id"].append(child)
+                        result["child_low"].append(keys[c - 1] if 0 < c <= n else NO_LOW)
+                        result["child_high"].append(keys[c] if c < n else NO_HIGH)
+                node_id += 1
+    return result
+
+
+def check_page_range(main_file, start, end, page_size, max_records, ptr_rids, ptr_keys):
+    """
+    Read data pages start..end-1, check their slots and match them against
+    the pointers of the tree into those pages.
+
+    Returns:
+    - tuple: (problems, number of records read).
+    """
+    expected = {}
+    for rid, key in zip(ptr_rids, ptr_keys):
+        expected.setdefault(rid_page(rid), {})[rid_slot(rid)] = key
+    problems = []
+    records = 0
+    pages_per_chunk = max(1, CHUNK_BYTES // page_size)
+    size = directory_size(max_records)
+    with open(main_file, "rb") as f:
+        f.seek(start * page_size)
+        page_num = start
+        while page_num < end:
+            data = f.read(min(pages_per_chunk, end - page_num) * page_size)
+            if not data:
+                break
+            for offset in range(0, len(data) - page_size + 1, page_size):
+                n = struct.unpack_from('i', data, offset)[0]
+                directory = data[offset + page_size - size:offset + page_size]
+                if max_records & 7 and directory[max_records >> 3] >> (max_records & 7):
+                    problems.append(f"the slot directory of page {page_num} marks slots past the last one")
+                used = [slot for slot in range(max_records) if slot_used(directory, n, slot)]
+                if n != len(used) or not 0 <= n <= max_records:
+                    problems.append(f"page {page_num} claims {n} records, its slot directory {len(used)}")
+                present = {slot: struct.unpack_from('i', data, offset + slot_offset(slot))[0] for slot in used}
+                records += len(present)
+                if len(set(present.values())) != len(present):
+                    problems.append(f"page {page_num} holds a key twice")
+                wanted = expected.pop(page_num, {})
+                for slot, key in sorted(wanted.items()):
+                    if slot not in present:
+                        problems.append(f"key {key} points to free slot {slot} of page {page_num}")
+                    elif present[slot] != key:
+                        problems.append(f"key {key} points to slot {slot} of page {page_num}, "
+                                        f"which holds record {present[slot]}")
+                for slot, key in sorted(present.items()):
+                    if slot not in wanted:
+                        problems.append(f"record {key} in slot {slot} of page {page_num} is not referenced by the tree")
+                page_num += 1
+    for page, slots in expected.items():
+        problems.append(f"keys {sorted(slots.values())[:5]} point to page {page}, past the end of the data file")
+    return problems, records
+
+
+def split_range(count, parts):
+    step = max(1, -(-count // parts))
+    return [(start, min(start + step, count)) for start in range(0, count, step)]
+
+
+def find_root(nodes, free):
+    """
+    The root is not stored in the files: it is the node without a parent that
+    holds keys, or the empty root leaf of an empty tree.
+    """
+    candidates = [i for i in range(len(nodes["parents"])) if nodes["parents"][i] == -1 and i not in free]
+    with_keys = [i for i in candidates if nodes["nkeys"][i] > 0]
+    if with_keys:
+        return with_keys
+    return [i for i in candidates if nodes["leaf"][i]][:1] or candidates[:1]
+
+
+def merge_results(results, count):
+    nodes = {name: array(typecode) for name, typecode in
+             (("ids", 'i'), ("parents", 'i'), ("nkeys", 'i'), ("first", 'i'), ("last", 'i'),
+              ("child_owner", 'i'), ("child_id", 'i'), ("child_low", 'q'), ("child_high", 'q'),
+              ("ptr_owner", 'i'), ("ptr_key", 'i'), ("ptr_rid", 'i'))}
+    nodes["leaf"] = bytearray()
+    nodes["problems"] = []
+    for result in results:
+        for name in nodes:
+            nodes[name].extend(result[name])
+    # Index of the first child edge of every node
+    child_start = array('i', [0]) * (count + 1)
+    for owner in nodes["child_owner"]:
+        child_start[owner + 1] += 1
+    for i in range(count):
+        child_start[i + 1] += child_start[i]
+    nodes["child_start"] = child_start
+    return nodes
+
+
+def walk(nodes, root, count, free, max_keys, min_keys, report):
+    """
+    Walk the tree from root over the edges found by the workers.
+
+    Returns:
+    - tuple: (reachable flags, height, keys in reachable nodes).
+    """
+    reachable = bytearray(count)
+    reachable[root] = 1
+    level = [root]
+    spine = {root}
+    height = 0
+    keys = 0
+    leaf_depth = None
+    while level:
+        height += 1
+        next_level = []
+        for node_id in level:
+            n = nodes["nkeys"][node_id]
+            keys += n
+            if node_id in spine:
+                if node_id != root and n < min_keys:
+                    report.warning(f"node {node_id} on the right spine has {n} keys, fewer than min_keys {min_keys}")
+            elif n < min_keys:
+                report.error(f"node {node_id} has {n} keys, fewer than min_keys {min_keys}")
+            if nodes["leaf"][node_id]:
+                if leaf_depth is None:
+                    leaf_depth = height
+                elif leaf_depth != height:
+                    report.error(f"leaf {node_id} is at depth {height}, other leaves at depth {leaf_depth}")
+                continue
+            first_edge, end_edge = nodes["child_start"][node_id], nodes["child_start"][node_id + 1]
+            for e in range(first_edge, end_edge):
+                child = nodes["child_id"][e]
+                if not 0 <= child < count:
+                    report.error(f"node {node_id} has child {child}, outside the node file")
+                    continue
+                if reachable[child]:
+                    report.error(f"node {child} is reached twice, last from node {node_id}")
+                    continue
+                reachable[child] = 1
+                if child in free:
+                    report.error(f"node {child} is in the tree and in the free-node list")
+                if nodes["parents"][child] != node_id:
+                    report.error(f"node {child} is a child of {node_id} but names {nodes['parents'][child]} as parent")
+                if nodes["nkeys"][child] and not (nodes["child_low"][e] < nodes["first"][child]
+                                                  and nodes["last"][child] < nodes["child_high"][e]):
+                    report.error(f"keys {nodes['first'][child]}..{nodes['last'][child]} of node {child} are outside "
+                                 f"the separators of node {node_id}")
+                if node_id in spine and e == end_edge - 1:
+                    spine.add(child)
+                next_level.append(child)
+        level = next_level
+    return reachable, height, keys
+
+
+def verify_tree(base_name, d, page_size, root=None, jobs=None, ignore_nodes=()):
+    """
+    Verify the node, free-node and data files of a tree.
+
+    Parameters:
+    - base_name (str): Base name of the tree files.
+    - d (int), page_size (int): Layout of the files.
+    - root (int): Root node ID, or None to find it from the parent pointers.
+    - jobs (int): Number of worker processes, os.cpu_count() by default.
+    - ignore_nodes (iterable): Node IDs in use outside the tree, such as snapshot copies.
+
+    Returns:
+    - Report: The errors, warnings and a summary.
+    """
+    start_time = time.perf_counter()
+    files = tree_files(base_name)
+    layout = BTree(BTreeConfig(d=d, page_size=page_size))
+    jobs = jobs or os.cpu_count() or 1
+    report = Report()
+
+    node_count = os.path.getsize(files['node_file']) // layout.node_page_size
+    page_count = os.path.getsize(files['main_file']) // layout.page_size
+    free_list = load_int_list_from_file(files['node_metadata_file'])
+    free = set(free_list)
+    if len(free) != len(free_list):
+        report.error("the free-node list contains duplicates")
+    for node_id in free:
+        if not 0 <= node_id < node_count:
+            report.error(f"free node {node_id} is outside the node file")
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        # Several ranges per worker even out ranges that take longer
+        ranges = split_range(node_count, jobs * 4)
+        results = list(pool.map(check_node_range, [files['node_file']] * len(ranges), *zip(*ranges),
+                                [layout.max_keys] * len(ranges), [layout.node_page_size] * len(ranges)))
+        nodes = merge_results(results, node_count)
+
+        if root is None:
+            roots = find_root(nodes, free)
+            if not roots:
+                report.error("no root node found")
+                return report
+            if len(roots) > 1:
+                report.error(f"several nodes without a parent hold keys: {roots[:10]}")
+            root = roots[0]
+        reachable, height, keys = walk(nodes, root, node_count, free, layout.max_keys, layout.min_keys, report)
+        for node_id, message in nodes["problems"]:
+            if reachable[node_id]:
+                report.error(message)
+        ignore = set(ignore_nodes)
+        leaked = [i for i in range(node_count) if not reachable[i] and i not in free and i not in ignore]
+        if leaked:
+            report.warning(f"{len(leaked)} nodes are neither in the tree nor free, e.g. {leaked[:10]}")
+
+        # Pointers of the reachable nodes, split between page ranges
+        page_ranges = split_range(max(page_count, 1), jobs * 4)
+        pages_per_range = page_ranges[0][1] - page_ranges[0][0]
+        buckets = [(array('i'), array('i')) for _ in page_ranges]
+        for owner, key, rid in zip(nodes["ptr_owner"], nodes["ptr_key"], nodes["ptr_rid"]):
+            if not reachable[owner]:
+                continue
+            page = rid_page(rid)
+            if not 0 <= page < page_count:
+                report.error(f"key {key} in node {owner} points to page {page}, outside the data file")
+                continue
+            if rid_slot(rid) >= layout.max_records_per_page:
+                report.error(f"key {key} in node {owner} points to slot {rid_slot(rid)} of page {page}, "
+                             f"past the last slot")
+                continue
+            bucket = buckets[page // pages_per_range]
+            bucket[0].append(rid)
+            bucket[1].append(key)
+        records = 0
+        for problems, found in pool.map(check_page_range, [files['main_file']] * len(page_ranges),
+                                        *zip(*page_ranges), [layout.page_size] * len(page_ranges),
+                                        [layout.max_records_per_page] * len(page_ranges),
+                                        [b[0] for b in buckets], [b[1] for b in buckets]):
+            records += found
+            for message in problems:
+                report.error(message)
+
+    report.summary = {
+        "root": root,
+        "height": height,
+        "nodes": node_count,
+        "reachable_nodes": sum(reachable),
+        "free_nodes": len(free),
+        "keys": keys,
+        "data_pages": page_count,
+        "records": records,
+        "elapsed_s": round(time.perf_counter() - start_time, 3),
+    }
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the node and data files of a B-tree")
+    parser.add_argument('base', help='Base name of the tree files')
+    parser.add_argument('--jobs', type=int, help='Worker processes (default: one per CPU)')
+    parser.add_argument('--root', type=int, help='Root node ID (default: found from the parent pointers)')
+    parser.add_argument('--d', type=int, help='Minimum degree, for trees without a config file')
+    parser.add_argument('--page-size', type=int, help='Data page size, for trees without a config file')
+    args = parser.parse_args()
+
+    files = tree_files(args.base)
+    if not all(os.path.exists(files[name]) for name in ('node_file', 'main_file', 'node_metadata_file')):
+        print(f"No tree named '{args.base}'.")
+        sys.exit(1)
+    config = BTreeConfig.from_file(files['config_file']) if os.path.exists(files['config_file']) else BTreeConfig()
+    config.update({name: value for name, value in (("d", args.d), ("page_size", args.page_size))
+                   if value is not None})
+    result = verify_tree(args.base, config.d, config.page_size, args.root, args.jobs)
+    result.print()
+    sys.exit(1 if result.error_count else 0)
@@ -1,502 +1,22 @@
-import struct
 import os
 import subprocess
-import bisect
 import sys
 import argparse
 import random
-from collections import OrderedDict
 import signal
+import functools
+import json
+import time
 
-# Define the LRU cache with a fixed size
-CACHE_SIZE = 0
-node_cache = OrderedDict()
-
-PAGE_CACHE_SIZE = 10
-page_cache = OrderedDict()
-
-def mark_node_dirty(node_id):
-    if node_id in node_cache:
-        node, _ = node_cache.pop(node_id)
-        node_cache[node_id] = (node, True)
-
-
-global_counters = {
-    "nodes_saved_to_disk": 0,
-    "nodes_loaded_from_disk": 0,
-    "nodes_loaded_from_cache": 0,
-    "pages_saved_to_disk": 0,
-    "pages_loaded_from_disk": 0,
-    "pages_loaded_from_cache": 0,
-    "metadata_loaded": 0,
-    "metadata_saved": 0
-}
-
-current_files = {
-    'main_file': "data.dat",
-    'node_file': "btree_nodes.dat",
-    'metadata_file': "metadata.dat",
-    'node_metadata_file': "metadata_nodes.dat"
-}
-
-
-# -----------------------------------------------------------
-# Configuration
-# -----------------------------------------------------------
-record_format = 'i d d d'  # key, P(A), P(B), P(AuB)
-record_size = struct.calcsize(record_format)
-
-page_size = 256
-max_records_per_page = (page_size - 4) // record_size
-
-# B-tree node parameters
-node_page_size = 555
-d = 2
-max_keys = 2 * d
-min_keys = d
-
-root = 0
-last_page = 1
-metadata_filename = "metadata.dat"
-
-
-# -----------------------------------------------------------
-# Record and Page Classes
-# -----------------------------------------------------------
-class Record:
-    def __init__(self, key, p_a, p_b, p_aub):
-        self.key = key
-        self.p_a = p_a
-        self.p_b = p_b
-        self.p_aub = p_aub
-
-
-class Page:
-    def __init__(self, records=None):
-        self.records = records if records else []
-
-    def pack(self):
-        data = struct.pack('i', len(self.records))
-        # records are already kept sorted by key
-        for r in self.records:
-            data += struct.pack(record_format, r.key, r.p_a, r.p_b, r.p_aub)
-        if len(data) < page_size:
-            data += b'\x00' * (page_size - len(data))
-        return data
-
-    @staticmethod
-    def unpack(data):
-        n = struct.unpack('i', data[0:4])[0]
-        recs = []
-        offset = 0
-        for _ in range(n):
-            chunk = data[offset:offset + record_size]
-            key, p_a, p_b, p_aub = struct.unpack(record_format, chunk)
-            recs.append(Record(key, p_a, p_b, p_aub))
-            offset += record_size
-        return Page(recs)
-
-
-# -----------------------------------------------------------
-# BTreeNode Class
-# -----------------------------------------------------------
-class BTreeNode:
-    def __init__(self, node_id, keys=None, children=None, leaf=True, parent_id=-1):
-        self.node_id = node_id
-        self.keys = keys if keys else []  # keys will be a list of tuples (key, page)
-        self.children = children if children else []
-        self.leaf = leaf
-        self.parent_id = parent_id
-
-    def to_bytes(self):
-        n = len(self.keys)
-        leaf_byte = 1 if self.leaf else 0
-        data = struct.pack('i', self.node_id)
-        data += struct.pack('B', leaf_byte)
-        data += struct.pack('i', n)
-        data += struct.pack('i', self.parent_id)
-
-        # Each key is now (k, p)
-        # max_keys keys, each 8 bytes total (2 ints)
-        for i in range(max_keys):
-            if i < n:
-                k, p = self.keys[i]
-            else:
-                k, p = 0, 0
-            data += struct.pack('ii', k, p)
-
-        # max_children = max_keys + 1 children, each 4 bytes
-        max_children = max_keys + 1
-        for i in range(max_children):
-            if i < len(self.children):
-                c = self.children[i]
-            else:
-                c = -1
-            data += struct.pack('i', c)
-
-        if len(data) < node_page_size:
-            data += b'\x00' * (node_page_size - len(data))
-
-        return data
-
-    @staticmethod
-    def from_bytes(data):
-        node_id = struct.unpack('i', data[0:4])[0]
-        leaf_byte = data[4]
-        leaf = (leaf_byte == 1)
-        n = struct.unpack('i', data[5:9])[0]
-        parent_id = struct.unpack('i', data[9:13])[0]
-
-        keys = []
-        offset = 13
-        # Each key: (k, p) = 8 bytes
-        for i in range(max_keys):
-            k, p = struct.unpack('ii', data[offset:offset + 8])
-            offset += 8
-            if i < n:
-                keys.append((k, p))
-
-        children = []
-        for i in range(max_keys + 1):
-            c = struct.unpack('i', data[offset:offset + 4])[0]
-            offset += 4
-            if c != -1:
-                children.append(c)
-
-        return BTreeNode(node_id, keys, children, leaf, parent_id)
-
-
-def generate_main_file(filename="data.dat", num_records=0):
-    if os.path.exists(filename):
-        os.remove(filename)
-
-    all_records = []  # Start with no records
-
-    with open(filename, "wb") as f:
-        page = Page(all_records)
-        f.write(page.pack())
-
-# Define the page cache with a fixed size and track dirty pages
-
-
-
-
-def read_page(file_path, page_num, size, mode="rb"):
-    global page_cache, global_counters, PAGE_CACHE_SIZE
-
-    if  (PAGE_CACHE_SIZE != 0) and (page_num in page_cache):
-        # Move to end to mark as recently used
-        page_data = page_cache.pop(page_num)
-        page_cache[page_num] = page_data
-        global_counters["pages_loaded_from_cache"] += 1
-        return Page.unpack(page_data)
-
-    # Read from disk
-    with open(file_path, mode) as f:
-        f.seek(page_num * size)
-        page_bytes = f.read(size)
-        if not page_bytes:
-            # If page does not exist, return empty page
-            page = Page()
-        else:
-            page = Page.unpack(page_bytes)
-        global_counters["pages_loaded_from_disk"] += 1
-
-    # Add to cache
-    page_data = page.pack()
-    page_cache[page_num] = page_data
-
-    if PAGE_CACHE_SIZE != 0 and len(page_cache) > PAGE_CACHE_SIZE:
-        evicted_page_num, evicted_data = page_cache.popitem(last=False)
-        with open(file_path, "r+b") as f:
-            f.seek(evicted_page_num * page_size)
-            f.write(evicted_data)
-            f.flush()
-            global_counters["pages_saved_to_disk"] += 1
-
-    return page
-
-
-def write_page(file_path, page_num, page):
-    global page_cache, global_counters
-
-    if page_num in page_cache:
-        page_cache.pop(page_num)
-        page_cache[page_num] = page.pack()
-    else:
-        with open(file_path, "r+b") as f:
-            f.seek(page_num * page_size)
-            f.write(page.pack())
-            f.flush()
-            global_counters["pages_saved_to_disk"] += 1
-
-
-    # Evict if cache size exceeded
-    if len(page_cache) > PAGE_CACHE_SIZE:
-        evicted_page_num, evicted_data = page_cache.popitem(last=False)
-        with open(file_path, "r+b") as f:
-            f.seek(evicted_page_num * page_size)
-            f.write(evicted_data)
-            f.flush()
-            global_counters["pages_saved_to_disk"] += 1
-
-
-
-
-
-def handle_exit_signal(signum, frame):
-    """
-    Handle signals like SIGINT and SIGTERM to perform clean-up before exiting.
-    """
-    print("\nReceived interrupt signal. Cleaning up before exiting...")
-
-    # Save any dirty cached nodes to disk
-    for node_id, (node, is_dirty) in node_cache.items():
-        if is_dirty:
-            print(f"Saving dirty node {node_id} to disk...")
-            save_node(node, current_files['node_file'], mode="r+b")
-
-    # Save cached pages to disk
-    for page_num, page_data in page_cache.items():
-        print(f"Flushing page {page_num} to disk...")
-        with open(current_files['main_file'], "r+b") as f:
-            f.seek(page_num * page_size)
-            f.write(page_data)
-            f.flush()
-
-    print("All data saved. Exiting program gracefully.")
-    sys.exit(0)  # Exit the program cleanly
-
-
-def insert_record_in_main_file(record, main_file="data.dat", metadata_filename="metadata.dat"):
-    global global_counters
-    underutilized_pages = load_underutilized_pages(metadata_filename)
-
-    if underutilized_pages:
-        page_num = underutilized_pages.pop(0)
-        print('from list')
-    else:
-        global last_page
-        add_underutilized_page(last_page, metadata_filename)
-        page_num = last_page
-        last_page +=1
-        print('from filesize')
-
-    page = read_page(main_file, page_num, page_size)
-
-
-
-    keys = [r.key for r in page.records]
-    pos = bisect.bisect_left(keys, record.key)
-    page.records.insert(pos, record)
-
-    if len(page.records) == max_records_per_page:
-        print('should remove')
-        remove_underutilized_page(page_num, metadata_filename)
-
-    write_page(main_file, page_num, page)
-
-    return page_num
-
-
-def print_main_file(filename="data.dat"):
-    global global_counters
-    if not os.path.exists(filename):
-        print("Main file does not exist.")
-        return
-    file_size = os.path.getsize(filename)
-    num_pages = file_size // page_size
-
-    with open(filename, "rb") as f:
-        for p in range(num_pages):
-            data = f.read(page_size)
-            global_counters["pages_loaded_from_disk"] += 1  # Increment the counter
-            page = Page.unpack(data)
-            print(f"Page {p}: {len(page.records)} records")
-            for r in page.records:
-                print(f"  Key={r.key}, P(A)={r.p_a}, P(B)={r.p_b}, P(A∪B)={r.p_aub}")
-
-
-def init_btree_nodes_file(node_filename="btree_nodes.dat"):
-    if os.path.exists(node_filename):
-        print("Node file exists. Loading existing root node...")
-        return  # Avoid overwriting existing data
-    root_node = BTreeNode(0, keys=[], leaf=True, parent_id=-1)
-    save_node(root_node, node_filename, "wb")
-    global root
-    root = root_node.node_id
-
-
-def read_node(node_to_read_id, node_filename="btree_nodes.dat"):
-    global global_counters
-    if node_to_read_id in node_cache:
-        global_counters["nodes_loaded_from_cache"] += 1
-        node, t = node_cache.pop(node_to_read_id)
-        node_cache[node_to_read_id] = (node, t)
-        return node
-
-    if not os.path.exists(node_filename):
-        return None
-
-    with open(node_filename, "rb") as f:
-        f.seek(node_to_read_id * node_page_size)
-        data = f.read(node_page_size)
-        if len(data) < node_page_size:
-            return None
-
-    global_counters["nodes_loaded_from_disk"] += 1
-    node = BTreeNode.from_bytes(data)
-    node_cache[node_to_read_id] = (node, False)
-    if len(node_cache) > CACHE_SIZE:
-        evicted_node_id, (evicted_node, dirty) = node_cache.popitem(last=False)
-        if CACHE_SIZE > 0 and dirty:
-            with open(node_filename, "r+b") as f:
-                f.seek(evicted_node_id * node_page_size)
-                f.write(evicted_node.to_bytes())
-                f.flush()
-                global_counters["nodes_saved_to_disk"] += 1
-
-    return node
-
-
-def save_node(node_to_save, node_filename="btree_nodes.dat", mode="r+b"):
-    global global_counters
-
-    if node_to_save.node_id in node_cache:
-        node_cache.move_to_end(node_to_save.node_id)
-        node_cache[node_to_save.node_id] = (node_to_save, True)
-    else:
-        with open(node_filename, mode) as f:
-            f.seek(node_to_save.node_id * node_page_size)
-            f.write(node_to_save.to_bytes())
-            f.flush()
-        global_counters["nodes_saved_to_disk"] += 1
-
-
-
-def load_int_list_from_file(filename):
-    if not os.path.exists(filename):
-        return []
-    with open(filename, "rb") as f:
-        data = f.read()
-    if len(data) < 4:
-        return []
-    count = struct.unpack('i', data[0:4])[0]
-    int_list = []
-    offset = 4
-    for _ in range(count):
-        val = struct.unpack('i', data[offset:offset + 4])[0]
-        offset += 4
-        int_list.append(val)
-    return int_list
-
-
-def save_int_list_to_file(filename, int_list):
-    with open(filename, "wb") as f:
-        f.write(struct.pack('i', len(int_list)))
-        for val in int_list:
-            f.write(struct.pack('i', val))
-
-
-def load_underutilized_pages(metadata_filename="metadata.dat"):
-    global global_counters
-    global_counters["metadata_loaded"] += 1
-    return load_int_list_from_file(metadata_filename)
-
-
-def save_underutilized_pages(pages, metadata_filename="metadata.dat"):
-    global global_counters
-    save_int_list_to_file(metadata_filename, pages)
-    global_counters["metadata_saved"] += 1
-
-
-def search_key(x, current_node_id=None, node_filename="btree_nodes.dat"):
-    if current_node_id is None:
-        current_node_id = root
-    current_node = read_node(current_node_id, node_filename)
-    print(f'current_node={current_node.children}')
-    if current_node is None:
-        print('1')
-        return current_node, 'not found'
-
-    if len(current_node.keys) > 0 and x < current_node.keys[0][0]:
-        if current_node.leaf:
-            print('2')
-            return current_node, 'not found'
-        print('5aa5')
-        return search_key(x, current_node.children[0], node_filename)
-
-    for i, (k, p) in enumerate(current_node.keys):
-        if k == x:
-            return current_node, 'found'
-        elif k > x:
-            if current_node.leaf:
-                print('3')
-                return current_node, 'not found'
-            print('6')
-            print(f'important{i}')
-            return search_key(x, current_node.children[i], node_filename)
-
-    if current_node.leaf:
-        print('4')
-        return current_node, 'not found'
-
-    return search_key(x, current_node.children[-1], node_filename)
-
-
-def add_key_to_node(node, key, page, node_filename="btree_nodes.dat"):
-    if node is None:
-        return
-
-    keys_only = [k[0] for k in node.keys]
-    insert_pos = bisect.bisect_left(keys_only, key)
-    node.keys.insert(insert_pos, (key, page))
-    save_node(node, node_filename)
-
-    if len(node.keys) > max_keys:
-        if node.parent_id == -1:
-            split_node(node, node_filename)
-        else:
-            try_compensation(node, key, page, node_filename=node_filename)
-
-
-def insert_key(x, a, main_file="data.dat", node_filename="btree_nodes.dat", metadata_filename="metadata.dat", loading= False):
-    node, is_found = search_key(x, None, node_filename)
-    print(f'POSITION {node.node_id}')
-    if is_found == 'found':
-        return 'ALREADY EXISTS!'
-
-    if not os.path.exists(main_file):
-        return 'ERROR: Main file not found!'
-
-    new_record = Record(x, a[0], a[1], a[2])
-    if not loading:
-        page_num = insert_record_in_main_file(new_record, main_file, metadata_filename)
-
-    add_key_to_node(node, x, page_num, node_filename)
-    return 'OK'
+from aggregate import COLUMNS as AGG_COLUMNS, aggregate
+from btree import PROBABILITY_COLUMNS, BTree, BTreeConfig, rid_page, rid_slot, tree_exists
+from cachesim import AccessRecorder
+from dump import EXPORT_FORMATS, export_tree, restore_tree
+from fsck import verify_tree
+from metrics import TIMED_COMMANDS, MetricsExporter, snapshot_metrics
 
-
-def load_all_nodes(node_filename="btree_nodes.dat"):
-    if not os.path.exists(node_filename):
-        return []
-    global node_cache, global_counters, current_files
-
-
-    nodes = []
-    file_size = os.path.getsize(node_filename)
-    node_count = file_size // node_page_size
-    for nid in range(node_count):
-        node = read_node(nid, node_filename)
-        if node is not None:
-            nd = {
-                "id": node.node_id,
-                "leaf": node.leaf,
-                "keys": node.keys,
-                "children": node.children
-            }
-            nodes.append(nd)
-    return nodes
+# Command-line front end. The tree itself, with its files, caches, counters and
+# geometry, is a btree.BTree; every command is run against the tree it is given.
 
 
 def generate_dot(nodes, dot_filename="tree.dot"):
@@ -522,12 +42,18 @@ def generate_dot(nodes, dot_filename="tree.dot"):
 
             if n["leaf"]:
                 f.write(f'  node{n["id"]} [label=< {label} >, style=filled, fillcolor=lightgrey];\n')
+            elif n.get("truncated"):
+                # Its children are below the requested depth
+                f.write(f'  node{n["id"]} [label=< {label} >, style=dashed];\n')
             else:
                 f.write(f'  node{n["id"]} [label=< {label} >];\n')
 
         # Define edges with specific ports to maintain child order
+        shown = {n["id"] for n in nodes}
         for n in nodes:
             for i, c in enumerate(n["children"]):
+                if c not in shown:
+                    continue
                 # Connect to the corresponding port 'fi' in the parent node
                 f.write(f'  node{n["id"]}:f{i} -> node{c};\n')
 
@@ -539,523 +65,72 @@ def visualize_tree(dot_filename="tree.dot", output_png="tree.png"):
     subprocess.run(["feh", output_png])
 
 
-def try_compensation(overflown_node, key, page, node_filename="btree_nodes.dat"):
-    parent = read_node(overflown_node.parent_id, node_filename)
-    if parent is None:
-        return False
-
-    try:
-        idx = parent.children.index(overflown_node.node_id)
-    except ValueError:
-        print(f"Node {overflown_node.node_id} is not a child of its parent {overflown_node.parent_id}.")
-        return False
-
-    left_sibling_id = parent.children[idx - 1] if idx > 0 else None
-    right_sibling_id = parent.children[idx + 1] if idx < len(parent.children) - 1 else None
-
-    combined_keys = []
-    combined_children = []
-
-    if left_sibling_id is not None:
-        left_sibling = read_node(left_sibling_id, node_filename)
-        if len(left_sibling.keys) < max_keys:
-            combined_keys.extend(left_sibling.keys)
-            combined_keys.append(parent.keys[idx - 1])
-            combined_keys.extend(overflown_node.keys)
-
-            if not overflown_node.leaf:
-                combined_children.extend(left_sibling.children)
-                combined_children.extend(overflown_node.children)
-
-            mid_index = len(combined_keys) // 2
-            parent.keys[idx - 1] = combined_keys[mid_index]
-
-            left_sibling.keys = combined_keys[:mid_index]
-            overflown_node.keys = combined_keys[mid_index + 1:]
-
-            if not overflown_node.leaf:
-                left_sibling.children = combined_children[:mid_index + 1]
-                overflown_node.children = combined_children[mid_index + 1:]
-
-            save_node(left_sibling, node_filename)
-            save_node(overflown_node, node_filename)
-            save_node(parent, node_filename)
-            return True
-
-    if right_sibling_id is not None:
-        # print(f'reading node {right_sibling_id} during compensation')
-        right_sibling = read_node(right_sibling_id, node_filename)
-        if len(right_sibling.keys) < max_keys:
-            combined_keys.extend(overflown_node.keys)
-            combined_keys.append(parent.keys[idx])
-            combined_keys.extend(right_sibling.keys)
-
-            if not overflown_node.leaf:
-                combined_children.extend(overflown_node.children)
-                combined_children.extend(right_sibling.children)
-
-            mid_index = len(combined_keys) // 2
-            parent.keys[idx] = combined_keys[mid_index]
-
-            overflown_node.keys = combined_keys[:mid_index]
-            right_sibling.keys = combined_keys[mid_index + 1:]
-
-            if not overflown_node.leaf:
-                overflown_node.children = combined_children[:mid_index + 1]
-                right_sibling.children = combined_children[mid_index + 1:]
-
-            save_node(overflown_node, node_filename)
-            save_node(right_sibling, node_filename)
-            save_node(parent, node_filename)
-            return True
-
-    split_node(overflown_node, node_filename)
-    return False
-
-
-def create_or_reuse_node(node_data, node_filename="btree_nodes.dat", metadata_filename="metadata_nodes.dat"):
-    free_nodes = load_free_nodes(metadata_filename)
-    if free_nodes:
-
-        # Use a free node
-        node_id = free_nodes.pop(0)
-        save_free_nodes(free_nodes, metadata_filename)
-    else:
-        # No free node, allocate a new one
-        file_size = os.path.getsize(node_filename)
-        node_id = file_size // node_page_size
-
-    node = BTreeNode(node_id, **node_data)
-    save_node(node, node_filename)
-    return node_id
-
-
-def split_node(overflown_node, node_filename="btree_nodes.dat", metadata_filename="metadata_nodes.dat"):
-    global root
-
-    # Step 1: Allocate a new node
-    new_node_id = get_free_node(metadata_filename)
-    if new_node_id is None:
-        file_size = os.path.getsize(node_filename)
-        new_node_id = file_size // node_page_size
-
-    new_node = BTreeNode(new_node_id, leaf=overflown_node.leaf, parent_id=overflown_node.parent_id)
-
-    # Step 2: Redistribute keys and children
-    mid_index = len(overflown_node.keys) // 2
-    middle_key = overflown_node.keys[mid_index]
-
-    # Assign keys to the new node
-    new_node.keys = overflown_node.keys[mid_index + 1:]
-    overflown_node.keys = overflown_node.keys[:mid_index]
-
-    # Assign children to the new node if not a leaf
-    if not overflown_node.leaf:
-        new_node.children = overflown_node.children[mid_index + 1:]
-        overflown_node.children = overflown_node.children[:mid_index + 1]
-
-        # Update parent_id for the children of the new node
-        for child_id in new_node.children:
-            # print(f'reading node {child_id} during spliting')
-            child_node = read_node(child_id, node_filename)
-            child_node.parent_id = new_node.node_id
-            save_node(child_node, node_filename)
-
-    # Save the updated nodes
-    save_node(overflown_node, node_filename)
-    save_node(new_node, node_filename)
-
-    # Step 3: Insert the middle key into the parent node
-    if overflown_node.parent_id == -1:
-        # Create a new root if the overflown node is the root
-        new_root_id = get_free_node(metadata_filename)
-        if new_root_id is None:
-            file_size = os.path.getsize(node_filename)
-            new_root_id = file_size // node_page_size
-
-        new_root = BTreeNode(new_root_id, leaf=False, parent_id=-1, children=[overflown_node.node_id, new_node.node_id])
-        new_root.keys = [middle_key]
-
-        # Update parent_id of the split nodes
-        overflown_node.parent_id = new_root_id
-        new_node.parent_id = new_root_id
-
-        save_node(overflown_node, node_filename)
-        save_node(new_node, node_filename)
-        save_node(new_root, node_filename)
-
-        root = new_root_id  # Update the global root
-    else:
-        # Insert the middle key into the parent node
-        # print(f'reading node {overflown_node.parent_id} during spliting')
-
-        parent_node = read_node(overflown_node.parent_id, node_filename)
-        insert_pos = bisect.bisect_left([k[0] for k in parent_node.keys], middle_key[0])
-
-        parent_node.keys.insert(insert_pos, middle_key)
-        print(f'INSERTT POSSS {insert_pos}')
-        print(f'{new_node.keys}')
-        parent_node.children.remove(overflown_node.node_id)
-        parent_node.children.insert(insert_pos, new_node.node_id)
-        parent_node.children.insert(insert_pos, overflown_node.node_id)
-
-        save_node(parent_node, node_filename)
-
-        # Handle parent overflow if it occurs
-        if len(parent_node.keys) > max_keys:
-            split_node(parent_node, node_filename, metadata_filename)
-
-
-def set_root(new_root_id):
-    global root
-    root = new_root_id
-
-
-def init_metadata(metadata_filename="metadata.dat"):
-    if not os.path.exists(metadata_filename):
-        with open(metadata_filename, "wb") as f:
-            # Start with zero free pages
-            f.write(struct.pack('i', 0))
-
-
-def add_underutilized_page(page_num, metadata_filename="metadata.dat"):
-    """
-    Add a page to the list of underutilized pages.
-    """
-    pages = load_underutilized_pages(metadata_filename)
-    if page_num not in pages:  # Avoid duplicates
-        bisect.insort(pages, page_num)
-        save_underutilized_pages(pages, metadata_filename)
-
-
-def remove_underutilized_page(page_num, metadata_filename="metadata.dat"):
+def handle_exit_signal(signum, frame, tree):
     """
-    Remove a page from the list of underutilized pages.
-    """
-    pages = load_underutilized_pages(metadata_filename)
-    if page_num in pages:
-        pages.remove(page_num)
-        save_underutilized_pages(pages, metadata_filename)
-
-def remove_record_from_main_file(page_num, key, main_file="data.dat", metadata_filename="metadata.dat"):
-    page = read_page(main_file, page_num, page_size)
-    page = Page.unpack(data)
-
-    # Binary search for the record by key
-    keys = [r.key for r in page.records]
-    pos = bisect.bisect_left(keys, key)
-    if pos < len(keys) and page.records[pos].key == key:
-        del page.records[pos]
-
-        write_page(main_file, page_num, page, mode="r+b")
-
-        if len(page.records) < max_records_per_page:
-            add_underutilized_page(page_num, metadata_filename)
-
-
-def update_record(key, new_pA, new_pB, new_pAuB, node_filename="btree_nodes.dat", main_file="data.dat"):
-    node, found = search_key(key, None, node_filename)
-    if found == 'not found':
-        return 'Not_Found'
-
-    if node is None:
-        return 'Error_Node_Read'
-
-    # Find which key matches
-    page_num = None
-    for (k, p) in node.keys:
-        if k == key:
-            page_num = p
-            break
-
-    if page_num is None:
-        return 'Error_Data_Inconsistent'
-
-    file_size = os.path.getsize(main_file)
-    num_pages = file_size // page_size
-    if page_num < 0 or page_num >= num_pages:
-        return 'Error_Invalid_Page'
-
-    data = read_page(main_file, page_num, page_size)
-    page = Page.unpack(data)
-
-    # Binary search for the record
-    keys = [r.key for r in page.records]
-    pos = bisect.bisect_left(keys, key)
-    if pos >= len(page.records) or page.records[pos].key != key:
-        return 'Error_Invalid_Slot'
-
-    updated_record = Record(key, new_pA, new_pB, new_pAuB)
-    page.records[pos] = updated_record
-
-    write_page(main_file, page_num, page, mode="r+b")
-
-    return 'OK'
-
-
-
-
-def init_node_metadata(metadata_filename="metadata_nodes.dat"):
-    """
-    Initialize the metadata file for free B-tree nodes if it does not exist.
-    """
-    if not os.path.exists(metadata_filename):
-        with open(metadata_filename, "wb") as f:
-            f.write(struct.pack('i', 0))  # Start with zero free nodes.
-
-
-def load_free_nodes(metadata_filename="metadata_nodes.dat"):
-    return load_int_list_from_file(metadata_filename)
-
-
-def save_free_nodes(free_nodes, metadata_filename="metadata_nodes.dat"):
-    save_int_list_to_file(metadata_filename, free_nodes)
-
-
-def add_free_node(node_id, metadata_filename="metadata_nodes.dat"):
-    """
-    Add a node ID to the list of free nodes in the metadata file.
-    """
-    free_nodes = load_free_nodes(metadata_filename)
-    bisect.insort(free_nodes, node_id)  # Maintain sorted order.
-    save_free_nodes(free_nodes, metadata_filename)
-
-
-def get_free_node(metadata_filename="metadata_nodes.dat"):
-    """
-    Retrieve and remove a free node ID from the metadata file, if available.
-    """
-    free_nodes = load_free_nodes(metadata_filename)
-    if not free_nodes:
-        return None
-    free_node_id = free_nodes.pop(0)  # Get the first free node ID.
-    save_free_nodes(free_nodes, metadata_filename)
-    return free_node_id
-
-
-def load_all_keys(node_filename="btree_nodes.dat"):
-    """
-    Traverse the B-tree and collect all existing keys.
-
-    Parameters:
-    - node_filename (str): Path to the B-tree nodes file.
-
-    Returns:
-    - keys (set): A set containing all existing keys in the B-tree.
-    """
-    global node_cache, global_counters, current_files
-
-
-    nodes_to_flush = [(node_id, node) for node_id, (node, is_dirty) in node_cache.items() if is_dirty]
-
-    for node_id, node in nodes_to_flush:
-        save_node(node, current_files['node_file'], mode="r+b")
-        node_cache[node_id] = (node, False)
-    nodes = load_all_nodes(node_filename)
-    keys = set()
-    for node in nodes:
-        for key_tuple in node["keys"]:
-            keys.add(key_tuple[0])
-    return keys
-
-
-def addrandom(num_keys, key_min=1, key_max=10000, main_file="data.dat", node_filename="btree_nodes.dat",
-              metadata_filename="metadata.dat", node_metadata_filename="metadata_nodes.dat"):
-    """
-    Generates and inserts a specified number of random records into the B-tree,
-    ensuring that no duplicate keys are inserted.
-
-    Parameters:
-    - num_keys (int): Number of random keys to generate and insert.
-    - key_min (int): Minimum possible key value (inclusive).
-    - key_max (int): Maximum possible key value (inclusive).
-    - main_file (str): Path to the main data file.
-    - node_filename (str): Path to the B-tree nodes file.
-    - metadata_filename (str): Path to the metadata file for main data.
-    - node_metadata_filename (str): Path to the metadata file for B-tree nodes.
-
-    Returns:
-    - inserted (int): Number of successfully inserted keys.
-    - skipped (int): Number of keys skipped due to duplication.
+    Handle signals like SIGINT and SIGTERM to perform clean-up before exiting.
     """
-    inserted = 0
-    skipped = 0
-    attempts = 0
-    max_attempts = num_keys * 10  # Prevent infinite loops
-
-
-    while inserted < num_keys and attempts < max_attempts:
-
-        key = random.randint(key_min, key_max)
-        pA = round(random.uniform(0.0, 1.0), 4)
-        pB = round(random.uniform(0.0, 1.0), 4)
-        pAuB = round(random.uniform(0.0, 1.0), 4)
-
-
-
-        print(f'Inserting key {key}...')
-        result = insert_key(key, (pA, pB, pAuB), main_file, node_filename, metadata_filename)
-
-        if result == 'ALREADY EXISTS!':
-            skipped += 1
-            print(f"Key {key} insertion skipped: already exists.")
-        elif result == 'OK':
-            inserted += 1
-            print(f"Key {key} inserted successfully.")
-        else:
-            print(f"Error inserting key {key}: {result}")
-
-        attempts += 1
-
-    print(f"ADDRANDOM completed: Inserted {inserted} keys, Skipped {skipped} duplicates.")
-    return inserted, skipped
+    print("\nReceived interrupt signal. Cleaning up before exiting...")
+    tree.flush_caches()
+    print("All data saved. Exiting program gracefully.")
+    sys.exit(0)  # Exit the program cleanly
 
 
-def load_main_file(main_file, node_filename="btree_nodes.dat", metadata_filename="metadata.dat",
-                   node_metadata_filename="metadata_nodes.dat"):
+def execute_command(command_line, tree):
     """
-    Load a new main file and rebuild the B-tree from its contents.
-    Identify underutilized pages and mark them.
+    Run a command, recording its latency in tree.metrics if it is one of the timed commands.
     """
-    global last_page  # Ensure we update the global last_page variable
-    if not os.path.exists(main_file):
-        print(f"Main file '{main_file}' does not exist. Creating a new file.")
-        generate_main_file(main_file)
-        add_underutilized_page(0, metadata_filename)
-        init_btree_nodes_file(node_filename)
-        init_node_metadata(node_metadata_filename)
-        init_metadata(metadata_filename)
-        last_page = 1  # Start with the first page
+    tokens = command_line.strip().split()
+    if not tokens or tokens[0].upper() not in TIMED_COMMANDS:
+        dispatch_command(command_line, tree)
         return
-
-    print(f"Loading main file '{main_file}' and rebuilding the B-tree...")
-
-    # Clear existing metadata and B-tree files
-    delete_metadata_files(metadata_filename, node_metadata_filename, node_filename)
-    init_metadata(metadata_filename)
-    init_node_metadata(node_metadata_filename)
-    init_btree_nodes_file(node_filename)
-
-    # Read and parse the data from the main file
-    file_size = os.path.getsize(main_file)
-    num_pages = file_size // page_size
-
-    # Set last_page to the next available page
-    last_page = num_pages+1
-    print(f"File '{main_file}' has {num_pages} pages. Setting last_page to {last_page}.")
-
-    keys_inserted = 0
-    underutilized_pages = []
-
-    with open(main_file, "rb") as f:
-        for page_num in range(num_pages):
-            f.seek(page_num * page_size)
-            data = f.read(page_size)
-            page = Page.unpack(data)
-
-            # Check for underutilized pages
-            if len(page.records) < max_records_per_page:
-                underutilized_pages.append(page_num)
-
-            for slot, record in enumerate(page.records):
-                # Insert each record into the B-tree
-                result = insert_key(record.key, (record.p_a, record.p_b, record.p_aub), main_file, node_filename,
-                                    metadata_filename, loading=True)
-                if result == 'OK':
-                    keys_inserted += 1
-
-    # Save underutilized pages to metadata
-    save_underutilized_pages(underutilized_pages, metadata_filename)
-    print(f"Identified {len(underutilized_pages)} underutilized pages.")
-    print(f"Rebuilt B-tree with {keys_inserted} keys from the main file '{main_file}'.")
-    print(f"Last page set to {last_page}.")
-
-
-def flush_caches():
-    """
-    Write all cached nodes and pages to disk and clear caches.
-    """
-    print("\nFlushing all caches to disk...")
-    global global_counters
-
-    # Save dirty nodes from node cache
-    for node_id, (node, is_dirty) in list(node_cache.items()):
-        if is_dirty:
-            print(f"Flushing dirty node {node_id} to disk...")
-            save_node(node, current_files['node_file'], mode="r+b")
-            node_cache[node_id] = (node, False)
-        global_counters["nodes_saved_to_disk"] +=1
-
-
-    # Save pages from page cache
-    for page_num, page_data in list(page_cache.items()):
-        print(f"Flushing page {page_num} to disk...")
-        with open(current_files['main_file'], "r+b") as f:
-            f.seek(page_num * page_size)
-            f.write(page_data)
-            f.flush()
-        global_counters["pages_saved_to_disk"] +=1
-
-        page_cache.pop(page_num)
-
-    print("All caches flushed successfully.\n")
+    start = time.perf_counter_ns()
+    try:
+        dispatch_command(command_line, tree)
+    finally:
+        tree.metrics.record_command(tokens[0].upper(), time.perf_counter_ns() - start)
 
 
-def execute_command(command_line, current_files):
+def dispatch_command(command_line, tree):
     tokens = command_line.strip().split()
     if not tokens:
         return
 
     command = tokens[0].upper()
 
+    if command == "CREATE" and len(tokens) > 1 and tokens[1].upper() == "INDEX":
+        columns = "|".join(PROBABILITY_COLUMNS)
+        if len(tokens) != 4 or tokens[2].upper() != "ON":
+            print(f"Usage: CREATE INDEX ON {columns}")
+            return
+        try:
+            index = tree.create_index(tokens[3].lower())
+        except ValueError as e:
+            print(e)
+            return
+        print(f"Index on {index.column} created with {index.stats.keys} entries.")
+        return
+
     if command == "CREATE":
         if len(tokens) != 2:
             print("Usage: CREATE <base_name>")
             return
         base_name = tokens[1]
 
-        # Generate file names based on the base name
-        new_main_file = f"{base_name}_data.dat"
-        new_node_file = f"{base_name}_nodes.dat"
-        new_metadata_file = f"{base_name}_metadata.dat"
-        new_node_metadata_file = f"{base_name}_nodes_metadata.dat"
-
         # Perform the creation process
         print(f"Creating a new B-tree with base name '{base_name}'...")
-
-        # Delete existing metadata and node files if they exist
-        delete_metadata_files(new_metadata_file, new_node_metadata_file, new_node_file, new_main_file)
-
-        # Initialize necessary files
-        generate_main_file(new_main_file, 0)  # Start with zero records
-        add_underutilized_page(0, new_metadata_file)
-        init_btree_nodes_file(new_node_file)
-        init_node_metadata(new_node_metadata_file)
-        init_metadata(new_metadata_file)
-
-        # Reset global counters
-        for key in global_counters:
-            global_counters[key] = 0
-
-        # Update the current_files dictionary
-        current_files['main_file'] = new_main_file
-        current_files['node_file'] = new_node_file
-        current_files['metadata_file'] = new_metadata_file
-        current_files['node_metadata_file'] = new_node_metadata_file
-
+        tree.create(base_name)
         print("New B-tree created successfully.")
         return
     elif command == "EXIT":
         print("\nExiting program. Flushing caches and saving data...")
-        flush_caches()
+        tree.flush_caches()
         print("Exiting cleanly. Goodbye!")
         sys.exit(0)
 
     elif command == "FLUSH":
-        flush_caches()
+        tree.flush_caches()
         print("FLUSH operation completed.")
 
-
     elif command == "LOAD":
 
         if len(tokens) != 2:
@@ -1065,41 +140,20 @@ def execute_command(command_line, current_files):
 
         base_name = tokens[1]
 
-        loaded_main_file = f"{base_name}_data.dat"
-
-        loaded_node_file = f"{base_name}_nodes.dat"
-
-        loaded_metadata_file = f"{base_name}_metadata.dat"
-
-        loaded_node_metadata_file = f"{base_name}_nodes_metadata.dat"
-
         # Check if all necessary files exist
 
-        if not all(os.path.exists(f) for f in
-                   [loaded_main_file, loaded_node_file, loaded_metadata_file, loaded_node_metadata_file]):
+        if not tree_exists(base_name):
             print(f"Error: One or more files for base name '{base_name}' do not exist.")
 
             return
 
-        # Update the current_files dictionary
-
-        current_files['main_file'] = loaded_main_file
-
-        current_files['node_file'] = loaded_node_file
-
-        current_files['metadata_file'] = loaded_metadata_file
-
-        current_files['node_metadata_file'] = loaded_node_metadata_file
-
         # Load the B-tree from the main file
-
-        load_main_file(loaded_main_file, loaded_node_file, loaded_metadata_file, loaded_node_metadata_file)
+        tree.load(base_name)
 
         print(f"B-tree loaded successfully from base name '{base_name}'.")
 
         return
 
-
     elif command == "INSERT":
         if len(tokens) != 5:
             print("Usage: INSERT <key> <pA> <pB> <pAuB>")
@@ -1112,7 +166,11 @@ def execute_command(command_line, current_files):
         except ValueError:
             print("Invalid arguments. <key> must be an integer and <pA>, <pB>, <pAuB> must be floats.")
             return
-        result = insert_key(key, (pA, pB, pAuB), current_files['main_file'], current_files['node_file'], current_files['metadata_file'])
+        try:
+            result = tree.insert_key(key, (pA, pB, pAuB))
+        except ValueError as e:
+            print(e)
+            return
         print(result)
 
     elif command == "DELETE":
@@ -1123,10 +181,9 @@ def execute_command(command_line, current_files):
             key = int(tokens[1])
         except ValueError:
 
-
             print("Invalid key. <key> must be an integer.")
             return
-        result = delete_key(key, current_files['node_file'], current_files['main_file'])
+        result = tree.delete_key(key)
         print(result)
 
     elif command == "UPDATE":
@@ -1141,7 +198,7 @@ def execute_command(command_line, current_files):
         except ValueError:
             print("Invalid arguments. <key> must be an integer and <new_pA>, <new_pB>, <new_pAuB> must be floats.")
             return
-        result = update_record(key, new_pA, new_pB, new_pAuB, current_files['node_file'], current_files['main_file'])
+        result = tree.update_record(key, new_pA, new_pB, new_pAuB)
         print(result)
 
     elif command == "SEARCH":
@@ -1153,21 +210,242 @@ def execute_command(command_line, current_files):
         except ValueError:
             print("Invalid key. <key> must be an integer.")
             return
-        node, found = search_key(key, None, current_files['node_file'])
+        if tree.record_cache is not None:
+            # Hot keys are answered from memory; other reads go to their page and may be cached
+            r = tree.get_record(key)
+            if r is None:
+                print(f"Key {key} not found.")
+            else:
+                print(f"Key {key} found: P(A)={r.p_a}, P(B)={r.p_b}, P(A∪B)={r.p_aub}")
+            return
+        if tree.page_index is not None:
+            # One page read, whatever the height of the tree
+            rid = tree.page_index.get(key)
+            r = tree.read_record(key, rid) if rid is not None else None
+            if r is None:
+                print(f"Key {key} not found.")
+            else:
+                print(f"Key {key} found on page {rid_page(rid)}, slot {rid_slot(rid)}: "
+                      f"P(A)={r.p_a}, P(B)={r.p_b}, P(A∪B)={r.p_aub}")
+            return
+        node, found = tree.search_key(key, None)
         if found == 'found':
             print(f"Key {key} found in node {node.node_id}.")
         else:
             print(f"Key {key} not found.")
 
+    elif command == "RANGE":
+        if len(tokens) != 3:
+            print("Usage: RANGE <low_key> <high_key>")
+            return
+        try:
+            low = int(tokens[1])
+            high = int(tokens[2])
+        except ValueError:
+            print("Invalid keys. <low_key> and <high_key> must be integers.")
+            return
+        entries = tree.range_search(low, high)
+        pages = set()
+        for key, rid in entries:
+            pages.add(rid_page(rid))
+            r = tree.read_record(key, rid)
+            if r is None:
+                print(f"  Key={key}: record missing from page {rid_page(rid)}, slot {rid_slot(rid)}")
+            else:
+                print(f"  Key={r.key}, P(A)={r.p_a}, P(B)={r.p_b}, P(A∪B)={r.p_aub}")
+        print(f"{len(entries)} records in range [{low}, {high}], on {len(pages)} data pages.")
+
+    elif command == "WHERE":
+        usage = f"Usage: WHERE {'|'.join(PROBABILITY_COLUMNS)} BETWEEN <low> AND <high>"
+        if len(tokens) != 6 or tokens[2].upper() != "BETWEEN" or tokens[4].upper() != "AND":
+            print(usage)
+            return
+        try:
+            low = float(tokens[3])
+            high = float(tokens[5])
+        except ValueError:
+            print("Invalid bounds. <low> and <high> must be floats.")
+            return
+        column = tokens[1].lower()
+        try:
+            records, pages_read = tree.select_between(column, low, high)
+        except ValueError as e:
+            print(e)
+            return
+        for r in records:
+            print(f"  Key={r.key}, P(A)={r.p_a}, P(B)={r.p_b}, P(A∪B)={r.p_aub}")
+        how = "using its index" if column in tree.secondary_indexes else "by a full scan"
+        print(f"{len(records)} records with {column} in [{low}, {high}], {pages_read} data pages read {how}.")
+
+    elif command == "QUANTILE":
+        usage = f"Usage: QUANTILE {'|'.join(PROBABILITY_COLUMNS)} <q>"
+        if len(tokens) != 3 or tokens[1].lower() not in tree.sketches:
+            print(usage)
+            return
+        try:
+            q = float(tokens[2])
+        except ValueError:
+            print("Invalid quantile. <q> must be a float between 0 and 1.")
+            return
+        if not 0.0 <= q <= 1.0:
+            print("Invalid quantile. <q> must be a float between 0 and 1.")
+            return
+        print_quantile(tree.sketches[tokens[1].lower()], tokens[1].lower(), q)
+
+    elif command == "AGG":
+        run_agg(tokens[1:], tree)
+
+    elif command == "EXPORT":
+        usage = f"Usage: EXPORT <file> [{'|'.join(EXPORT_FORMATS)}] [<low_key> <high_key>]"
+        args = tokens[1:]
+        if not args or len(args) > 4:
+            print(usage)
+            return
+        path = args.pop(0)
+        fmt = "bin"
+        if args and args[0].lower() in EXPORT_FORMATS:
+            fmt = args.pop(0).lower()
+        if len(args) not in (0, 2):
+            print(usage)
+            return
+        try:
+            low, high = (int(args[0]), int(args[1])) if args else (None, None)
+        except ValueError:
+            print("Invalid keys. <low_key> and <high_key> must be integers.")
+            return
+        start = time.perf_counter()
+        try:
+            count = export_tree(tree, path, fmt, low, high)
+        except (OSError, ValueError) as e:
+            print(f"Export failed: {e}")
+            return
+        elapsed = time.perf_counter() - start
+        print(f"Exported {count} records to '{path}' ({fmt}, {os.path.getsize(path)} bytes) "
+              f"in {elapsed:.3f}s.")
+
+    elif command == "RESTORE":
+        if len(tokens) != 3:
+            print("Usage: RESTORE <dump_file> <base_name>")
+            return
+        path, base_name = tokens[1], tokens[2]
+        start = time.perf_counter()
+        try:
+            count = restore_tree(tree, path, base_name)
+        except (OSError, ValueError) as e:
+            print(f"Restore failed: {e}")
+            return
+        elapsed = time.perf_counter() - start
+        print(f"Restored {count} records from '{path}' into '{base_name}' in {elapsed:.3f}s, "
+              f"height {len(tree.stats.level_nodes)}.")
+
+    elif command == "VACUUM":
+        if len(tokens) > 2 or (len(tokens) == 2 and not (tokens[1].isdigit() and int(tokens[1]) > 0)):
+            print("Usage: VACUUM [<records_per_step>]")
+            return
+        size = os.path.getsize(tree.files['main_file'])
+        start = time.perf_counter()
+        try:
+            vacuum = tree.vacuum(*(int(t) for t in tokens[1:]))
+        except ValueError as e:
+            print(f"Vacuum failed: {e}")
+            return
+        elapsed = time.perf_counter() - start
+        print(f"Vacuumed {tree.stats.keys} records into {tree.last_page} pages (was {vacuum.pages}), "
+              f"{vacuum.moved} moved in {vacuum.steps} steps, in {elapsed:.3f}s; "
+              f"data file {size} -> {os.path.getsize(tree.files['main_file'])} bytes.")
+
     elif command == "PRINT":
-        print_main_file(current_files['main_file'])
+        if len(tokens) == 2:
+            snap = tree.find_snapshot(tokens[1])
+            if snap is not None:
+                tree.print_snapshot(snap)
+            return
+        tree.print_main_file()
 
     elif command == "VISUALIZE":
-        nodes = load_all_nodes(current_files['node_file'])
+        usage = "Usage: VISUALIZE [<snapshot_id>] [depth <levels>] [subtree <node_id>]"
+        args = tokens[1:]
+        snap = None
+        if len(args) % 2 == 1:
+            snap = tree.find_snapshot(args.pop(0))
+            if snap is None:
+                return
+        options = {}
+        for name, value in zip(args[0::2], args[1::2]):
+            if name.lower() not in ("depth", "subtree") or not value.isdigit():
+                print(usage)
+                return
+            options[name.lower()] = int(value)
+        if options.get("depth") == 0:
+            print(usage)
+            return
+        nodes = tree.collect_nodes(options.get("subtree"), options.get("depth"), snap)
+        if not nodes:
+            print(f"No node {options.get('subtree')}.")
+            return
         generate_dot(nodes, "tree.dot")
         visualize_tree("tree.dot", "tree.png")
         print("B-tree visualized as 'tree.png'.")
 
+    elif command == "SNAPSHOT":
+        if len(tokens) == 1:
+            snap = tree.create_snapshot()
+            print(f"Snapshot {snap.snapshot_id} created at root {snap.root}.")
+        elif tokens[1].upper() == "LIST" and len(tokens) == 2:
+            if not tree.snapshots:
+                print("No snapshots.")
+            for snap in tree.snapshots.values():
+                print(f"Snapshot {snap.snapshot_id}: root {snap.root}, {len(snap.node_copies)} nodes copied, "
+                      f"{len(snap.node_images)} node images, {len(snap.pages)} pages kept")
+        elif tokens[1].upper() == "RELEASE" and len(tokens) == 3:
+            snap = tree.find_snapshot(tokens[2])
+            if snap is not None:
+                freed = tree.release_snapshot(snap.snapshot_id)
+                print(f"Snapshot {snap.snapshot_id} released, {freed} nodes freed.")
+        else:
+            print("Usage: SNAPSHOT | SNAPSHOT LIST | SNAPSHOT RELEASE <snapshot_id>")
+
+    elif command == "CONFIG":
+        for name, value in tree.config.to_dict().items():
+            print(f"{name}: {value}")
+
+    elif command == "STATS":
+        if len(tokens) == 2 and tokens[1].upper() == "FULL":
+            verify_tree_stats(tree)
+        elif len(tokens) == 1:
+            print_stats(tree)
+        else:
+            print("Usage: STATS [FULL]")
+
+    elif command == "VERIFY":
+        if len(tokens) != 1:
+            print("Usage: VERIFY")
+            return
+        # The verifier reads the files, so they must hold everything first
+        tree.flush_caches()
+        report = verify_tree(tree.base_name, tree.d, tree.page_size, root=tree.root,
+                             ignore_nodes=list(tree.copy_refs))
+        if report.summary and report.summary["keys"] != tree.stats.keys:
+            report.error(f"the tree holds {report.summary['keys']} keys, the statistics say {tree.stats.keys}")
+        if tree.bloom is not None:
+            for node in tree.collect_nodes():
+                for key, _ in node["keys"]:
+                    if not tree.bloom.might_contain(key):
+                        report.error(f"key {key} of node {node['id']} is missing from the Bloom filter")
+        if tree.page_index is not None:
+            pointers = {key: page for node in tree.collect_nodes() for key, page in node["keys"]}
+            if pointers != tree.page_index:
+                wrong = sorted(k for k in pointers.keys() | tree.page_index.keys()
+                               if pointers.get(k) != tree.page_index.get(k))
+                report.error(f"the hash index disagrees with the tree on {len(wrong)} keys, e.g. {wrong[:5]}")
+        report.print()
+
+    elif command == "EXPLAIN":
+        if len(tokens) < 2 or tokens[1].upper() not in TIMED_COMMANDS:
+            print(f"Usage: EXPLAIN <command>, where command is one of {', '.join(TIMED_COMMANDS)}")
+            return
+        explain_command(" ".join(tokens[1:]), tree)
+
     elif command == "ADDRANDOM":
         if len(tokens) != 2:
             print("Usage: ADDRANDOM <number_of_keys>")
@@ -1180,9 +458,11 @@ def execute_command(command_line, current_files):
         except ValueError:
             print("Invalid number of keys. Please provide an integer.")
             return
-        inserted, skipped = addrandom(num_keys, main_file=current_files['main_file'], node_filename=current_files['node_file'],
-                                      metadata_filename=current_files['metadata_file'],
-                                      node_metadata_filename=current_files['node_metadata_file'])
+        try:
+            inserted, skipped = tree.addrandom(num_keys)
+        except ValueError as e:
+            print(e)
+            return
         print(f"Inserted {inserted} keys, Skipped {skipped} duplicates.")
 
     elif command == "HELP":
@@ -1195,260 +475,339 @@ Available Commands:
         - <base_name>_nodes.dat
         - <base_name>_metadata.dat
         - <base_name>_nodes_metadata.dat
+        - <base_name>_config.json
       Existing files with these names will be overwritten.
-  LOAD <main_file>
-      Load an existing B-tree from the specified main data file.
+  LOAD <base_name>
+      Load an existing B-tree; its stored d and page size replace the configured ones.
   INSERT <key> <pA> <pB> <pAuB>
       Insert a new record with the specified key and probabilities.
   DELETE <key>
       Delete the record with the specified key.
   UPDATE <key> <new_pA> <new_pB> <new_pAuB>
-      Update the record with the specified key.
+      Update the record with the specified key in place, writing only the record.
   SEARCH <key>
-      Search for the record with the specified key.
-  PRINT
-      Display all records in the main file.
-  VISUALIZE
-      Generate and display a visual representation of the B-tree.
+      Search for the record with the specified key. With --hash-index, read it
+      straight from its data page and display it. With --record-cache-size, display
+      it, from memory if its key is read often.
+  RANGE <low_key> <high_key>
+      Display the records with keys between low_key and high_key, in key order,
+      and the number of data pages holding them.
+  CREATE INDEX ON p_a|p_b|p_aub
+      Build a secondary index over one probability field, kept up to date by
+      INSERT, UPDATE and DELETE and stored in <base_name>_idx_<field>_*.
+  WHERE p_a|p_b|p_aub BETWEEN <low> AND <high>
+      Display the records whose field lies between low and high, in field order,
+      reading only the matching data pages if the field has an index.
+  QUANTILE p_a|p_b|p_aub <q>
+      Display the q-quantile (0.5 for the median) of a probability field, from a
+      sketch kept up to date by INSERT, UPDATE and DELETE; reads no pages.
+  AGG COUNT|SUM|AVG|MIN|MAX|HISTOGRAM|VIOLATIONS [<column>] [BINS <n>] [KEYS <low_key> <high_key>]
+      Compute an aggregate of p_a, p_b, p_aub or p_aib (the implied P(A∩B)) over the
+      data file with NumPy. VIOLATIONS counts records whose probabilities are
+      inconsistent; KEYS only reads the pages holding the given keys.
+  EXPORT <file> [csv|bin] [<low_key> <high_key>]
+      Write the records, or those with keys between low_key and high_key, to a file
+      in key order: as CSV, or as a binary dump for RESTORE (the default). Reads a
+      snapshot, so other clients can keep writing, and uses constant memory.
+  RESTORE <dump_file> <base_name>
+      Create the tree base_name from a binary dump, overwriting its files, and open
+      it. The tree is built bottom-up with the configured d, page size and fill
+      factor, without inserting the records one by one.
+  VACUUM [<records_per_step>]
+      Rewrite the data file densely and in key order, then truncate it. Runs in
+      steps of 1024 records by default; other clients can write between steps.
+  SNAPSHOT
+      Pin the current state of the tree; prints the snapshot ID.
+  SNAPSHOT LIST
+      List the snapshots and the space they hold.
+  SNAPSHOT RELEASE <snapshot_id>
+      Drop a snapshot and free the old node versions kept for it.
+  PRINT [<snapshot_id>]
+      Display all records in the main file, or as they were in a snapshot.
+  VISUALIZE [<snapshot_id>] [depth <levels>] [subtree <node_id>]
+      Generate and display a visual representation of the B-tree or of a snapshot,
+      optionally only its top levels or the subtree under one node.
+  CONFIG
+      Display the configuration of the open tree.
+  VERIFY
+      Flush the caches and check the node, free-node and data files for corruption,
+      that the Bloom filter holds every key and that the hash index matches the tree.
+  EXPLAIN <command>
+      Run an INSERT, SEARCH, DELETE, UPDATE or RANGE command and display every node, page
+      and metadata access it made, with cache hits, splits, compensations and merges.
+  STATS [FULL]
+      Display the key count, height, nodes per level, free nodes, fill factor, page utilization,
+      the Bloom filter false-positive rates and saved reads and the record cache hit ratio, then
+      command latencies, phase timings, bytes read and written and write amplification.
+      FULL also walks the whole tree, checks the maintained figures against it and
+      measures how well the data pages follow key order (clustering).
   ADDRANDOM <number_of_keys>
       Generate and insert a specified number of random records.
   EXIT
       Exit the program.
 """)
 
-    elif command == "EXIT":
-        sys.exit(0)
-
     else:
         print(f"Unknown command: {command}. Type 'HELP' for a list of commands.")
 
 
+def print_global_counters(tree):
+    print("Global Operation Counters:")
+    for key, value in tree.counter_values().items():
+        print(f"{key.replace('_', ' ').capitalize()}: {value}")
 
-def delete_key(x, node_filename="btree_nodes.dat", main_file="data.dat"):
-    node, found = search_key(x, None, node_filename)
-    if found == 'not found':
-        return 'Not_Found'
-
-    if node is None:
-        raise ValueError(f"Node {node.node_id} could not be read.")
-
-    # Find key in node
-    record_index = None
-    page_num = None
-    for i, (k, p) in enumerate(node.keys):
-        if k == x:
-            record_index = i
-            page_num = p
-            break
-
-    if record_index is None:
-        raise ValueError("Key not found in node after searching. Data inconsistency!")
-
-    if node.leaf:
-        del node.keys[record_index]
-        remove_record_from_main_file(page_num, x, main_file)
-        if len(node.keys) == 0:
-            if node.parent_id != -1:
-                parent = read_node(node.parent_id, node_filename)
-                parent.children.remove(node.node_id)
-                save_node(parent, node_filename)
-                add_free_node(node.node_id)
-            else:
-                global root
-                root = None if len(node.children) == 0 else node.children[0]
-        elif len(node.keys) < min_keys:
-            handle_underflow(node, node_filename)
-        save_node(node, node_filename)
-        return 'OK'
-
-    if not node.leaf:
-        left_child_id = node.children[record_index]
-        right_child_id = node.children[record_index + 1]
-
-        if left_child_id is not None:
-            predecessor = get_largest_key(read_node(left_child_id, node_filename), node_filename)
-            node.keys[record_index] = predecessor
-            save_node(node, node_filename)
-            return delete_key(predecessor[0], node_filename, main_file)
-        elif right_child_id is not None:
-            successor = get_smallest_key(read_node(right_child_id, node_filename), node_filename)
-            node.keys[record_index] = successor
-            save_node(node, node_filename)
-            return delete_key(successor[0], node_filename, main_file)
-        handle_underflow(node, node_filename)
-
-    return 'OK'
-
-
-def handle_underflow(node, node_filename):
-    """
-    Handles underflow in a B-tree node through compensation or merging.
-
-    Parameters:
-    - node (BTreeNode): The node experiencing underflow.
-    - node_filename (str): Path to the B-tree nodes file.
 
-    Returns:
-    - None
-    """
-    if node.parent_id != -1:
-        # print(f'reading parent node {node.parent_id} when handling underflow.')
-        parent = read_node(node.parent_id, node_filename)
+def print_tree_stats(tree):
+    tree_stats = tree.tree_stats()
+    print(f"Keys: {tree_stats['keys']}")
+    print(f"Height: {tree_stats['height']}")
+    print(f"Nodes per level (leaves first): {' '.join(map(str, tree_stats['level_nodes']))}")
+    print(f"Free nodes: {tree_stats['free_nodes']}")
+    print(f"Fill factor: {tree_stats['fill_factor']:.3f}")
+    print(f"Page utilization: {tree_stats['page_utilization']:.3f}")
+    if tree.bloom is not None:
+        bloom = tree.bloom.summary()
+        observed = bloom["observed_fp_rate"]
+        print(f"Bloom filter: {bloom['keys']} keys, {bloom['counters']} counters, {bloom['hashes']} hashes, "
+              f"expected FP rate {bloom['expected_fp_rate']:.4f}, "
+              f"observed FP rate {'n/a' if observed is None else f'{observed:.4f}'}")
+        print(f"Bloom filter: {bloom['negatives']} lookups answered without a descent, "
+              f"{bloom['false_positives']} false positives, {bloom['saved_reads']} node reads saved")
+    if tree.page_index is not None:
+        print(f"Hash index: {len(tree.page_index)} keys")
+    if tree.record_cache is not None:
+        cache = tree.record_cache.summary()
+        ratio = cache["hit_ratio"]
+        print(f"Record cache: {cache['records']} of {cache['capacity']} records, {cache['hits']} hits, "
+              f"{cache['misses']} misses, hit ratio {'n/a' if ratio is None else f'{ratio:.4f}'}, "
+              f"{cache['admitted']} admitted over a colder record, {cache['rejected']} rejected")
+    for column, index in tree.secondary_indexes.items():
+        index_stats = index.tree_stats()
+        print(f"Index on {column}: {index_stats['keys']} entries, height {index_stats['height']}, "
+              f"{index_stats['nodes']} nodes")
+
+
+def verify_tree_stats(tree):
+    print_tree_stats(tree)
+    clustering = tree.clustering()
+    print(f"Clustering: {clustering['records']} records on {clustering['pages']} data pages, "
+          f"{clustering['page_changes']} page changes in key order (score {clustering['score']:.3f})")
+    scanned = tree.scan_stats()
+    mismatches = [(name, getattr(tree.stats, name), getattr(scanned, name))
+                  for name in ("keys", "free_nodes", "level_nodes")
+                  if getattr(tree.stats, name) != getattr(scanned, name)]
+    for name, kept, found in mismatches:
+        print(f"Mismatch in {name}: maintained {kept}, scan found {found}")
+    if not mismatches:
+        print("Statistics match a full scan of the tree.")
+
+
+def print_stats(tree):
+    print_tree_stats(tree)
+    stats = snapshot_metrics(tree)
+    header = f"{'count':>8} {'mean us':>10} {'p50 us':>10} {'p99 us':>10} {'max us':>10}"
+    print(f"{'command':<10}{header}")
+    for command, s in stats["commands"].items():
+        print(f"{command:<10}{s['count']:>8} {s['mean_us']:>10.1f} {s['p50_us']:>10.1f} "
+              f"{s['p99_us']:>10.1f} {s['max_us']:>10.1f}")
+    print(f"{'phase':<10}{header} {'total s':>10}")
+    for phase, s in stats["phases"].items():
+        print(f"{phase:<10}{s['count']:>8} {s['mean_us']:>10.1f} {s['p50_us']:>10.1f} "
+              f"{s['p99_us']:>10.1f} {s['max_us']:>10.1f} {s['total_s']:>10.3f}")
+    print(f"Bytes read: {stats['counters']['bytes_read']}")
+    print(f"Bytes written: {stats['counters']['bytes_written']}")
+    amplification = stats["write_amplification"]
+    print(f"Write amplification: {amplification if amplification is not None else 'n/a'}")
+
+
+def print_quantile(sketch, column, q):
+    value = sketch.quantile(q)
+    if value is None:
+        print(f"No values of {column}.")
     else:
-        return
+        print(f"Quantile {q:g} of {column}: {value} (approximate, over {sketch.count} values)")
 
-    idx = parent.children.index(node.node_id)
 
-    # Check left and right siblings
-    left_sibling_id = parent.children[idx - 1] if idx > 0 else None
-    right_sibling_id = parent.children[idx + 1] if idx < len(parent.children) - 1 else None
-    # print(f'reading syblings {left_sibling_id}  and {right_sibling_id} when handling underflow')
-    left_sibling = read_node(left_sibling_id, node_filename) if left_sibling_id is not None else None
-    right_sibling = read_node(right_sibling_id, node_filename) if right_sibling_id is not None else None
+AGG_FUNCTIONS = ("COUNT", "SUM", "AVG", "MIN", "MAX", "HISTOGRAM", "VIOLATIONS")
 
-    # Try compensation with left sibling
-    if left_sibling and len(left_sibling.keys) > min_keys:
-        transfer_key_from_left(node, left_sibling, parent, idx - 1, node_filename)
-        return
 
-    # Try compensation with right sibling
-    if right_sibling and len(right_sibling.keys) > min_keys:
-        transfer_key_from_right(node, right_sibling, parent, idx, node_filename)
+def run_agg(args, tree):
+    """
+    AGG <function> [<column>] [BINS <n>] [KEYS <low_key> <high_key>]
+    """
+    usage = (f"Usage: AGG {'|'.join(AGG_FUNCTIONS)} [{'|'.join(AGG_COLUMNS)}] "
+             f"[BINS <n>] [KEYS <low_key> <high_key>]")
+    if not args or args[0].upper() not in AGG_FUNCTIONS:
+        print(usage)
+        return
+    function = args[0].upper()
+    args = args[1:]
+    column = "p_a"
+    if function not in ("COUNT", "VIOLATIONS"):
+        if not args:
+            print(usage)
+            return
+        column = args[0].lower()
+        args = args[1:]
+    bins = 10
+    key_range = None
+    try:
+        while args:
+            option = args[0].upper()
+            if option == "BINS" and len(args) >= 2:
+                bins = int(args[1])
+                args = args[2:]
+            elif option == "KEYS" and len(args) >= 3:
+                key_range = (int(args[1]), int(args[2]))
+                args = args[3:]
+            else:
+                print(usage)
+                return
+        result = aggregate(tree, column, key_range, bins)
+    except (ValueError, RuntimeError) as e:
+        print(e)
         return
 
-    # If compensation is not possible, merge with a sibling
-    if left_sibling:
-        merge_nodes(left_sibling, node, parent, idx - 1, node_filename)
-    elif right_sibling:
-        merge_nodes(node, right_sibling, parent, idx, node_filename)
-
-
-def transfer_key_from_left(node, left_sibling, parent, parent_key_idx, node_filename):
-    # Transfer key from parent to node
-    node.keys.insert(0, parent.keys[parent_key_idx])
-    parent.keys[parent_key_idx] = left_sibling.keys.pop()
-
-    # Transfer child from left sibling to node (if not a leaf)
-    if not node.leaf:
-        # print(f'reading left sibling node {left_sibling.node_id} during transfer.')
-        child = read_node(left_sibling.children[-1], node_filename)
-        child.parent_id = node.node_id
-        save_node(child, node_filename)
-        node.children.insert(0, left_sibling.children.pop())
-
-    save_node(node, node_filename)
-    save_node(left_sibling, node_filename)
-    save_node(parent, node_filename)
-
-
-def transfer_key_from_right(node, right_sibling, parent, parent_key_idx, node_filename):
-    # Transfer key from parent to node
-    node.keys.append(parent.keys[parent_key_idx])
-    parent.keys[parent_key_idx] = right_sibling.keys.pop(0)
-
-    # Transfer child from right sibling to node (if not a leaf)
-    if not node.leaf:
-        # print(f'reading right sibling node {right_sibling.node_id} during transfer.')
-        child = read_node(right_sibling.children[0], node_filename)
-        child.parent_id = node.node_id
-        save_node(child, node_filename)
-        print(node.node_id)
-        print(child.node_id)
-        print(child.parent_id)
-
-        print(f'{right_sibling.children}')
-
-        node.children.append(right_sibling.children.pop(0))
-        print(f'{right_sibling.node_id}')
-
-        print(f'{right_sibling.children}')
+    scope = f" with keys in [{key_range[0]}, {key_range[1]}]" if key_range else ""
+    if function == "COUNT":
+        print(f"COUNT{scope}: {result['count']}")
+    elif function == "VIOLATIONS":
+        print(f"Records{scope} with inconsistent probabilities: {result['violations']} of {result['count']}")
+    elif function == "HISTOGRAM":
+        print(f"HISTOGRAM {column}{scope}:")
+        for low, high, n in result["histogram"]:
+            print(f"  [{low:.3f}, {high:.3f}] {n}")
+        if result["below"] or result["above"]:
+            print(f"  below {result['histogram'][0][0]:.3f}: {result['below']}, "
+                  f"above {result['histogram'][-1][1]:.3f}: {result['above']}")
+    else:
+        value = result[function.lower()]
+        print(f"{function} {column}{scope}: {'n/a' if value is None else value}")
+    print(f"{result['pages']} data pages read.")
 
-    save_node(node, node_filename)
-    save_node(right_sibling, node_filename)
-    save_node(parent, node_filename)
 
+def explain_command(command_line, tree):
+    """
+    Run a command with tracing on, then print its trace and a summary of it.
 
-def merge_nodes(left_node, right_node, parent, parent_key_idx, node_filename):
+    The command really runs: EXPLAIN INSERT inserts the record.
     """
-    Merges two sibling nodes into one and adjusts the parent.
+    tree.tracer.start()
+    start = time.perf_counter_ns()
+    try:
+        execute_command(command_line, tree)
+    finally:
+        elapsed_us = (time.perf_counter_ns() - start) / 1000
+        events = tree.tracer.stop()
+
+    print(f"{'step':>5} {'t us':>10} {'step us':>10}  event")
+    for step, e in enumerate(events, start=1):
+        details = " ".join(f"{k}={v}" for k, v in e.items() if k not in ("event", "t_us", "step_us"))
+        print(f"{step:>5} {e['t_us']:>10.1f} {e['step_us']:>10.1f}  {e['event']} {details}")
+
+    def count(event, **fields):
+        return sum(1 for e in events if e["event"] == event and all(e.get(k) == v for k, v in fields.items()))
+
+    visited = list(dict.fromkeys(e["node"] for e in events if e["event"] == "read_node"))
+    pages = sorted({e["page"] for e in events if e["event"] in ("read_page", "write_page", "write_record")})
+    print(f"Nodes visited: {' '.join(map(str, visited)) or '-'}")
+    print(f"Node reads: {count('read_node', hit=True)} hits, {count('read_node', hit=False)} misses; "
+          f"node saves: {count('save_node', cached=True)} cached, {count('save_node', cached=False)} to disk; "
+          f"evictions: {count('evict_node')}")
+    print(f"Pages touched: {' '.join(map(str, pages)) or '-'}; "
+          f"page reads: {count('read_page', hit=True)} hits, {count('read_page', hit=False)} misses; "
+          f"page writes: {count('write_page')}, in-place record writes: {count('write_record')}")
+    print(f"Splits: {count('split') + count('split_two_to_three')}, compensations: {count('compensation')}, "
+          f"underflows: {count('underflow')}, merges: {count('merge')}")
+    print(f"Metadata loads: {count('metadata_load')}, saves: {count('metadata_save')}")
+    print(f"Elapsed: {elapsed_us:.1f} us")
+
+
+def execute_and_measure(command_line, tree, command_metrics):
     """
-    merging_key = parent.keys.pop(parent_key_idx)
-    left_node.keys.append(merging_key)
-    left_node.keys.extend(right_node.keys)
-    left_node.children.extend(right_node.children)
-
-    if not right_node.leaf:
-        for child_id in right_node.children:
-            child_node = read_node(child_id, node_filename)
-            child_node.parent_id = left_node.node_id
-            save_node(child_node, node_filename)
-
-    print(f'{left_node.keys}')
-    print(f'{parent.keys}')
-
-    parent.children.remove(right_node.node_id)
-    right_node.keys.clear()
-    right_node.children.clear()
-    save_node(left_node, node_filename)
-    save_node(right_node, node_filename)
-
-    save_node(parent, node_filename)
-
-    if len(parent.keys) < min_keys:
-        handle_underflow(parent, node_filename)
-    if len(parent.keys) == 0 and parent.parent_id == -1:
-        left_node.parent_id = parent.parent_id
-        save_node(left_node, node_filename)
-        parent.children.clear()
-        save_node(parent, node_filename)
-        save_node(left_node, node_filename)
-        global root
-        root = left_node.node_id
-    # Mark the right node as free
-    add_free_node(right_node.node_id)
-
-
-def get_largest_key(node, node_filename):
-    while not node.leaf:
-        node = read_node(node.children[-1], node_filename)
-    return node.keys[-1]
-
-
-def get_smallest_key(node, node_filename):
-    while not node.leaf:
-        node = read_node(node.children[0], node_filename)
-    return node.keys[0]
-
-
-def delete_metadata_files(*filenames):
-    for filename in filenames:
-        if os.path.exists(filename):
-            try:
-                os.remove(filename)
-                print(f"Deleted existing file: {filename}")
-            except OSError as e:
-                print(f"Error deleting file {filename}: {e}")
-
-
-
-def print_global_counters():
-    print("Global Operation Counters:")
-    for key, value in global_counters.items():
-        print(f"{key.replace('_', ' ').capitalize()}: {value}")
+    Run a command and append its wall time and counter deltas to command_metrics.
+    """
+    before = tree.counter_values()
+    start = time.perf_counter()
+    try:
+        execute_command(command_line, tree)
+    finally:
+        elapsed = time.perf_counter() - start
+        after = tree.counter_values()
+        command_metrics.append({
+            "command": command_line.strip(),
+            "time_s": round(elapsed, 6),
+            "counters": {key: after[key] - before.get(key, 0) for key in after},
+        })
+
+
+def write_metrics_json(path, tree, command_metrics, seed=None):
+    metrics = {
+        "config": {**tree.config.to_dict(), "seed": seed},
+        "time_s": round(sum(m["time_s"] for m in command_metrics), 6),
+        "counters": tree.counter_values(),
+        "commands": command_metrics,
+    }
+    with open(path, "w") as f:
+        json.dump(metrics, f, indent=2)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="B-tree Management Program with Main File Switching")
     parser.add_argument('-t', '--testfile', type=str, help='Path to the test file containing commands')
+    parser.add_argument('--config', type=str,
+                        help='JSON file with any of d, page_size, cache_size, page_cache_size, split_policy, '
+                             'fill_factor, bloom_bits_per_key, hash_index, placement, page_fill, record_cache_size; '
+                             'the options below override it')
+    parser.add_argument('--split-policy', choices=["classic", "bstar"],
+                        help='Split policy used when compensation is not possible')
+    parser.add_argument('--fill-factor', type=float, help='Target node occupancy for bstar splits and RESTORE (0.5-1.0)')
+    parser.add_argument('--bloom-bits-per-key', type=int,
+                        help='Bloom filter counters per key (default 10); 0 disables the filter')
+    parser.add_argument('--hash-index', action='store_true', default=None,
+                        help='Keep a key -> record ID hash index for point reads and updates')
+    parser.add_argument('--placement', choices=BTreeConfig.PLACEMENTS,
+                        help='Data page of new records: the first with room, or next to their key neighbours')
+    parser.add_argument('--page-fill', type=float,
+                        help='Share of the record slots of each data page filled by VACUUM and RESTORE (0-1.0]')
+    parser.add_argument('--record-cache-size', type=int,
+                        help='Number of hot records cached for SEARCH (default 0, no cache)')
+    parser.add_argument('--d', type=int, help='Minimum degree of the B-tree')
+    parser.add_argument('--cache-size', type=int, help='Number of cached nodes')
+    parser.add_argument('--page-cache-size', type=int, help='Number of cached data pages')
+    parser.add_argument('--page-size', type=int, help='Size of a data page in bytes')
+    parser.add_argument('--seed', type=int, help='Seed for ADDRANDOM')
+    parser.add_argument('--metrics-json', type=str,
+                        help='Write the configuration, total counters and per-command counters to this file on exit')
+    parser.add_argument('--metrics-file', type=str,
+                        help='Periodically write latency histograms and counters to <path>.json and <path>.prom')
+    parser.add_argument('--metrics-interval', type=float, default=10.0,
+                        help='Seconds between two writes of --metrics-file')
+    parser.add_argument('--trace-file', type=str,
+                        help='Record every node and page access to this file, for cachesim.py')
+    parser.add_argument('--no-counters', action='store_true',
+                        help='Do not print the operation counters after every command')
     args = parser.parse_args()
 
-    # Initialize current active files
-    current_files = {
-        'main_file': None,
-        'node_file': None,
-        'metadata_file': None,
-        'node_metadata_file': None
-    }
+    try:
+        config = BTreeConfig.from_file(args.config) if args.config else BTreeConfig()
+        config.update({name: value for name, value in (("d", args.d), ("page_size", args.page_size),
+                                                        ("cache_size", args.cache_size),
+                                                        ("page_cache_size", args.page_cache_size),
+                                                        ("split_policy", args.split_policy),
+                                                        ("fill_factor", args.fill_factor),
+                                                        ("bloom_bits_per_key", args.bloom_bits_per_key),
+                                                        ("hash_index", args.hash_index),
+                                                        ("placement", args.placement),
+                                                        ("page_fill", args.page_fill),
+                                                        ("record_cache_size", args.record_cache_size))
+                       if value is not None})
+        tree = BTree(config)
+    except (OSError, ValueError) as e:
+        print(e)
+        sys.exit(1)
+    if args.seed is not None:
+        random.seed(args.seed)
 
     if not args.testfile:
         # Interactive Mode Initialization
@@ -1463,47 +822,25 @@ if __name__ == "__main__":
         if choice == "1":
             # Define default base name
             default_base = "default"
-            default_main_file = f"{default_base}_data.dat"
-            default_node_file = f"{default_base}_nodes.dat"
-            default_metadata_file = f"{default_base}_metadata.dat"
-            default_node_metadata_file = f"{default_base}_nodes_metadata.dat"
 
             # Check if default files exist
-            if not all(os.path.exists(f) for f in
-                       [default_main_file, default_node_file, default_metadata_file, default_node_metadata_file]):
+            if not tree_exists(default_base):
                 print("Default files do not exist. Creating a new B-tree with default files.")
-                # Initialize default B-tree
-                generate_main_file(default_main_file, 0)
-                add_underutilized_page(0, default_metadata_file)
-                init_btree_nodes_file(default_node_file)
-                init_node_metadata(default_node_metadata_file)
-                init_metadata(default_metadata_file)
+                tree.create(default_base)
                 print("Default B-tree created successfully.")
             else:
                 print("Loading existing default B-tree files.")
-
-            # Set current_files to default
-            current_files['main_file'] = default_main_file
-            current_files['node_file'] = default_node_file
-            current_files['metadata_file'] = default_metadata_file
-            current_files['node_metadata_file'] = default_node_metadata_file
-
-            # Load the B-tree
-            load_main_file(default_main_file, default_node_file, default_metadata_file, default_node_metadata_file)
-            print("Default B-tree loaded successfully.")
+                tree.load(default_base)
+                print("Default B-tree loaded successfully.")
 
         elif choice == "2":
             # Overwrite Default Files by Creating a New B-tree with default base name
             default_base = "default"
-            default_main_file = f"{default_base}_data.dat"
-            default_node_file = f"{default_base}_nodes.dat"
-            default_metadata_file = f"{default_base}_metadata.dat"
-            default_node_metadata_file = f"{default_base}_nodes_metadata.dat"
 
             print("Overwriting default files by creating a new B-tree with base name 'default'...")
             # Create a new B-tree with default base name
             create_new_btree = f"CREATE {default_base}"
-            execute_command(create_new_btree, current_files)
+            execute_command(create_new_btree, tree)
 
         elif choice == "3":
             # Create a New B-tree with a Custom Base Name
@@ -1512,7 +849,7 @@ if __name__ == "__main__":
                 print("Invalid base name. Exiting.")
                 sys.exit(1)
             create_command = f"CREATE {base_name}"
-            execute_command(create_command, current_files)
+            execute_command(create_command, tree)
 
         elif choice == "4":
             # Load an Existing B-tree with a Custom Base Name
@@ -1521,36 +858,51 @@ if __name__ == "__main__":
                 print("Invalid base name. Exiting.")
                 sys.exit(1)
             load_command = f"LOAD {base_name}"
-            execute_command(load_command, current_files)
+            execute_command(load_command, tree)
         else:
             print("Invalid choice. Exiting.")
             sys.exit(1)
 
-    # Proceed with either batch mode or interactive mode
-    if args.testfile:
-        if not os.path.exists(args.testfile):
-            print(f"Test file '{args.testfile}' does not exist.")
-            sys.exit(1)
-
-        with open(args.testfile, 'r') as tf:
-            for line_number, line in enumerate(tf, start=1):
-                stripped_line = line.strip()
-                if not stripped_line or stripped_line.startswith('#'):
-                    continue
-                print(f">>> {stripped_line}")
-                execute_command(stripped_line, current_files)
-                print_global_counters()
+    command_metrics = []
+    if args.trace_file:
+        tree.tracer.recorder = AccessRecorder(args.trace_file)
+    exporter = MetricsExporter(tree, args.metrics_file, args.metrics_interval).start() if args.metrics_file else None
+    try:
+        # Proceed with either batch mode or interactive mode
+        if args.testfile:
+            if not os.path.exists(args.testfile):
+                print(f"Test file '{args.testfile}' does not exist.")
+                sys.exit(1)
 
-        print("Batch processing completed.")
-    else:
-        print("Entering interactive mode. Type 'HELP' for a list of commands or 'EXIT' to quit.")
-        while True:
-            signal.signal(signal.SIGINT, handle_exit_signal)
-            signal.signal(signal.SIGTERM, handle_exit_signal)
-            try:
-                command_line = input("B-tree> ")
-                execute_command(command_line, current_files)
-                print_global_counters()
-            except (EOFError, KeyboardInterrupt):
-                print("\nExiting interactive mode.")
-                break
+            with open(args.testfile, 'r') as tf:
+                for line_number, line in enumerate(tf, start=1):
+                    stripped_line = line.strip()
+                    if not stripped_line or stripped_line.startswith('#'):
+                        continue
+                    print(f">>> {stripped_line}")
+                    execute_and_measure(stripped_line, tree, command_metrics)
+                    if not args.no_counters:
+                        print_global_counters(tree)
+
+            print("Batch processing completed.")
+        else:
+            print("Entering interactive mode. Type 'HELP' for a list of commands or 'EXIT' to quit.")
+            exit_handler = functools.partial(handle_exit_signal, tree=tree)
+            while True:
+                signal.signal(signal.SIGINT, exit_handler)
+                signal.signal(signal.SIGTERM, exit_handler)
+                try:
+                    command_line = input("B-tree> ")
+                    execute_and_measure(command_line, tree, command_metrics)
+                    if not args.no_counters:
+                        print_global_counters(tree)
+                except (EOFError, KeyboardInterrupt):
+                    print("\nExiting interactive mode.")
+                    break
+    finally:
+        if exporter:
+            exporter.stop()
+        if tree.tracer.recorder:
+            tree.tracer.recorder.close()
+        if args.metrics_json:
+            write_metrics_json(args.metrics_json, tree, command_metrics, args.seed)
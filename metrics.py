@@ -0,0 +1,297 @@
+import functools
+import json
+import os
+import threading
+import time
+
+# Latency histograms, phase timings and access traces of a tree, and the
+# export of the metrics.
+#
+# Every BTree has a Metrics object. Commands run through main.execute_command
+# are timed per command, and the tree methods decorated with timed_phase are
+# timed per phase. Phases nest (a split reads and writes pages), so a phase
+# includes the time of the phases inside it; a phase re-entered on the same
+# thread (a split propagating upwards) is only timed once, at the outermost
+# call.
+
+TIMED_COMMANDS = ("INSERT", "SEARCH", "DELETE", "UPDATE", "RANGE")
+PHASES = ("descent", "page_io", "split", "underflow", "metadata")
+
+# Quantiles of every probability field exported with the metrics
+EXPORTED_QUANTILES = (0.5, 0.9, 0.99)
+
+# Bucket upper bounds in microseconds: 1-2-5 steps from 1 us to 10 s
+BUCKET_BOUNDS_US = [m * 10 ** e for e in range(7) for m in (1, 2, 5)] + [10 ** 7]
+
+
+class LatencyHistogram:
+    """
+    Fixed-bucket latency histogram. Percentiles are the upper bound of the
+    bucket holding them, capped at the largest value seen.
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS_US) + 1)  # last bucket: above 10 s
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def record(self, elapsed_ns):
+        us = elapsed_ns / 1000
+        i = 0
+        while i < len(BUCKET_BOUNDS_US) and us > BUCKET_BOUNDS_US[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.total_ns += elapsed_ns
+        self.max_ns = max(self.max_ns, elapsed_ns)
+
+    def percentile_us(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                bound = BUCKET_BOUNDS_US[i] if i < len(BUCKET_BOUNDS_US) else float("inf")
+                return min(bound, self.max_ns / 1000)
+        return self.max_ns / 1000
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean_us": round(self.total_ns / self.count / 1000, 2) if self.count else 0.0,
+            "p50_us": round(self.percentile_us(0.50), 2),
+            "p99_us": round(self.percentile_us(0.99), 2),
+            "max_us": round(self.max_ns / 1000, 2),
+            "total_s": round(self.total_ns / 1e9, 6),
+        }
+
+
+class PhaseTimer:
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        active = self.metrics.active_phases()
+        self.outermost = self.name not in active
+        if self.outermost:
+            active.add(self.name)
+            self.start = time.perf_counter_ns()
+
+    def __exit__(self, *exc):
+        if self.outermost:
+            elapsed = time.perf_counter_ns() - self.start
+            self.metrics.active_phases().discard(self.name)
+            self.metrics.record_phase(self.name, elapsed)
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.commands = {command: LatencyHistogram() for command in TIMED_COMMANDS}
+        self.phases = {phase: LatencyHistogram() for phase in PHASES}
+        # Records inserted, updated or deleted in the data file
+        self.records_written = 0
+        # Phases entered by the current thread and not left yet
+        self.local = threading.local()
+
+    def active_phases(self):
+        if not hasattr(self.local, "phases"):
+            self.local.phases = set()
+        return self.local.phases
+
+    def phase(self, name):
+        return PhaseTimer(self, name)
+
+    def record_phase(self, name, elapsed_ns):
+        with self.lock:
+            self.phases[name].record(elapsed_ns)
+
+    def record_command(self, command, elapsed_ns):
+        with self.lock:
+            self.commands[command].record(elapsed_ns)
+
+    def record_write(self):
+        with self.lock:
+            self.records_written += 1
+
+    def reset(self):
+        with self.lock:
+            self.commands = {command: LatencyHistogram() for command in TIMED_COMMANDS}
+            self.phases = {phase: LatencyHistogram() for phase in PHASES}
+            self.records_written = 0
+
+
+class Tracer:
+    """
+    Structured trace of the node, page and metadata accesses of one operation.
+
+    Tracing is per thread: only events emitted by the thread that called start
+    are kept, so other clients of the tree do not show up in the trace. A
+    recorder (cachesim.AccessRecorder), if set, is given every event of every
+    thread.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+        self.recorder = None
+
+    def start(self):
+        self.local.events = []
+        self.local.start = self.local.last = time.perf_counter_ns()
+
+    def stop(self):
+        """
+        Returns:
+        - list: The events emitted since start, as dicts with the event name,
+          t_us (time since start), step_us (time since the previous event)
+          and the fields given to emit.
+        """
+        events = self.local.events
+        self.local.events = None
+        return events
+
+    def emit(self, event, **fields):
+        if self.recorder is not None:
+            self.recorder.record_event(event, fields)
+        events = getattr(self.local, "events", None)
+        if events is None:
+            return
+        now = time.perf_counter_ns()
+        events.append({"event": event,
+                       "t_us": round((now - self.local.start) / 1000, 1),
+                       "step_us": round((now - self.local.last) / 1000, 1),
+                       **fields})
+        self.local.last = now
+
+
+def timed_phase(name):
+    """
+    Decorator for BTree methods: time each call as the given phase.
+    """
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.metrics.phase(name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def snapshot_metrics(tree):
+    """
+    Collect the histograms and counters of a tree into a JSON-ready dict.
+
+    Write amplification is the bytes written to the node, data and metadata
+    files per byte of record inserted, updated or deleted in the data file.
+    """
+    with tree.metrics.lock:
+        commands = {c: h.summary() for c, h in tree.metrics.commands.items()}
+        phases = {p: h.summary() for p, h in tree.metrics.phases.items()}
+        records_written = tree.metrics.records_written
+    # btree imports this module, so it can only be imported once both are loaded
+    from btree import record_size
+    counters = tree.counter_values()
+    return {
+        "time": round(time.time(), 3),
+        "tree": tree.base_name,
+        "commands": commands,
+        "phases": phases,
+        "counters": counters,
+        "tree_stats": tree.tree_stats(),
+        "bloom": tree.bloom.summary() if tree.bloom is not None else None,
+        "record_cache": tree.record_cache.summary() if tree.record_cache is not None else None,
+        "quantiles": {column: {f"p{round(q * 100)}": sketch.quantile(q) for q in EXPORTED_QUANTILES}
+                      for column, sketch in tree.sketches.items()},
+        "records_written": records_written,
+        "write_amplification": round(counters["bytes_written"] / (records_written * record_size), 2)
+        if records_written else None,
+    }
+
+
+def prometheus_text(tree):
+    """
+    Render the histograms and counters of a tree in the Prometheus text format.
+    """
+    tree_label = f'tree="{tree.base_name or ""}"'
+    lines = []
+    with tree.metrics.lock:
+        for metric, label, histograms, help_text in (
+                ("btree_command_latency_seconds", "command", tree.metrics.commands, "Latency of tree commands."),
+                ("btree_phase_seconds", "phase", tree.metrics.phases, "Time spent in each phase of the commands.")):
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} histogram")
+            for name, h in histograms.items():
+                labels = f'{tree_label},{label}="{name}"'
+                cumulative = 0
+                for bound, n in zip(BUCKET_BOUNDS_US, h.counts):
+                    cumulative += n
+                    lines.append(f'{metric}_bucket{{{labels},le="{bound / 1e6:g}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{{labels},le="+Inf"}} {h.count}')
+                lines.append(f"{metric}_sum{{{labels}}} {h.total_ns / 1e9:.9f}")
+                lines.append(f"{metric}_count{{{labels}}} {h.count}")
+    for counter, value in tree.counter_values().items():
+        metric = f"btree_{counter}_total"
+        lines.append(f"# TYPE {metric} counter")
+        lines.append(f"{metric}{{{tree_label}}} {value}")
+    tree_stats = tree.tree_stats()
+    for name in ("keys", "height", "nodes", "free_nodes", "fill_factor", "page_utilization"):
+        metric = f"btree_{name}"
+        lines.append(f"# TYPE {metric} gauge")
+        lines.append(f"{metric}{{{tree_label}}} {tree_stats[name]}")
+    if tree.record_cache is not None:
+        cache = tree.record_cache.summary()
+        for name, kind in (("hits", "counter"), ("misses", "counter"), ("records", "gauge")):
+            metric = f"btree_record_cache_{name}{'_total' if kind == 'counter' else ''}"
+            lines.append(f"# TYPE {metric} {kind}")
+            lines.append(f"{metric}{{{tree_label}}} {cache[name]}")
+    lines.append("# HELP btree_record_quantile Quantiles of the probability fields, from the sketches.")
+    lines.append("# TYPE btree_record_quantile gauge")
+    for column, sketch in tree.sketches.items():
+        for q in EXPORTED_QUANTILES:
+            value = sketch.quantile(q)
+            if value is not None:
+                lines.append(f'btree_record_quantile{{{tree_label},column="{column}",quantile="{q:g}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+def write_atomically(path, text):
+    # Readers of the file never see it half written
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+class MetricsExporter:
+    """
+    Write the metrics of a tree every interval seconds to <path>.json and
+    <path>.prom, and once more when stopped.
+    """
+
+    def __init__(self, tree, path, interval=10.0):
+        self.tree = tree
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.export()
+
+    def export(self):
+        write_atomically(f"{self.path}.json", json.dumps(snapshot_metrics(self.tree), indent=2) + "\n")
+        write_atomically(f"{self.path}.prom", prometheus_text(self.tree))
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.export()
@@ -0,0 +1,170 @@
+import threading
+from collections import OrderedDict
+
+from bloom import mix64
+
+# Cache of whole records for point reads of hot keys.
+#
+# A hit answers SEARCH without a descent or a page read. Admission is
+# W-TinyLFU: a record read for the first time goes to a small LRU window,
+# and the record the window pushes out only replaces the least recently
+# used record of the main area if its key was read more often, as counted
+# by a count-min sketch of the recent reads. Reads of many cold keys, e.g.
+# a sweep over the key space, cycle through the window and never displace
+# the hot keys. The sketch halves all its counters every SAMPLE_FACTOR *
+# capacity reads, so keys that cool down lose their place.
+#
+# Writers keep the cache exact: UPDATE replaces a cached record, DELETE and
+# INSERT drop the key. Each of them also bumps the epoch, and a reader only
+# admits the record it read if the epoch is still the one it saw before
+# reading, so a record overwritten meanwhile is never cached.
+
+# Share of the capacity given to the window
+WINDOW_SHARE = 0.01
+SKETCH_ROWS = 4
+# Counters stop at 15, as in the 4-bit counters of TinyLFU
+COUNTER_MAX = 15
+SAMPLE_FACTOR = 10
+# Byte translation table halving a counter
+HALVE = bytes(c >> 1 for c in range(256))
+
+
+class FrequencySketch:
+    """
+    Count-min sketch of recent key reads, aged by halving.
+
+    Parameters:
+    - capacity (int): Number of keys of the cache the sketch serves.
+    """
+
+    def __init__(self, capacity):
+        width = 16
+        while width < capacity:
+            width *= 2
+        self.width = width
+        self.counters = bytearray(SKETCH_ROWS * width)
+        self.sample_size = SAMPLE_FACTOR * max(capacity, 1)
+        self.additions = 0
+
+    def positions(self, key):
+        h = mix64(key)
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        mask = self.width - 1
+        return [row * self.width + ((h1 + row * h2) & mask) for row in range(SKETCH_ROWS)]
+
+    def increment(self, key):
+        counters = self.counters
+        for p in self.positions(key):
+            if counters[p] < COUNTER_MAX:
+                counters[p] += 1
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            self.age()
+
+    def frequency(self, key):
+        counters = self.counters
+        return min(counters[p] for p in self.positions(key))
+
+    def age(self):
+        self.counters = bytearray(self.counters.translate(HALVE))
+        self.additions //= 2
+
+
+class RecordCache:
+    """
+    Bounded key -> Record cache with frequency-aware admission.
+
+    Parameters:
+    - capacity (int): Maximum number of records held.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.window_capacity = max(1, int(capacity * WINDOW_SHARE))
+        self.main_capacity = capacity - self.window_capacity
+        self.window = OrderedDict()
+        self.main = OrderedDict()
+        self.sketch = FrequencySketch(capacity)
+        self.lock = threading.Lock()
+        # Bumped by every write to a key; see admit
+        self.epoch = 0
+        self.hits = 0
+        self.misses = 0
+        # Records the window pushed out that replaced a main record, and that were dropped
+        self.admitted = 0
+        self.rejected = 0
+
+    def __len__(self):
+        return len(self.window) + len(self.main)
+
+    def get(self, key):
+        """
+        Count a read of key and return its cached record, or None.
+        """
+        with self.lock:
+            self.sketch.increment(key)
+            for area in (self.main, self.window):
+                record = area.get(key)
+                if record is not None:
+                    area.move_to_end(key)
+                    self.hits += 1
+                    return record
+            self.misses += 1
+            return None
+
+    def admit(self, key, record, epoch):
+        """
+        Offer a record read after a miss.
+
+        Parameters:
+        - epoch (int): The epoch read before the record was read; if a write
+          happened since, the record may be stale and is not cached.
+        """
+        with self.lock:
+            if epoch != self.epoch or key in self.window or key in self.main:
+                return
+            self.window[key] = record
+            if len(self.window) <= self.window_capacity:
+                return
+            candidate, candidate_record = self.window.popitem(last=False)
+            if len(self.main) < self.main_capacity:
+                self.main[candidate] = candidate_record
+                return
+            if not self.main:
+                return
+            victim = next(iter(self.main))
+            if self.sketch.frequency(candidate) > self.sketch.frequency(victim):
+                del self.main[victim]
+                self.main[candidate] = candidate_record
+                self.admitted += 1
+            else:
+                self.rejected += 1
+
+    def update(self, key, record):
+        """
+        Replace the cached record of key, if any, after the record was rewritten.
+        """
+        with self.lock:
+            self.epoch += 1
+            for area in (self.main, self.window):
+                if key in area:
+                    area[key] = record
+
+    def invalidate(self, key):
+        with self.lock:
+            self.epoch += 1
+            self.window.pop(key, None)
+            self.main.pop(key, None)
+
+    def summary(self):
+        with self.lock:
+            reads = self.hits + self.misses
+            return {
+                "records": len(self.window) + len(self.main),
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / reads, 4) if reads else None,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+            }
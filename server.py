@@ -0,0 +1,291 @@
+import argparse
+import asyncio
+import io
+import json
+import signal
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import main
+from btree import BTree, BTreeConfig, RWLatch, tree_exists
+from metrics import MetricsExporter
+
+# Network front end for the command vocabulary of main.execute_command.
+#
+# Each client sends one command per line and gets one JSON object per line
+# back, in request order, so a client may pipeline as many commands as it
+# likes before reading the answers:
+#
+#   {"id": 3, "command": "SEARCH 17", "ok": true, "result": "...", "output": [...]}
+#
+# Writes from all connections go through a single commit loop. It takes every
+# write waiting at that moment (up to --max-batch), runs them back to back and
+# flushes the caches once for the whole batch before any of them is answered.
+# SEARCH and RANGE run on a thread pool next to the writes; they rely on the
+# node latches of the tree. Within one connection requests still take effect in
+# the order they were sent: a read waits for the earlier writes, and a write
+# is queued only once the earlier reads have finished.
+
+READ_COMMANDS = {"SEARCH", "RANGE", "WHERE", "AGG", "QUANTILE", "EXPORT", "STATS", "HELP"}
+# Record-level writes are latched inside the tree and may run next to reads.
+# Everything else touches the whole tree or the open files and runs alone.
+RECORD_WRITE_COMMANDS = {"INSERT", "DELETE", "UPDATE", "ADDRANDOM", "VACUUM"}
+DURABLE_COMMANDS = RECORD_WRITE_COMMANDS | {"CREATE", "LOAD", "RESTORE", "FLUSH"}
+
+MAX_BATCH = 64
+
+
+class CapturedStdout(io.TextIOBase):
+    """
+    Stand-in for sys.stdout that sends each thread's output to its own buffer.
+
+    Threads that are not capturing write to the real stdout.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, text):
+        buffer = getattr(self.local, "buffer", None)
+        if buffer is None:
+            return self.stream.write(text)
+        return buffer.write(text)
+
+    def flush(self):
+        if getattr(self.local, "buffer", None) is None:
+            self.stream.flush()
+
+    def start(self):
+        self.local.buffer = io.StringIO()
+
+    def stop(self):
+        text = self.local.buffer.getvalue()
+        self.local.buffer = None
+        return [line for line in text.splitlines() if line.strip()]
+
+
+stdout = CapturedStdout(sys.stdout)
+
+
+def command_name(command_line):
+    """
+    Name of the command, or of the command it explains for EXPLAIN, which is
+    latched and flushed like the command itself.
+    """
+    tokens = command_line.split()
+    if tokens[0].upper() == "EXPLAIN" and len(tokens) > 1:
+        return tokens[1].upper()
+    return tokens[0].upper()
+
+
+def run_command(tree, tree_latch, command_line):
+    """
+    Run one command against the tree and collect what it printed.
+
+    tree_latch is taken shared by reads and record writes, exclusively by the
+    other commands.
+
+    Returns:
+    - dict: The response fields other than the request id.
+    """
+    command = command_name(command_line)
+    exclusive = command not in READ_COMMANDS and command not in RECORD_WRITE_COMMANDS
+    response = {"command": command_line, "ok": True}
+    if exclusive:
+        tree_latch.acquire_write()
+    else:
+        tree_latch.acquire_read()
+    stdout.start()
+    try:
+        main.execute_command(command_line, tree)
+    except (Exception, SystemExit) as e:
+        response["ok"] = False
+        response["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        output = stdout.stop()
+        tree_latch.release()
+    response["result"] = output[-1] if output else ""
+    response["output"] = output
+    return response
+
+
+def run_batch(tree, tree_latch, command_lines):
+    """
+    Run a batch of writes and make them durable with a single cache flush.
+    """
+    responses = [run_command(tree, tree_latch, line) for line in command_lines]
+    if any(command_name(line) in DURABLE_COMMANDS for line in command_lines):
+        tree_latch.acquire_read()
+        stdout.start()
+        try:
+            tree.flush_caches()
+        finally:
+            stdout.stop()
+            tree_latch.release()
+    return responses
+
+
+class Server:
+    def __init__(self, tree, max_batch=MAX_BATCH, read_threads=4):
+        self.tree = tree
+        # Shared by reads and record writes, exclusive for the other commands
+        self.tree_latch = RWLatch()
+        self.max_batch = max_batch
+        self.writes = asyncio.Queue()
+        # One writer thread keeps the batches in arrival order
+        self.write_executor = ThreadPoolExecutor(max_workers=1)
+        self.read_executor = ThreadPoolExecutor(max_workers=read_threads)
+        self.batches = 0
+        self.batched_writes = 0
+
+    async def commit_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.writes.get()]
+            while len(batch) < self.max_batch and not self.writes.empty():
+                batch.append(self.writes.get_nowait())
+            lines = [line for line, _ in batch]
+            try:
+                responses = await loop.run_in_executor(self.write_executor, run_batch, self.tree, self.tree_latch,
+                                                       lines)
+            except Exception as e:
+                responses = [{"command": line, "ok": False, "error": f"{type(e).__name__}: {e}"} for line in lines]
+            self.batches += 1
+            self.batched_writes += len(batch)
+            for (_, future), response in zip(batch, responses):
+                if not future.done():
+                    future.set_result(response)
+
+    async def run_read(self, command_line, after):
+        if after is not None:
+            await asyncio.wait([after])
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.read_executor, run_command, self.tree, self.tree_latch,
+                                          command_line)
+
+    async def queue_write(self, command_line, future, after):
+        if after:
+            await asyncio.wait(after)
+        await self.writes.put((command_line, future))
+
+    async def handle_client(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        pending = asyncio.Queue()
+        sender = asyncio.create_task(self.send_responses(pending, writer))
+        last_write = None
+        # Reads sent since the last write, and the task queueing that write
+        reads = []
+        queued = None
+        request_id = 0
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command_line = line.decode("utf-8", errors="replace").strip()
+                if not command_line:
+                    continue
+                request_id += 1
+                command = command_name(command_line)
+                if command == "EXIT":
+                    # Only this connection goes away, the tree stays open
+                    done = loop.create_future()
+                    done.set_result({"command": command_line, "ok": True, "result": "Bye.", "output": ["Bye."]})
+                    await pending.put((request_id, done))
+                    break
+                if command in READ_COMMANDS:
+                    future = asyncio.ensure_future(self.run_read(command_line, last_write))
+                    reads.append(future)
+                else:
+                    future = loop.create_future()
+                    after = reads + ([queued] if queued is not None and not queued.done() else [])
+                    queued = asyncio.ensure_future(self.queue_write(command_line, future, after))
+                    last_write = future
+                    reads = []
+                await pending.put((request_id, future))
+        finally:
+            await pending.put(None)
+            await sender
+            writer.close()
+
+    async def send_responses(self, pending, writer):
+        while True:
+            item = await pending.get()
+            if item is None:
+                break
+            request_id, future = item
+            response = await future
+            try:
+                writer.write((json.dumps({"id": request_id, **response}) + "\n").encode("utf-8"))
+                await writer.drain()
+            except ConnectionError:
+                pass
+
+
+async def serve(tree, args):
+    server = Server(tree, args.max_batch, args.read_threads)
+    committer = asyncio.create_task(server.commit_loop())
+    if args.unix:
+        listener = await asyncio.start_unix_server(server.handle_client, path=args.unix)
+        where = args.unix
+    else:
+        listener = await asyncio.start_server(server.handle_client, args.host, args.port)
+        where = f"{args.host}:{args.port}"
+    print(f"Serving B-tree '{args.base}' on {where}.", file=stdout.stream, flush=True)
+    serving = asyncio.ensure_future(listener.serve_forever())
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, serving.cancel)
+    try:
+        await serving
+    except asyncio.CancelledError:
+        pass
+    finally:
+        listener.close()
+        committer.cancel()
+        server.write_executor.shutdown()
+        server.read_executor.shutdown()
+    print(f"{server.batched_writes} writes committed in {server.batches} batches.", file=stdout.stream)
+
+
+def open_tree(base_name, config):
+    tree = BTree(config)
+    stdout.start()
+    try:
+        if tree_exists(base_name):
+            tree.load(base_name)
+        else:
+            tree.create(base_name)
+    finally:
+        stdout.stop()
+    return tree
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a B-tree over TCP or a Unix socket")
+    parser.add_argument('--base', default="default", help='Base name of the tree; created if its files do not exist')
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=7070)
+    parser.add_argument('--unix', help='Listen on this Unix socket path instead of TCP')
+    parser.add_argument('--max-batch', type=int, default=MAX_BATCH, help='Most writes committed by one flush')
+    parser.add_argument('--read-threads', type=int, default=4, help='Threads serving SEARCH and RANGE')
+    parser.add_argument('--config', help='JSON configuration of the tree, as for main.py')
+    parser.add_argument('--cache-size', type=int, help='Node cache size, overrides the configuration')
+    parser.add_argument('--metrics-file', help='Periodically write latency histograms and counters to <path>.json and <path>.prom')
+    parser.add_argument('--metrics-interval', type=float, default=10.0, help='Seconds between two writes of --metrics-file')
+    args = parser.parse_args()
+
+    config = BTreeConfig.from_file(args.config) if args.config else BTreeConfig()
+    if args.cache_size is not None:
+        config.cache_size = args.cache_size
+    sys.stdout = stdout
+    tree = open_tree(args.base, config)
+    exporter = MetricsExporter(tree, args.metrics_file, args.metrics_interval).start() if args.metrics_file else None
+    asyncio.run(serve(tree, args))
+    stdout.start()
+    tree.flush_caches()
+    stdout.stop()
+    if exporter:
+        exporter.stop()
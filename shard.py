@@ -0,0 +1,414 @@
+import argparse
+import bisect
+import contextlib
+import io
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+import main
+from btree import (PROBABILITY_COLUMNS, BTree, BTreeConfig, load_int_list_from_file, save_int_list_to_file,
+                   tree_exists)
+from sketch import QuantileSketch
+
+# Range-partitioned B-tree spread over worker processes.
+#
+# The key space is cut into ranges by a sorted list of lower bounds. Shard i
+# owns the keys in [lowers[i], lowers[i + 1]) and is served by its own process
+# with its own tree files, <base>_shard<id>_*.dat, so the shards share no
+# caches, latches or file handles. The coordinator routes point commands by
+# key, fans RANGE out to the shards it overlaps and concatenates the answers,
+# which come back already in key order.
+#
+# The layout is kept in <base>_shards.dat as an int list:
+#   [next_shard_id, id_0, lower_0, id_1, lower_1, ...]
+
+KEY_MIN = -2 ** 31
+KEY_MAX = 2 ** 31 - 1
+
+KEYED_COMMANDS = {"INSERT", "DELETE", "UPDATE", "SEARCH"}
+# Commands sent to a worker in one message
+BATCH_SIZE = 1000
+
+
+def worker_loop(base_name, config, conn):
+    """
+    Serve one shard: run the requests received on conn against its own tree.
+
+    Requests:
+    - ("batch", lines, verbose): run commands; reply with the printed lines
+      of each (only the last one unless verbose).
+    - ("keys", lo, hi): reply with the keys in [lo, hi].
+    - ("records", lo, hi): reply with (key, p_a, p_b, p_aub) for the keys in [lo, hi].
+    - ("counters",): reply with the counters of the shard's tree.
+    - ("sketches",): reply with the quantile sketches of the shard's tree, as dicts.
+    - ("stop",): flush the caches and exit.
+    """
+    tree = BTree(config)
+    with contextlib.redirect_stdout(io.StringIO()):
+        if tree_exists(base_name):
+            tree.load(base_name)
+        else:
+            tree.create(base_name)
+
+    while True:
+        request = conn.recv()
+        op = request[0]
+        if op == "batch":
+            _, lines, verbose = request
+            replies = []
+            for line in lines:
+                out = io.StringIO()
+                with contextlib.redirect_stdout(out):
+                    try:
+                        main.execute_command(line, tree)
+                    except Exception as e:
+                        print(f"Error: {type(e).__name__}: {e}")
+                printed = [l for l in out.getvalue().splitlines() if l.strip()]
+                replies.append(printed if verbose else printed[-1:])
+            conn.send(replies)
+        elif op == "keys":
+            conn.send([k for k, _ in tree.range_search(request[1], request[2])])
+        elif op == "records":
+            records = []
+            for key, rid in tree.range_search(request[1], request[2]):
+                r = tree.read_record(key, rid)
+                if r is not None:
+                    records.append((r.key, r.p_a, r.p_b, r.p_aub))
+            conn.send(records)
+        elif op == "counters":
+            conn.send(tree.counter_values())
+        elif op == "sketches":
+            conn.send({column: sketch.to_dict() for column, sketch in tree.sketches.items()})
+        elif op == "stop":
+            with contextlib.redirect_stdout(io.StringIO()):
+                tree.flush_caches()
+            conn.send("stopped")
+            return
+
+
+class Shard:
+    def __init__(self, shard_id, base_name, config):
+        self.shard_id = shard_id
+        self.base_name = f"{base_name}_shard{shard_id}"
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=worker_loop, args=(self.base_name, config, child_conn),
+                                               daemon=True)
+        self.process.start()
+        # Commands routed here since the last rebalance
+        self.ops = 0
+
+    def request(self, *request):
+        self.conn.send(request)
+        return self.conn.recv()
+
+    def stop(self):
+        self.request("stop")
+        self.process.join()
+
+
+class ShardCoordinator:
+    """
+    Route commands to the shard owning their key.
+
+    Parameters:
+    - base_name (str): Base name of the sharded tree.
+    - num_shards (int): Number of shards created when no layout file exists.
+    - key_min, key_max (int): Key range split evenly between the new shards.
+    - config (BTreeConfig): Configuration of the tree of every worker.
+    """
+
+    def __init__(self, base_name, num_shards=4, key_min=1, key_max=10000, config=None):
+        self.base_name = base_name
+        self.config = config if config is not None else BTreeConfig()
+        self.layout_file = f"{base_name}_shards.dat"
+        self.key_min = key_min
+        self.key_max = key_max
+        layout = load_int_list_from_file(self.layout_file)
+        if layout:
+            self.next_id = layout[0]
+            ids = layout[1::2]
+            self.lowers = layout[2::2]
+        else:
+            step = (key_max - key_min + 1) / num_shards
+            ids = list(range(num_shards))
+            self.lowers = [KEY_MIN] + [key_min + round(i * step) for i in range(1, num_shards)]
+            self.next_id = num_shards
+        self.shards = [Shard(i, base_name, self.config) for i in ids]
+        self.save_layout()
+
+    def save_layout(self):
+        layout = [self.next_id]
+        for shard, lower in zip(self.shards, self.lowers):
+            layout += [shard.shard_id, lower]
+        save_int_list_to_file(self.layout_file, layout)
+
+    def shard_index(self, key):
+        return bisect.bisect_right(self.lowers, key) - 1
+
+    def upper(self, index):
+        # Last key owned by shard index
+        return self.lowers[index + 1] - 1 if index + 1 < len(self.lowers) else KEY_MAX
+
+    def route(self, line):
+        """
+        Return the index of the shard owning the key of a keyed command, else None.
+        """
+        tokens = line.split()
+        if len(tokens) < 2 or tokens[0].upper() not in KEYED_COMMANDS:
+            return None
+        try:
+            return self.shard_index(int(tokens[1]))
+        except ValueError:
+            return None
+
+    def execute_many(self, lines, verbose=False):
+        """
+        Run keyed commands with every shard working at the same time.
+
+        Each shard receives its commands in their original order, so commands
+        on the same key keep their order. The replies come back aligned with lines.
+        """
+        replies = [None] * len(lines)
+        for chunk_start in range(0, len(lines), BATCH_SIZE * len(self.shards)):
+            batches = {}
+            for i in range(chunk_start, min(chunk_start + BATCH_SIZE * len(self.shards), len(lines))):
+                index = self.route(lines[i])
+                if index is None:
+                    replies[i] = [f"Cannot route '{lines[i]}': expected a command followed by an integer key."]
+                    continue
+                batches.setdefault(index, []).append(i)
+            # Send every batch before waiting for any, the shards run in parallel
+            for index, positions in batches.items():
+                self.shards[index].conn.send(("batch", [lines[i] for i in positions], verbose))
+                self.shards[index].ops += len(positions)
+            for index, positions in batches.items():
+                for i, reply in zip(positions, self.shards[index].conn.recv()):
+                    replies[i] = reply
+        return replies
+
+    def broadcast(self, *request):
+        for shard in self.shards:
+            shard.conn.send(request)
+        return [shard.conn.recv() for shard in self.shards]
+
+    def range_records(self, lo, hi):
+        first = max(self.shard_index(lo), 0)
+        last = self.shard_index(hi)
+        involved = range(first, last + 1)
+        for index in involved:
+            self.shards[index].conn.send(("records", max(lo, self.lowers[index]), min(hi, self.upper(index))))
+            self.shards[index].ops += 1
+        records = []
+        # Shards are ordered by key range, so concatenating keeps key order
+        for index in involved:
+            records += self.shards[index].conn.recv()
+        return records
+
+    def rebalance(self):
+        """
+        Split the shard that received the most commands since the last rebalance.
+
+        The upper half of its keys moves to a new shard. The records are copied
+        and the layout saved before they are deleted from the old shard, so an
+        interruption leaves duplicates rather than lost records.
+        """
+        index = max(range(len(self.shards)), key=lambda i: self.shards[i].ops)
+        hot = self.shards[index]
+        keys = hot.request("keys", self.lowers[index], self.upper(index))
+        if len(keys) < 2:
+            print(f"Shard {hot.shard_id} holds {len(keys)} keys; nothing to split.")
+            return
+        split_key = keys[len(keys) // 2]
+        moved = hot.request("records", split_key, self.upper(index))
+
+        new_shard = Shard(self.next_id, self.base_name, self.config)
+        self.next_id += 1
+        new_shard.request("batch", [f"INSERT {k} {a} {b} {aub}" for k, a, b, aub in moved], False)
+        self.shards.insert(index + 1, new_shard)
+        self.lowers.insert(index + 1, split_key)
+        self.save_layout()
+        hot.request("batch", [f"DELETE {k}" for k, _, _, _ in moved], False)
+
+        for shard in self.shards:
+            shard.ops = 0
+        print(f"Split shard {hot.shard_id} at key {split_key}: moved {len(moved)} records to shard {new_shard.shard_id}.")
+
+    def print_layout(self):
+        counters = self.broadcast("counters")
+        for index, shard in enumerate(self.shards):
+            lower = "-inf" if self.lowers[index] == KEY_MIN else self.lowers[index]
+            upper = "+inf" if self.upper(index) == KEY_MAX else self.upper(index)
+            print(f"Shard {shard.shard_id}: keys [{lower}, {upper}], {shard.ops} commands since last rebalance, "
+                  f"{counters[index]['nodes_loaded_from_disk']} node reads, "
+                  f"{counters[index]['nodes_saved_to_disk']} node writes")
+
+    def stop(self):
+        for shard in self.shards:
+            shard.stop()
+        self.save_layout()
+
+    def execute_command(self, command_line):
+        tokens = command_line.strip().split()
+        if not tokens:
+            return
+        command = tokens[0].upper()
+
+        if command in KEYED_COMMANDS:
+            for line in self.execute_many([command_line], verbose=True)[0]:
+                print(line)
+
+        elif command == "RANGE":
+            if len(tokens) != 3:
+                print("Usage: RANGE <low_key> <high_key>")
+                return
+            try:
+                low = int(tokens[1])
+                high = int(tokens[2])
+            except ValueError:
+                print("Invalid keys. <low_key> and <high_key> must be integers.")
+                return
+            records = self.range_records(low, high)
+            for key, p_a, p_b, p_aub in records:
+                print(f"  Key={key}, P(A)={p_a}, P(B)={p_b}, P(A∪B)={p_aub}")
+            print(f"{len(records)} records in range [{low}, {high}].")
+
+        elif command == "ADDRANDOM":
+            if len(tokens) != 2:
+                print("Usage: ADDRANDOM <number_of_keys>")
+                return
+            try:
+                num_keys = int(tokens[1])
+            except ValueError:
+                print("Invalid number of keys. Please provide an integer.")
+                return
+            lines = [f"INSERT {random.randint(self.key_min, self.key_max)} "
+                     f"{round(random.uniform(0.0, 1.0), 4)} {round(random.uniform(0.0, 1.0), 4)} "
+                     f"{round(random.uniform(0.0, 1.0), 4)}" for _ in range(num_keys)]
+            results = self.execute_many(lines)
+            inserted = sum(1 for r in results if r == ["OK"])
+            print(f"Inserted {inserted} keys, Skipped {num_keys - inserted} duplicates.")
+
+        elif command in ("PRINT", "FLUSH"):
+            for shard, reply in zip(self.shards, self.broadcast("batch", [command], True)):
+                print(f"--- Shard {shard.shard_id} ---")
+                for line in reply[0]:
+                    print(line)
+
+        elif command == "QUANTILE":
+            if len(tokens) != 3 or tokens[1].lower() not in PROBABILITY_COLUMNS:
+                print(f"Usage: QUANTILE {'|'.join(PROBABILITY_COLUMNS)} <q>")
+                return
+            try:
+                q = float(tokens[2])
+            except ValueError:
+                print("Invalid quantile. <q> must be a float between 0 and 1.")
+                return
+            column = tokens[1].lower()
+            # Sketches merge, so the quantile over all shards needs no records
+            merged = QuantileSketch()
+            for sketches in self.broadcast("sketches"):
+                merged.merge(QuantileSketch.from_dict(sketches[column]))
+            main.print_quantile(merged, column, q)
+
+        elif command == "SHARDS":
+            self.print_layout()
+
+        elif command == "REBALANCE":
+            self.rebalance()
+
+        elif command == "HELP":
+            print("""
+Sharded commands:
+  INSERT, DELETE, UPDATE, SEARCH
+      As in main.py, sent to the shard owning the key.
+  RANGE <low_key> <high_key>
+      Records in the range, collected from every shard it overlaps.
+  ADDRANDOM <number_of_keys>
+      Insert random keys, all shards working in parallel.
+  QUANTILE p_a|p_b|p_aub <q>
+      Quantile over all shards, from their merged sketches.
+  PRINT | FLUSH
+      Run the command on every shard.
+  SHARDS
+      Show the key range and load of every shard.
+  REBALANCE
+      Split the busiest shard in two at its median key.
+  EXIT
+      Flush every shard and exit.
+""")
+        else:
+            print(f"Unknown command: {command}. Type 'HELP' for a list of commands.")
+
+
+def benchmark_inserts(num_keys, shard_counts, config, seed=1):
+    """
+    Measure INSERT throughput for each number of shards, in a temporary directory.
+    """
+    rng = random.Random(seed)
+    keys = rng.sample(range(1, num_keys * 10 + 1), num_keys)
+    lines = [f"INSERT {k} 0.5 0.5 0.75" for k in keys]
+    print(f"{'shards':>8} {'inserts/s':>12} {'speedup':>8}")
+    baseline = None
+    for count in shard_counts:
+        # The tree files are named by path, so the working directory of the process is left alone
+        with tempfile.TemporaryDirectory(prefix="shard_bench_") as workdir:
+            coordinator = ShardCoordinator(os.path.join(workdir, "bench"), count, 1, num_keys * 10, config)
+            try:
+                start = time.perf_counter()
+                coordinator.execute_many(lines)
+                elapsed = time.perf_counter() - start
+            finally:
+                coordinator.stop()
+        throughput = num_keys / elapsed
+        baseline = baseline or throughput
+        print(f"{count:>8} {throughput:>12.1f} {throughput / baseline:>8.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Range-partitioned B-tree over worker processes")
+    parser.add_argument('--base', default="default", help='Base name of the sharded tree')
+    parser.add_argument('--shards', type=int, default=4, help='Number of shards for a new tree')
+    parser.add_argument('--key-min', type=int, default=1, help='Smallest key expected, used to place the shards')
+    parser.add_argument('--key-max', type=int, default=10000, help='Largest key expected, used to place the shards')
+    parser.add_argument('--config', help='JSON configuration of every shard, as for main.py')
+    parser.add_argument('--cache-size', type=int, help='Node cache size of every shard, overrides the configuration')
+    parser.add_argument('-t', '--testfile', type=str, help='Path to the test file containing commands')
+    parser.add_argument('--bench', type=int, metavar='NUM_KEYS',
+                        help='Measure insert throughput for --bench-shards shard counts and exit')
+    parser.add_argument('--bench-shards', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    config = BTreeConfig.from_file(args.config) if args.config else BTreeConfig()
+    if args.cache_size is not None:
+        config.cache_size = args.cache_size
+    if args.bench:
+        benchmark_inserts(args.bench, args.bench_shards, config)
+        sys.exit(0)
+
+    coordinator = ShardCoordinator(args.base, args.shards, args.key_min, args.key_max, config)
+    print(f"Sharded B-tree '{args.base}' with {len(coordinator.shards)} shards.")
+    try:
+        if args.testfile:
+            with open(args.testfile, 'r') as tf:
+                for line in tf:
+                    stripped_line = line.strip()
+                    if not stripped_line or stripped_line.startswith('#'):
+                        continue
+                    if stripped_line.upper() == "EXIT":
+                        break
+                    print(f">>> {stripped_line}")
+                    coordinator.execute_command(stripped_line)
+        else:
+            while True:
+                command_line = input("shards> ")
+                if command_line.strip().upper() == "EXIT":
+                    break
+                coordinator.execute_command(command_line)
+    except (EOFError, KeyboardInterrupt):
+        print("\nExiting interactive mode.")
+    finally:
+        coordinator.stop()
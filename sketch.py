@@ -0,0 +1,220 @@
+import argparse
+import bisect
+import json
+import math
+import os
+import random
+import threading
+
+# Mergeable quantile sketches of the probability columns.
+#
+# A KLL sketch keeps a few hundred of the values it was given, in levels:
+# a value at level h stands for 2^h values. When a level fills up it is
+# sorted and every other value moves up a level (which half is random), so
+# the sketch stays small while the rank of any value is off by about 1.7/k
+# of the values inserted, whatever their number. Two sketches merge by
+# concatenating their levels and compacting again.
+#
+# KLL cannot forget a value, so a QuantileSketch keeps the deleted values in
+# a second KLL sketch and ranks by the difference of the two. The error is
+# then relative to all insertions and deletions since the sketch was built;
+# LOAD rebuilds the sketches from the data file, which drops the deletions.
+
+DEFAULT_K = 200
+# Each level holds LEVEL_DECAY times the values of the level above it
+LEVEL_DECAY = 2 / 3
+
+
+class KLLSketch:
+    """
+    Parameters:
+    - k (int): Capacity of the top level; larger is more accurate and bigger.
+    """
+
+    def __init__(self, k=DEFAULT_K):
+        self.k = k
+        self.levels = []
+        self.count = 0  # values given to the sketch, i.e. total weight
+        self.size = 0  # values kept
+        self.max_size = 0
+        self.rng = random.Random()
+        self.grow()
+
+    def grow(self):
+        self.levels.append([])
+        self.max_size = sum(self.capacity(h) for h in range(len(self.levels)))
+
+    def capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return int(math.ceil(self.k * LEVEL_DECAY ** depth)) + 1
+
+    def update(self, value):
+        self.levels[0].append(value)
+        self.count += 1
+        self.size += 1
+        if self.size >= self.max_size:
+            self.compress()
+
+    def compress(self):
+        for h in range(len(self.levels)):
+            if len(self.levels[h]) >= self.capacity(h):
+                if h + 1 >= len(self.levels):
+                    self.grow()
+                self.levels[h + 1].extend(self.compact(h))
+                self.size = sum(len(level) for level in self.levels)
+                if self.size < self.max_size:
+                    break
+
+    def compact(self, level):
+        """
+        Sort a level and return every other value from a random offset; an odd
+        value out, the smallest, stays at its level.
+        """
+        values = sorted(self.levels[level])
+        rest = len(values) % 2
+        self.levels[level] = values[:rest]
+        return values[rest + self.rng.randint(0, 1)::2]
+
+    def merge(self, other):
+        while len(self.levels) < len(other.levels):
+            self.grow()
+        for h, level in enumerate(other.levels):
+            self.levels[h].extend(level)
+        self.count += other.count
+        self.size = sum(len(level) for level in self.levels)
+        while self.size >= self.max_size:
+            self.compress()
+
+    def weighted_values(self):
+        return [(value, 1 << h) for h, level in enumerate(self.levels) for value in level]
+
+    def to_dict(self):
+        return {"k": self.k, "count": self.count, "levels": self.levels}
+
+    @staticmethod
+    def from_dict(values):
+        sketch = KLLSketch(values["k"])
+        for _ in range(len(values["levels"]) - 1):
+            sketch.grow()
+        sketch.levels = [list(level) for level in values["levels"]]
+        sketch.count = values["count"]
+        sketch.size = sum(len(level) for level in sketch.levels)
+        return sketch
+
+
+class QuantileSketch:
+    """
+    Quantiles of a multiset of values that supports insertions and deletions.
+
+    Queries bisect a cumulative rank table that is rebuilt, in O(k log k), by
+    the first query after a change; further queries do not touch the sketch.
+    """
+
+    def __init__(self, k=DEFAULT_K):
+        self.inserts = KLLSketch(k)
+        self.deletes = KLLSketch(k)
+        self.lock = threading.Lock()
+        self.table = None  # (values, cumulative weights), None when stale
+
+    def add(self, value):
+        with self.lock:
+            self.inserts.update(value)
+            self.table = None
+
+    def add_all(self, values):
+        with self.lock:
+            for value in values:
+                self.inserts.update(value)
+            self.table = None
+
+    def remove(self, value):
+        with self.lock:
+            self.deletes.update(value)
+            self.table = None
+
+    @property
+    def count(self):
+        return self.inserts.count - self.deletes.count
+
+    def merge(self, other):
+        """
+        Add the values of another sketch, e.g. of another shard, to this one.
+        """
+        with self.lock:
+            self.inserts.merge(other.inserts)
+            self.deletes.merge(other.deletes)
+            self.table = None
+
+    def rank_table(self):
+        with self.lock:
+            if self.table is None:
+                weighted = self.inserts.weighted_values() + [(v, -w) for v, w in self.deletes.weighted_values()]
+                weighted.sort()
+                values, cumulative = [], []
+                total = 0
+                for value, weight in weighted:
+                    total += weight
+                    values.append(value)
+                    # Deletions are approximate too, so the difference can dip;
+                    # a running maximum keeps the table sorted for bisection
+                    cumulative.append(max(total, cumulative[-1]) if cumulative else total)
+                self.table = (values, cumulative)
+            return self.table
+
+    def quantile(self, q):
+        """
+        Returns:
+        - float: The smallest value with at least a q share of the values at or
+          below it, or None if the sketch is empty.
+        """
+        count = self.count
+        if count <= 0:
+            return None
+        values, cumulative = self.rank_table()
+        i = bisect.bisect_left(cumulative, max(1, q * count))
+        return values[min(i, len(values) - 1)]
+
+    def to_dict(self):
+        with self.lock:
+            return {"inserts": self.inserts.to_dict(), "deletes": self.deletes.to_dict()}
+
+    @staticmethod
+    def from_dict(values):
+        sketch = QuantileSketch()
+        sketch.inserts = KLLSketch.from_dict(values["inserts"])
+        sketch.deletes = KLLSketch.from_dict(values["deletes"])
+        return sketch
+
+
+def save_sketches(path, sketches):
+    """
+    Write a {column: QuantileSketch} dict to a JSON file.
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({column: sketch.to_dict() for column, sketch in sketches.items()}, f)
+    os.replace(tmp_path, path)
+
+
+def load_sketches(path):
+    with open(path) as f:
+        return {column: QuantileSketch.from_dict(values) for column, values in json.load(f).items()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge the quantile sketches of several trees and query them")
+    parser.add_argument('files', nargs='+', help='<base_name>_sketch.json files, written on FLUSH and EXIT')
+    parser.add_argument('--q', type=float, nargs='+', default=[0.5, 0.9, 0.99], help='Quantiles to print')
+    args = parser.parse_args()
+
+    merged = {}
+    for path in args.files:
+        for column, sketch in load_sketches(path).items():
+            if column in merged:
+                merged[column].merge(sketch)
+            else:
+                merged[column] = sketch
+    for column, sketch in merged.items():
+        quantiles = " ".join(f"q{q:g}={sketch.quantile(q):.4f}" if sketch.count > 0 else f"q{q:g}=n/a"
+                             for q in args.q)
+        print(f"{column}: {sketch.count} values, {quantiles}")
@@ -0,0 +1,127 @@
+import argparse
+import csv
+import itertools
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+# Parameter sweep over main.py. Every run is a separate main.py process in its
+# own temporary directory, reporting through --metrics-json; --jobs runs are
+# in flight at a time. Repeats of a configuration use different seeds and are
+# aggregated into a mean and a 95% confidence interval.
+
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+
+GRID_PARAMETERS = ["d", "cache_size", "page_cache_size", "page_size", "records"]
+METRICS = ["time_s", "nodes_saved_to_disk", "nodes_loaded_from_disk", "nodes_loaded_from_cache",
+           "pages_saved_to_disk", "pages_loaded_from_disk", "pages_loaded_from_cache",
+           "metadata_loaded", "metadata_saved"]
+
+# Two-sided 95% Student t critical values by degrees of freedom
+T_95 = {1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447, 7: 2.365, 8: 2.306, 9: 2.262,
+        10: 2.228, 12: 2.179, 15: 2.131, 20: 2.086, 25: 2.060, 30: 2.042}
+
+
+def t_critical(df):
+    for known in sorted(T_95):
+        if df <= known:
+            return T_95[known]
+    return 1.96
+
+
+def default_commands(records):
+    return ["CREATE sweep", f"ADDRANDOM {records}", "FLUSH"]
+
+
+def run_one(config, seed, commands):
+    """
+    Run main.py once for a configuration and return its metrics JSON.
+    """
+    with tempfile.TemporaryDirectory(prefix="sweep_") as workdir:
+        testfile = os.path.join(workdir, "commands.txt")
+        with open(testfile, "w") as f:
+            f.write("\n".join(commands or default_commands(config["records"])) + "\n")
+        metrics_file = os.path.join(workdir, "metrics.json")
+        subprocess.run([sys.executable, MAIN, "--testfile", testfile, "--metrics-json", metrics_file,
+                        "--d", str(config["d"]), "--cache-size", str(config["cache_size"]),
+                        "--page-cache-size", str(config["page_cache_size"]),
+                        "--page-size", str(config["page_size"]), "--seed", str(seed)],
+                       cwd=workdir, stdout=subprocess.DEVNULL, check=True)
+        with open(metrics_file) as f:
+            return json.load(f)
+
+
+def summarize(values):
+    n = len(values)
+    mean = sum(values) / n
+    std = math.sqrt(sum((v - mean) ** 2 for v in values) / (n - 1)) if n > 1 else 0.0
+    ci95 = t_critical(n - 1) * std / math.sqrt(n) if n > 1 else 0.0
+    return {"mean": mean, "std": std, "ci95": ci95}
+
+
+def sweep(grid, repeats, seed, jobs, commands=None):
+    """
+    Run every configuration of the grid repeats times.
+
+    Parameters:
+    - grid (dict): Parameter name -> list of values, for the GRID_PARAMETERS.
+    - repeats (int): Runs per configuration, seeded seed, seed + 1, ...
+    - jobs (int): Runs in flight at a time.
+    - commands (list): Commands to run instead of CREATE / ADDRANDOM records / FLUSH.
+
+    Returns:
+    - list: One dict per configuration with its parameters, runs and metric summaries.
+    """
+    configs = [dict(zip(GRID_PARAMETERS, values)) for values in itertools.product(*(grid[p] for p in GRID_PARAMETERS))]
+    runs = [(config, seed + r) for config in configs for r in range(repeats)]
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        outputs = list(pool.map(lambda run: run_one(run[0], run[1], commands), runs))
+
+    results = []
+    for i, config in enumerate(configs):
+        config_outputs = outputs[i * repeats:(i + 1) * repeats]
+        values = {metric: [out["time_s"] if metric == "time_s" else out["counters"][metric] for out in config_outputs]
+                  for metric in METRICS}
+        results.append({**config, "runs": repeats,
+                        "metrics": {metric: summarize(v) for metric, v in values.items()}})
+    return results
+
+
+def write_results(results, output):
+    with open(f"{output}.json", "w") as f:
+        json.dump(results, f, indent=2)
+    with open(f"{output}.csv", "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(GRID_PARAMETERS + ["runs"] + [f"{m}_{s}" for m in METRICS for s in ("mean", "ci95")])
+        for r in results:
+            writer.writerow([r[p] for p in GRID_PARAMETERS] + [r["runs"]] +
+                            [round(r["metrics"][m][s], 6) for m in METRICS for s in ("mean", "ci95")])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run main.py over a grid of configurations in parallel")
+    parser.add_argument('--d', type=int, nargs='+', default=[2])
+    parser.add_argument('--cache-size', type=int, nargs='+', default=[0])
+    parser.add_argument('--page-cache-size', type=int, nargs='+', default=[10])
+    parser.add_argument('--page-size', type=int, nargs='+', default=[256])
+    parser.add_argument('--records', type=int, nargs='+', default=[1000], help='Keys added by ADDRANDOM')
+    parser.add_argument('--repeats', type=int, default=10, help='Runs per configuration')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the first repeat')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='Runs in flight at a time')
+    parser.add_argument('--commands', help='Command file run instead of CREATE / ADDRANDOM <records> / FLUSH')
+    parser.add_argument('--output', default="sweep_results", help='Output path without extension (.csv and .json)')
+    args = parser.parse_args()
+
+    commands = None
+    if args.commands:
+        with open(args.commands) as f:
+            commands = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+    grid = {"d": args.d, "cache_size": args.cache_size, "page_cache_size": args.page_cache_size,
+            "page_size": args.page_size, "records": args.records}
+    results = sweep(grid, args.repeats, args.seed, args.jobs, commands)
+    write_results(results, args.output)
+    print(f"{len(results)} configurations x {args.repeats} runs written to {args.output}.csv and {args.output}.json.")
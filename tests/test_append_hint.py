@@ -0,0 +1,83 @@
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+from btree import BTree, BTreeConfig
+
+
+class AppendHintTest(unittest.TestCase):
+    """
+    Ascending appends take the sequential-insert fast path while other threads
+    insert between the existing keys; the hints must never fall behind a key
+    already in the tree.
+    """
+
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory(prefix="test_append_hint_")
+        self.base_name = os.path.join(self.workdir.name, "t")
+        self.tree = BTree(BTreeConfig(d=2))
+        # Switch threads often so the hint updates interleave
+        self.switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+
+    def tearDown(self):
+        sys.setswitchinterval(self.switch_interval)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.tree.close()
+        self.workdir.cleanup()
+
+    def run_command(self, command):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            main.execute_command(command, self.tree)
+        return out.getvalue()
+
+    def test_appends_mixed_with_interior_inserts(self):
+        self.run_command(f"CREATE {self.base_name}")
+        # Even keys seed the tree, odd keys below it are filled in meanwhile. The
+        # appending threads overlap, so each appended key must be inserted once.
+        seeded = range(2, 401, 2)
+        appended = range(1000, 2000)
+        interior = [range(1 + 2 * t, 400, 8) for t in range(4)]
+        results = {}
+        errors = []
+
+        def insert_all(keys):
+            try:
+                for key in keys:
+                    result = self.tree.insert_key(key, (0.1, 0.2, 0.3))
+                    results.setdefault(key, []).append(result)
+            except Exception as e:
+                errors.append(e)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            for key in seeded:
+                self.tree.insert_key(key, (0.1, 0.2, 0.3))
+            threads = [threading.Thread(target=insert_all, args=(keys,)) for keys in [appended] * 4 + interior]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(errors, [])
+        for key in appended:
+            self.assertEqual(sorted(results[key]), ['ALREADY EXISTS!'] * 3 + ['OK'], key)
+        for keys in interior:
+            for key in keys:
+                self.assertEqual(results[key], ['OK'], key)
+        expected = set(seeded).union(appended, *interior)
+        scanned = [key for node in self.tree.collect_nodes() for key, _ in node["keys"]]
+        self.assertEqual(len(scanned), len(expected))
+        self.assertEqual(set(scanned), expected)
+        self.assertIn("0 errors", self.run_command("VERIFY"))
+
+
+if __name__ == "__main__":
+    unittest.main()
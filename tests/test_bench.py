@@ -0,0 +1,27 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.runner import run_workload
+from bench.workloads import WORKLOADS
+
+
+class TinyWorkloadTest(unittest.TestCase):
+    """
+    Every workload must run with a handful of operations, where the key space
+    is smaller than the default range width.
+    """
+
+    def test_every_workload_with_few_ops(self):
+        for name in WORKLOADS:
+            for ops in (1, 5, 19):
+                with self.subTest(workload=name, ops=ops):
+                    result = run_workload(name, ops=ops)
+                    self.assertEqual(result["workload"], name)
+                    self.assertGreater(result["ops"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
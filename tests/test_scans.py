@@ -0,0 +1,59 @@
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+from btree import BTree, BTreeConfig
+
+
+class WholeFileScanTest(unittest.TestCase):
+    """
+    Whole-tree scans (VISUALIZE, VERIFY, Bloom filter growth) must see the live
+    nodes, not the copies a snapshot keeps of their old versions.
+    """
+
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory(prefix="test_scans_")
+        self.base_name = os.path.join(self.workdir.name, "t")
+        self.tree = BTree(BTreeConfig(d=2))
+
+    def tearDown(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.tree.drop_snapshots()
+            self.tree.close()
+        self.workdir.cleanup()
+
+    def run_command(self, command):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            main.execute_command(command, self.tree)
+        return out.getvalue()
+
+    def test_snapshot_copies_do_not_shadow_live_nodes(self):
+        self.run_command(f"CREATE {self.base_name}")
+        with contextlib.redirect_stdout(io.StringIO()):
+            for key in range(1, 201):
+                self.tree.insert_key(key, (0.1, 0.2, 0.3))
+        self.run_command("FLUSH")
+        self.run_command("SNAPSHOT")
+        deleted = set(range(1, 201, 3))
+        with contextlib.redirect_stdout(io.StringIO()):
+            for key in sorted(deleted):
+                self.assertEqual(self.tree.delete_key(key), 'OK')
+        self.run_command("FLUSH")
+
+        scanned = {key for node in self.tree.collect_nodes() for key, _ in node["keys"]}
+        self.assertEqual(scanned, set(range(1, 201)) - deleted)
+        self.assertIn("0 errors", self.run_command("VERIFY"))
+        printed = self.run_command("PRINT")
+        for key in deleted:
+            self.assertNotIn(f"Key={key},", printed)
+
+
+if __name__ == "__main__":
+    unittest.main()